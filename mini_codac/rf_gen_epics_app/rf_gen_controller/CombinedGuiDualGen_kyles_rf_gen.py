@@ -38,6 +38,10 @@ import csv
 import struct
 from pymodbus.client import ModbusTcpClient
 
+#shared memory board of the pressures and temperatures (telemetry_shm.py), so
+#other processes on this host can read them
+from telemetry_shm import env_board
+
 #pressure controller class
 class PressureController:
     def __init__(self, port='COM3', baudrate=115200, timeout=1):
@@ -360,6 +364,7 @@ class PressureControllerApp:
         #define control objects and read threads
         self.fyra = None
         self.comet = None
+        self.env_board = None
         
         self.running = None
         self.data_listener_thread = None
@@ -767,6 +772,13 @@ class PressureControllerApp:
             self.suspended=Event()
 
             ##############
+            #the board is optional, the gui works without it
+            if self.env_board is None:
+                try:
+                    self.env_board = env_board(create=True)
+                except Exception as e:
+                    print(f"Failed to create the environment board: {e}")
+
             self.data_listener_thread = Thread(target=self.read_continuous_data, daemon=True)
             self.data_listener_thread.start()
         except Exception as e:
@@ -818,6 +830,9 @@ class PressureControllerApp:
             self.data_listener_thread.join()
         if self.running is not None:    
             self.running.clear()
+        if self.env_board is not None:
+            self.env_board.close()
+            self.env_board = None
         self.disable = True
 
     #simple variable to set log plot off
@@ -922,6 +937,11 @@ class PressureControllerApp:
             TC3 = ul.t_in(self.mcc_board_num, 2, TempScale.CELSIUS)
             TC4 = ul.t_in(self.mcc_board_num, 3, TempScale.CELSIUS)
             
+            #publish the pressures and temperatures
+            if self.env_board is not None:
+                self.env_board.write({'VAC1': pressure_1, 'VAC2': pressure_2,
+                                      'TC1': TC1, 'TC2': TC2, 'TC3': TC3, 'TC4': TC4})
+            
             #get all the rf generator data
            
             # Read the state (command 8000)
@@ -1440,6 +1460,9 @@ class PressureControllerApp:
             self.data_listener_thread.join()
         if self.running is not None:    
             self.running.clear()
+        if self.env_board is not None:
+            self.env_board.close()
+            self.env_board = None
         self.root.destroy()
         
 #start the gui
@@ -0,0 +1,268 @@
+# Admission control for the lines received on a single client connection.
+# Lines are queued by the thread reading the socket and executed, in order, by
+# a second thread. The queue is bounded, and when it is full new lines are
+# either answered with BUSY right away (POLICY_BUSY), or the oldest queued
+# query is answered with BUSY to make room for the new line (POLICY_SHED).
+# A rejected line keeps its place in the queue, so responses are always sent
+# back in the order the queries were received. Consecutive rejected lines share
+# one entry that counts the BUSY replies still owed, so a client flooding the
+# server cannot grow the queue beyond about twice its depth.
+#
+# Writes get no response. A write that is rejected, or that fails, is reported
+# by the next PING? of the client instead (see take_write_error), which is the
+# command a client sends to know that its writes have been executed.
+
+import collections
+import threading
+import time
+
+from dispatch_queue import POLICY_BUSY, POLICY_SHED
+
+BUSY_RESP = 'BUSY'
+
+class Conn_Queue():
+    """
+    Bounded queue of the lines received on one client connection.
+    """
+
+    def __init__(self, max_depth: int, policy: str=POLICY_BUSY):
+        """
+        Initializes the Conn_Queue class.
+
+        Inputs:
+            max_depth (int)           - Maximum number of lines waiting to be
+                                        executed
+            policy    (optional, str) - Either POLICY_BUSY or POLICY_SHED
+        """
+        self._cond      = threading.Condition()
+        # [line, rejected, time queued, BUSY replies owed, writes rejected]
+        self._items     = collections.deque()
+        self._closed    = False
+        self._max_depth = max_depth
+        self._policy    = policy
+
+        self.num_pending  = 0 # Queued lines that will be executed
+        self.num_rejected = 0
+        self.num_shed     = 0
+
+        self._write_error = None # Reported by the next PING?, see
+                                 # take_write_error
+
+        return
+
+    def put(self, line: str, force: bool=False) -> bool:
+        """
+        Queues a line received from the client.
+
+        Inputs:
+            line  (str)            - Line received from the client
+            force (optional, bool) - Always admit the line (safety commands)
+
+        Returns:
+            False if the line was rejected. A rejected query is still queued,
+            so that BUSY is sent back in order, a rejected write is not
+            executed and is reported by the next PING?.
+        """
+        is_write = (line.find('$') >= 0)
+
+        with self._cond:
+            admit = (force or (self.num_pending < self._max_depth))
+            if ((not admit) and (self._policy == POLICY_SHED)):
+                admit = self._shed_oldest()
+
+            if (admit):
+                self.num_pending += 1
+                self._items.append([line, False, time.monotonic(), 0, 0])
+            else:
+                self.num_rejected += 1
+                if ((not self._items) or (not self._items[-1][1])):
+                    self._items.append([line, True, time.monotonic(), 0, 0])
+                item = self._items[-1]
+                item[0] = line # The last one, i.e. the PING? after writes
+                if (is_write):
+                    item[4] += 1
+                else:
+                    item[3] += 1
+
+            self._cond.notify()
+
+        return admit
+
+    def _shed_oldest(self) -> bool:
+        """
+        Marks the oldest queued query as rejected. Must be called with the
+        condition held.
+
+        Returns:
+            True if a query was shed
+        """
+        for item in self._items:
+            if ((not item[1]) and (item[0].find('$') < 0)):
+                item[1] = True
+                item[3] = 1
+                self.num_pending -= 1
+                self.num_shed += 1
+                return True
+
+        return False
+
+    def get(self) -> tuple:
+        """
+        Waits for the next line.
+
+        Inputs:
+            None
+
+        Returns:
+            (line, rejected, time.monotonic() at which the line was queued),
+            or None once the queue is closed and empty. A rejected line is to
+            be answered with BUSY.
+        """
+        with self._cond:
+            while True:
+                while ((len(self._items) == 0) and (not self._closed)):
+                    self._cond.wait()
+
+                if (len(self._items) == 0):
+                    return None
+
+                item = self._items[0]
+                if (not item[1]):
+                    self._items.popleft()
+                    self.num_pending -= 1
+                    return (item[0], False, item[2])
+
+                if (item[4] > 0):
+                    self._write_error = BUSY_RESP
+                    item[4] = 0
+
+                if (item[3] > 0):
+                    item[3] -= 1
+                    if (item[3] == 0):
+                        self._items.popleft()
+                    return (item[0], True, item[2])
+
+                # Only rejected writes
+                self._items.popleft()
+
+    def set_write_error(self, error: str):
+        """
+        Records that a write of the client failed. Called by the thread that
+        executes the lines.
+
+        Inputs:
+            error (str) - Response to the next PING? (i.e. BUSY)
+        """
+        with self._cond:
+            self._write_error = error
+
+        return
+
+    def take_write_error(self) -> str:
+        """
+        Returns, and clears, the error of the writes since the last call. The
+        response to PING? if it is not None.
+
+        Inputs:
+            None
+        """
+        with self._cond:
+            error = self._write_error
+            self._write_error = None
+
+        return error
+
+    def close(self):
+        """
+        Closes the queue. Lines already queued are still returned by get.
+
+        Inputs:
+            None
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        return
+
+    def depth(self) -> int:
+        """
+        Returns the number of lines waiting in the queue, counting every BUSY
+        reply that is owed.
+
+        Inputs:
+            None
+        """
+        with self._cond:
+            return sum(1 if (not item[1]) else item[3] for item in self._items)
+
+class Conn_Registry():
+    """
+    Keeps track of the queues of all connected clients.
+    """
+
+    def __init__(self):
+        """
+        Initializes the Conn_Registry class.
+
+        Inputs:
+            None
+        """
+        self._lock   = threading.Lock()
+        self._queues = set()
+
+        # Counters of connections that have already been closed
+        self._closed_rejected = 0
+        self._closed_shed     = 0
+
+        return
+
+    def add(self, cqueue: Conn_Queue):
+        """
+        Registers the queue of a newly connected client.
+
+        Inputs:
+            cqueue (Conn_Queue) - Queue of the client
+        """
+        with self._lock:
+            self._queues.add(cqueue)
+
+        return
+
+    def remove(self, cqueue: Conn_Queue):
+        """
+        Unregisters the queue of a client that disconnected.
+
+        Inputs:
+            cqueue (Conn_Queue) - Queue of the client
+        """
+        with self._lock:
+            self._queues.discard(cqueue)
+            self._closed_rejected += cqueue.num_rejected
+            self._closed_shed     += cqueue.num_shed
+
+        return
+
+    def stats(self) -> dict:
+        """
+        Returns the connection queue statistics.
+
+        Inputs:
+            None
+
+        Returns:
+            dict - {"clients", "depth", "max_depth", "rejected", "shed"}, where
+                   depth is the total over all clients, and max_depth the
+                   deepest single client queue
+        """
+        with self._lock:
+            depths = [cqueue.depth() for cqueue in self._queues]
+            stats = {"clients": len(self._queues),
+                     "depth": sum(depths),
+                     "max_depth": max(depths) if (depths) else 0,
+                     "rejected": self._closed_rejected +
+                                 sum(cq.num_rejected for cq in self._queues),
+                     "shed": self._closed_shed +
+                             sum(cq.num_shed for cq in self._queues)}
+
+        return stats
@@ -3,51 +3,145 @@
 # key-value pair to the lookup dict (self._lookup). Where the key is the command
 # and the value is the function that executes the command.
 
+import random
 import socket
+import time
 
-from numpy.random      import randint
+from functools         import partial
+
+from admission         import BUSY_RESP, Conn_Registry
+from dispatch_queue    import (Busy, Dispatch_Queue, OPERATOR, POLL, READ,
+                               SAFETY)
+from macros            import Macro_Runner
+from metrics           import Metrics
+from parameters        import MAX_QUEUE_DEPTH, OVERLOAD_POLICY, SCAN_CLASSES
 from psi_message       import Psi_Message
+from single_flight     import Single_Flight
 from rf_gen_controller import (get_control_source, get_forward_power, get_ip,
                                get_load_cap, get_match_mode, get_phase,
                                get_power, get_reflected_power, get_state,
-                               get_tune_cap, set_power)
-                               
+                               get_tune_cap, read_params, rf_off, rf_on,
+                               set_load_cap, set_match_mode, set_power,
+                               set_tune_cap)
+
+# Integer reads that can be pipelined (see read_pipelined). Command -> CMDS key
+PIPELINED = {'GETPOWER?': 'power_set_point', 'GETSTATE?': 'state',
+             'GETCTRLSRC?': 'ctrl_src', 'GETFWDPWR?': 'fwd_pwr',
+             'GETRFLPWR?': 'rfl_pwr', 'GETMATCHMODE?': 'match_mode',
+             'GETLDCAP?': 'read_load_cap', 'GETTNCAP?': 'read_tune_cap',
+             'GETPHASE?': 'phase_shift'}
+
+def _arg_error(cmd: str, value) -> str:
+    """
+    Returns the response of a write whose argument is not valid. Writes have
+    no response, the next PING? reports it (see tcp_server.py).
+    """
+    return f'Error: "{cmd} {value}" invalid argument'
 
 class Cmd_Lookup():
     """
     Lookup table.
     """
 
-    def __init__(self):
+    def __init__(self, max_depth: int=None, policy: str=None,
+                 ipaddr: str=None, port: int=None, conns: Conn_Registry=None,
+                 metrics: Metrics=None):
         """
-        Initializes the Cmd_Lookup class.
+        Initializes the Cmd_Lookup class. Each instance talks to a single RF
+        generator.
 
         Inputs:
-            None
+            max_depth (optional, int) - Maximum number of requests waiting for
+                                        the generator. Defaults to
+                                        MAX_QUEUE_DEPTH in parameters.py
+            policy    (optional, str) - Overload policy ("busy" or "shed").
+                                        Defaults to OVERLOAD_POLICY in
+                                        parameters.py
+            ipaddr    (optional, str) - IP address of the generator. Defaults
+                                        to DEFAULT_IP_ADDR in parameters.py
+            port      (optional, int) - Modbus port of the generator. Defaults
+                                        to DEFAULT_TCP_PORT in parameters.py
+            conns     (optional, Conn_Registry) - Registry of the client
+                                        queues, shared by the lookup tables of
+                                        all generators served by one driver
+            metrics   (optional, Metrics) - Metrics of the driver, shared by
+                                        the lookup tables of all generators
         """
-        self._addr   = None
+        if (max_depth == None): max_depth = MAX_QUEUE_DEPTH
+        if (policy == None): policy = OVERLOAD_POLICY
+
+        self._addr   = ipaddr
+        self._port   = port
         self._ipmode = None
 
+        # Concurrent reads of the same (device, command) share one request
+        self._flight = Single_Flight()
+
+        # Optional cache of the reads, see set_cache
+        self._cache      = None
+        self._t_write    = 0.0 # time.time() at which the last write finished
+        self._num_cached = 0
+
+        # Every command that talks to the generator goes through the dispatch
+        # queue, so that safety and operator writes are never stuck behind
+        # reads and polling
+        self._queue = Dispatch_Queue(max_depth=max_depth, policy=policy)
+
+        # Queues of the connected clients (filled in by tcp_server)
+        self.conns = conns
+        if (self.conns == None): self.conns = Conn_Registry()
+
+        # Metrics reported by METRICS? (filled in by tcp_server)
+        self.metrics = metrics
+        if (self.metrics == None): self.metrics = Metrics()
+
+        dev = (ipaddr, port) # Selects the generator in rf_gen_controller
         self._lookup = {
                 #                        'IPADDR?'  : self.get_ipaddr,
-                        'IPADDR?'  : get_ip,
+                        'IPADDR?'  : partial(get_ip, *dev),
                         'IPMODE?'  : self.get_ipmode,
                         'HOSTNAME?': self.get_hostname,
-                        'GETPOWER?' : get_power,
-                        'GETSTATE?' : get_state,
-                        'GETCTRLSRC?' : get_control_source,
-                        'GETFWDPWR?'  : get_forward_power,
-                        'GETRFLPWR?'  : get_reflected_power,
-                        'GETMATCHMODE?' : get_match_mode,
-                        'GETLDCAP?'     : get_load_cap,
-                        'GETTNCAP?'     : get_tune_cap,
-                        'GETPHASE?'     : get_phase,
-                        'SETPOWER$'     : self.power_set
+                        'GETPOWER?' : partial(get_power, *dev),
+                        'GETSTATE?' : partial(get_state, *dev),
+                        'GETCTRLSRC?' : partial(get_control_source, *dev),
+                        'GETFWDPWR?'  : partial(get_forward_power, *dev),
+                        'GETRFLPWR?'  : partial(get_reflected_power, *dev),
+                        'GETMATCHMODE?' : partial(get_match_mode, *dev),
+                        'GETLDCAP?'     : partial(get_load_cap, *dev),
+                        'GETTNCAP?'     : partial(get_tune_cap, *dev),
+                        'GETPHASE?'     : partial(get_phase, *dev),
+                        'GETQLATENCY?'  : self.get_queue_latency,
+                        'GETQDEPTH?'    : self.get_queue_depth,
+                        'METRICS?'      : self.get_metrics,
+                        'PING?'         : self.ping,
+                        'MACROSTAT?'    : self.get_macro_status,
+                        'MACRORESULT?'  : self.get_macro_result,
+                        'SETPOWER$'     : self.power_set,
+                        'SETRF$'        : self.rf_set,
+                        'SETMATCHMODE$' : self.match_mode_set,
+                        'SETLDCAP$'     : self.load_cap_set,
+                        'SETTNCAP$'     : self.tune_cap_set,
+                        'MACRO$'        : self.macro_start,
+                        'MACROABORT$'   : self.macro_abort
                        }
 
+        # Commands that are answered locally, without talking to the generator
+        self._local = {'IPMODE?', 'HOSTNAME?', 'GETQLATENCY?', 'GETQDEPTH?',
+                       'METRICS?', 'PING?', 'MACROSTAT?', 'MACRORESULT?', 'MACRO$', 'MACROABORT$'}
+
+        # Batched reads of the scan classes (i.e. GETFAST?). They are local
+        # since every read of the batch goes through the dispatch queue itself
+        for name, (scan, cmds) in SCAN_CLASSES.items():
+            self._lookup[f'GET{name}?'] = partial(self.get_batch, cmds)
+            self._local.add(f'GET{name}?')
+
+        # Multi-step procedures executed by the driver (see macros.py)
+        self._macros = Macro_Runner(self)
+
         return
 
-    def cmd_lookup(self, cmd: str, args: str|int=None) -> str|int:
+    def cmd_lookup(self, cmd: str, args: str|int=None,
+                   priority: int=None) -> str|int:
         """
         Wrapper function for the command lookup table.
 
@@ -55,6 +149,10 @@ class Cmd_Lookup():
             cmd (str)      - Command which is a key in the lookup table. This key
                              corresponds to a value which is a function.
             args (str|int) - Optional argument that may accompany a command
+            priority (int) - Optional priority class of the command (see
+                             dispatch_queue.py). By default writes are
+                             OPERATOR, turning the RF off is SAFETY and reads
+                             are READ. The background poller uses POLL.
 
         Returns:
             A sring which is the output of the function that is associated with
@@ -63,24 +161,156 @@ class Cmd_Lookup():
         func_id = f'{__name__}.cmd_lookup'
         pmsg = Psi_Message()
 
-        pmsg.debug(func_id, f'cmd={cmd}, args={args}')
+        pmsg.debug(func_id, 'cmd=%s, args=%s', cmd, args)
 
         if (args != None):
             try:
                 idx = cmd.find("$")
                 cmd = cmd[:idx+1]
-                rf_cmd = self._lookup[cmd](args)
+                func = self._lookup[cmd]
             except KeyError:
                 pmsg.error(func_id, f'Errr: "{cmd}" is an invalid command')
-                rf_cmd = f'Error: "{cmd} is an invalid command'
+                return f'Error: "{cmd} is an invalid command'
+
+            if (cmd in self._local):
+                return func(args)
+
+            if (priority == None):
+                priority = self.cmd_priority(cmd, args)
+
+            try:
+                rf_cmd = self._queue.call(priority, func, args)
+            except Busy:
+                # Nothing was written, the cached values are still valid
+                pmsg.error(func_id, f'"{cmd}" rejected, the driver is busy')
+                return BUSY_RESP
+            self._t_write = time.time()
         else:
             try:
-                rf_cmd = self._lookup[cmd]()
+                func = self._lookup[cmd]
             except KeyError:
-                rf_cmd = f'Error: "{cmd} is an invalid command'
+                return f'Error: "{cmd} is an invalid command'
+
+            if (cmd in self._local):
+                rf_cmd = func()
+            elif (priority == POLL):
+                rf_cmd = self._queue.call(POLL, func)
+            else:
+                if (priority == None): priority = READ
+                if (self._cache != None):
+                    rf_cmd = self._cache(cmd, self._t_write)
+                    if (rf_cmd != None):
+                        self._num_cached += 1
+                        return rf_cmd
+                try:
+                    rf_cmd = self._flight.do((self._addr, cmd),
+                                             self._queue.call, priority, func)
+                except Busy:
+                    rf_cmd = BUSY_RESP
 
         return rf_cmd
 
+    def set_cache(self, func):
+        """
+        Answers reads from a cache when it has the value (i.e. the values of
+        the poller). A value read before the last write is never used, since
+        the write may have changed it.
+
+        Inputs:
+            func (callable) - func(cmd, t_min) returns the value of cmd read
+                              after time.time() t_min, or None
+        """
+        self._cache = func
+
+        return
+
+    def add_local(self, cmd: str, func):
+        """
+        Adds a read command that is answered by the driver, without talking to
+        the generator (i.e. GETPOLL?, answered by the poller).
+
+        Inputs:
+            cmd  (str)      - Command (i.e. "GETPOLL?")
+            func (callable) - Function without arguments returning the answer
+        """
+        self._lookup[cmd] = func
+        self._local.add(cmd)
+
+        return
+
+    def last_write(self) -> float:
+        """
+        Returns the time.time() at which the last write to the generator
+        finished (0.0 if there was none).
+
+        Inputs:
+            None
+        """
+        return self._t_write
+
+    def cmds(self) -> list:
+        """
+        Returns the commands of the lookup table.
+
+        Inputs:
+            None
+        """
+        return list(self._lookup.keys())
+
+    def has_cmd(self, cmd: str) -> bool:
+        """
+        Returns True if cmd is in the lookup table.
+
+        Inputs:
+            cmd (str) - Command, without arguments
+        """
+        return (cmd in self._lookup)
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of this generator. A read that attached to an
+        identical read already in flight, or was answered from the cache (see
+        set_cache), is counted as a cache hit, since it was answered without
+        a Modbus transaction of its own.
+
+        Inputs:
+            None
+
+        Returns:
+            dict - Queue depths, admission counters, cache hits/misses and the
+                   p99 queue latency (ms) per priority class
+        """
+        qstats = self._queue.admission_stats()
+        stats = {"q_depth": qstats["depth"], "q_rejected": qstats["rejected"],
+                 "q_shed": qstats["shed"]}
+
+        for name, num in self._queue.depth().items():
+            stats[f'q_{name}'] = num
+
+        for name, lat in self._queue.latency_stats().items():
+            stats[f'q_{name}_p99'] = round(lat["p99"]*1000.0, 2)
+
+        hits = self._flight.num_shared + self._num_cached
+        misses = self._flight.num_calls
+        stats["cache_hits"] = hits
+        stats["cache_misses"] = misses
+        stats["cache_hit_ratio"] = round(hits/max(hits + misses, 1), 3)
+
+        return stats
+
+    def cmd_priority(self, cmd: str, args: str|int) -> int:
+        """
+        Returns the default priority class of a write command.
+
+        Inputs:
+            cmd  (str)     - Command (key in the lookup table)
+            args (str|int) - Argument of the command
+        """
+        if ((cmd == 'SETRF$') and (str(args).strip() == '0')):
+            return SAFETY
+
+        return OPERATOR
+
     def get_ipaddr(self) -> str:
         """
         Returns the current IP address.
@@ -88,7 +318,7 @@ class Cmd_Lookup():
         Inputs:
             None
         """
-        return get_ip()
+        return get_ip(self._addr, self._port)
 
     def get_ipmode(self) -> int:
         """
@@ -97,8 +327,67 @@ class Cmd_Lookup():
         Inputs:
             None
         """
-#        return f'{randint(0, 10)}'
-        return f'{randint(0, 10)}'
+#        return f'{random.randint(0, 9)}'
+        return f'{random.randint(0, 9)}'
+
+    def ping(self) -> str:
+        """
+        Returns "OK". The commands of a client are executed in order, so a
+        client can send PING? after a write and use the response to know that
+        the write has been executed.
+
+        Inputs:
+            None
+        """
+        return 'OK'
+
+    def get_batch(self, cmds: list) -> str:
+        """
+        Reads several commands and returns their values separated by spaces,
+        in order. Returns BUSY if one of the reads was rejected.
+
+        Inputs:
+            cmds (list) - Read commands (i.e. the commands of a scan class)
+        """
+        values = []
+        for cmd in cmds:
+            value = self.cmd_lookup(cmd)
+            if (value == BUSY_RESP):
+                return BUSY_RESP
+            values.append(str(value))
+
+        return ' '.join(values)
+
+    def read_pipelined(self, cmds: list, priority: int=POLL) -> dict:
+        """
+        Reads several commands as one request of the dispatch queue, which
+        sends the reads to the generator in one pipelined Modbus exchange (see
+        read_params in rf_gen_controller.py). Commands that cannot be
+        pipelined are read one by one. Busy and Preempted are raised as by
+        the dispatch queue.
+
+        Inputs:
+            cmds     (list)          - Read commands
+            priority (optional, int) - Priority class. Defaults to POLL
+
+        Returns:
+            dict - {cmd: value}, without the reads the generator rejected
+        """
+        batch = [cmd for cmd in cmds if (cmd in PIPELINED)]
+
+        values = {}
+        if (batch):
+            resps = self._queue.call(priority, read_params,
+                                     [PIPELINED[cmd] for cmd in batch],
+                                     self._addr, self._port)
+            values = {cmd: value for cmd, value in zip(batch, resps)
+                      if (value != None)}
+
+        for cmd in cmds:
+            if (cmd not in PIPELINED):
+                values[cmd] = self.cmd_lookup(cmd, priority=priority)
+
+        return values
 
     def get_hostname(self):
         """
@@ -117,6 +406,10 @@ class Cmd_Lookup():
             power (str) - Integer between 6000 and 0, which represents
                           the power to which the RF generator will be
                           set (in mW)
+
+        Returns:
+            An error string if the argument is not an integer, which the next
+            PING? reports. None otherwise
         """
         func_id = f'{__name__}.power_set'
         pmsg = Psi_Message()
@@ -131,18 +424,208 @@ class Cmd_Lookup():
                 idx = sp_power.find("\n")
                 if (idx < 0):
                     pmsg.error(func_id, f'Invalid value ({sp_power}) given for argument')
-                    return
+                    return _arg_error('SETPOWER$', sp_power)
 
                 power = int(sp_power[:idx+1])
                 pmsg.debug(func_id, f'power={power}')
             except ValueError:
                 pmsg.error(func_id, f'{exc}')
-                return
+                return _arg_error('SETPOWER$', sp_power)
 
-        set_power(power)
+        set_power(power, self._addr, self._port)
 
         return
 
+    def rf_set(self, state: str|int):
+        """
+        Turns the RF power on or off
+
+        Inputs:
+            state (str|int) - 1 to turn the RF power on, 0 to turn it off
+
+        Returns:
+            An error string if the argument is not an integer, None otherwise
+        """
+        func_id = f'{__name__}.rf_set'
+        pmsg = Psi_Message()
+
+        pmsg.debug(func_id, f'state={state}')
+
+        try:
+            state = int(state)
+        except ValueError:
+            pmsg.error(func_id, f'Invalid value ({state}) given for argument')
+            return _arg_error('SETRF$', state)
+
+        if (state == 0):
+            rf_off(self._addr, self._port)
+        else:
+            rf_on(self._addr, self._port)
+
+        return
+
+    def _int_arg(self, func_id: str, value: str|int) -> int:
+        """
+        Converts the argument of a command to an integer.
+
+        Inputs:
+            func_id (str)     - Name of the calling function (for the log)
+            value   (str|int) - Argument of the command
+
+        Returns:
+            The integer, or None if the argument is not an integer
+        """
+        try:
+            return int(value)
+        except ValueError:
+            Psi_Message().error(func_id, f'Invalid value ({value}) given for argument')
+
+        return None
+
+    def match_mode_set(self, m_mode: str|int):
+        """
+        Sets the match mode
+
+        Inputs:
+            m_mode (str|int) - 1 for manual, 2 for auto
+        """
+        mode = self._int_arg(f'{__name__}.match_mode_set', m_mode)
+        if (mode == None):
+            return _arg_error('SETMATCHMODE$', m_mode)
+
+        set_match_mode(mode, self._addr, self._port)
+
+        return
+
+    def load_cap_set(self, cap_pos: str|int):
+        """
+        Moves the load capacitor
+
+        Inputs:
+            cap_pos (str|int) - Position, 1000 is 100.0%
+        """
+        pos = self._int_arg(f'{__name__}.load_cap_set', cap_pos)
+        if (pos == None):
+            return _arg_error('SETLDCAP$', cap_pos)
+
+        set_load_cap(pos, self._addr, self._port)
+
+        return
+
+    def tune_cap_set(self, cap_pos: str|int):
+        """
+        Moves the tune capacitor
+
+        Inputs:
+            cap_pos (str|int) - Position, 1000 is 100.0%
+        """
+        pos = self._int_arg(f'{__name__}.tune_cap_set', cap_pos)
+        if (pos == None):
+            return _arg_error('SETTNCAP$', cap_pos)
+
+        set_tune_cap(pos, self._addr, self._port)
+
+        return
+
+    def macro_start(self, macro_args: str):
+        """
+        Starts a macro in the background (see macros.py)
+
+        Inputs:
+            macro_args (str) - Macro name followed by its arguments
+
+        Returns:
+            An error string if the macro was not started (unknown macro, wrong
+            arguments, or a macro is already running), which the next PING?
+            reports. None otherwise
+        """
+        if (not self._macros.start(macro_args)):
+            return f'Error: "MACRO$ {macro_args}" was not started'
+
+        return
+
+    def macro_abort(self, unused: str|int):
+        """
+        Aborts the running macro
+
+        Inputs:
+            unused (str|int) - Ignored
+        """
+        self._macros.abort()
+
+        return
+
+    def get_macro_status(self) -> str:
+        """
+        Returns the status of the current (or last) macro as
+        "<number> <name> <state> <step>/<total>"
+
+        Inputs:
+            None
+        """
+        return self._macros.status()
+
+    def get_macro_result(self) -> str:
+        """
+        Returns the values collected by the current (or last) macro
+
+        Inputs:
+            None
+        """
+        return self._macros.result()
+
+    def get_metrics(self) -> str:
+        """
+        Returns the metrics of the driver as "key=value" pairs separated by
+        spaces (see metrics.py). Latencies are in ms.
+
+        Inputs:
+            None
+        """
+        return self.metrics.format()
+
+    def get_queue_latency(self) -> str:
+        """
+        Returns the latency of the dispatch queue per priority class as
+        "class n=<requests> pre=<preempted> p50=<ms> p99=<ms> max=<ms>"
+        entries separated by ";".
+
+        Inputs:
+            None
+        """
+        stats = self._queue.latency_stats()
+        entries = []
+        for name, stat in stats.items():
+            entries.append(f'{name} n={stat["n"]} pre={stat["preempted"]} '
+                           f'p50={stat["p50"]*1000.0:.1f} '
+                           f'p99={stat["p99"]*1000.0:.1f} '
+                           f'max={stat["max"]*1000.0:.1f}')
+
+        return ';'.join(entries)
+
+    def get_queue_depth(self) -> str:
+        """
+        Returns the queue depths and the admission control counters as
+        "key=value" pairs separated by spaces. The q_ keys refer to the
+        dispatch queue in front of the generator, the conn_ keys to the
+        queues of the connected clients.
+
+        Inputs:
+            None
+        """
+        qstats = self._queue.admission_stats()
+        cstats = self.conns.stats()
+        depth = ' '.join(f'q_{name}={num}'
+                         for name, num in self._queue.depth().items())
+
+        return (f'q_depth={qstats["depth"]} q_max={qstats["max_depth"]} '
+                f'q_rejected={qstats["rejected"]} q_shed={qstats["shed"]} '
+                f'{depth} clients={cstats["clients"]} '
+                f'conn_depth={cstats["depth"]} '
+                f'conn_max_depth={cstats["max_depth"]} '
+                f'conn_rejected={cstats["rejected"]} '
+                f'conn_shed={cstats["shed"]} policy={qstats["policy"]}')
+
 
 
 
@@ -0,0 +1,312 @@
+# Prioritized dispatch of work that talks to the RF generator. Every request
+# that results in a Modbus transaction is queued here with a priority class,
+# and a worker thread always executes the highest priority request first.
+# Requests within the same class are executed in the order they arrived.
+
+import collections
+import heapq
+import itertools
+import threading
+import profiling
+import time
+import tracing
+
+from metrics import percentile
+
+# Priority classes (lower number = higher priority)
+SAFETY   = 0 # Safety relevant writes (i.e. RF off)
+OPERATOR = 1 # Operator writes (i.e. power set point)
+READ     = 2 # On-demand reads requested by a client
+POLL     = 3 # Background polling
+
+CLASS_NAMES = {SAFETY: 'safety', OPERATOR: 'operator', READ: 'read',
+               POLL: 'poll'}
+
+# Overload policies. When the queue is full a new read is either rejected
+# right away (BUSY), or the oldest queued poll/read request is shed to make
+# room for it (SHED). Writes are always admitted: safety writes preempt the
+# polling, and an operator write sheds the oldest poll/read if the queue is
+# full, whatever the policy.
+POLICY_BUSY = 'busy'
+POLICY_SHED = 'shed'
+
+# Number of latency samples that are kept per class
+LAT_SAMPLES = 1024
+
+class Preempted(Exception):
+    """
+    Raised in the caller of a queued request that was withdrawn from the queue
+    to make room for higher priority work.
+    """
+    pass
+
+class Busy(Exception):
+    """
+    Raised in the caller of a request that was not admitted to the queue, or
+    that was shed from the queue, because the queue was full.
+    """
+    pass
+
+class _Request():
+    """
+    A request waiting in, or executed by, the dispatch queue.
+    """
+
+    def __init__(self, priority: int, func, args: tuple):
+        self.priority = priority
+        self.func     = func
+        self.args     = args
+        self.t_queued = time.monotonic()
+        self.trace    = tracing.current()
+        self.prof_key = profiling.current()
+        self.done     = threading.Event()
+        self.result   = None
+        self.exc      = None
+
+        return
+
+class Dispatch_Queue():
+    """
+    Priority queue in front of the Modbus layer.
+    """
+
+    def __init__(self, num_workers: int=1, max_depth: int=None,
+                 policy: str=POLICY_BUSY):
+        """
+        Initializes the Dispatch_Queue class and starts the worker threads.
+
+        Inputs:
+            num_workers (optional, int) - Number of requests that may be
+                                          executed at the same time. Defaults
+                                          to 1, since the generator handles
+                                          one transaction at a time.
+            max_depth   (optional, int) - Maximum number of queued requests.
+                                          Unbounded if not given. Safety
+                                          and operator writes are always
+                                          admitted.
+            policy      (optional, str) - What to do when the queue is full,
+                                          either POLICY_BUSY or POLICY_SHED
+        """
+        self._cond      = threading.Condition()
+        self._heap      = []
+        self._seq       = itertools.count()
+        self._running   = True
+        self._max_depth = max_depth
+        self._policy    = policy
+
+        # Latency (queue wait + execution, in seconds) per priority class
+        self._latency   = {pclass: collections.deque(maxlen=LAT_SAMPLES)
+                           for pclass in CLASS_NAMES}
+        self._num_done  = {pclass: 0 for pclass in CLASS_NAMES}
+        self._num_preempted = {pclass: 0 for pclass in CLASS_NAMES}
+        self._num_rejected  = {pclass: 0 for pclass in CLASS_NAMES}
+        self._num_shed      = {pclass: 0 for pclass in CLASS_NAMES}
+
+        self._workers = []
+        for iwork in range(num_workers):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        return
+
+    def call(self, priority: int, func, *args) -> str|int:
+        """
+        Queues func(*args) and waits for it to be executed.
+
+        Inputs:
+            priority (int)      - Priority class (SAFETY, OPERATOR, READ, POLL)
+            func     (callable) - Function that is to be executed
+            args                - Arguments passed to func
+
+        Returns:
+            The return value of func. Raises Preempted if the request was
+            withdrawn from the queue before it was executed, Busy if the queue
+            was full, and re-raises any exception raised by func.
+        """
+        req = _Request(priority, func, args)
+
+        with self._cond:
+            if (priority == SAFETY):
+                self._preempt(POLL)
+            elif ((self._max_depth != None) and
+                  (len(self._heap) >= self._max_depth)):
+                if (priority == OPERATOR):
+                    # Admitted even if there is no read to shed, the writes
+                    # are bounded by the client queues
+                    self._shed_oldest(priority)
+                elif ((self._policy != POLICY_SHED) or
+                      (not self._shed_oldest(priority))):
+                    self._num_rejected[priority] += 1
+                    raise Busy(f'{CLASS_NAMES[priority]} request rejected')
+
+            heapq.heappush(self._heap, (priority, next(self._seq), req))
+            self._cond.notify()
+
+        req.done.wait()
+        if (req.exc != None):
+            raise req.exc
+
+        return req.result
+
+    def _preempt(self, pclass: int):
+        """
+        Withdraws every queued request of the given priority class. Requests
+        that are already executing are not interrupted, since a Modbus
+        transaction cannot be aborted half way. Must be called with the
+        condition held.
+
+        Inputs:
+            pclass (int) - Priority class whose queued work is withdrawn
+        """
+        keep = []
+        for entry in self._heap:
+            req = entry[2]
+            if (req.priority == pclass):
+                req.exc = Preempted(f'{CLASS_NAMES[pclass]} request preempted')
+                self._num_preempted[pclass] += 1
+                req.done.set()
+            else:
+                keep.append(entry)
+
+        if (len(keep) != len(self._heap)):
+            heapq.heapify(keep)
+            self._heap = keep
+
+        return
+
+    def _shed_oldest(self, priority: int) -> bool:
+        """
+        Sheds the oldest queued poll request, or if there is none the oldest
+        queued read, to make room for a request of the given priority. Work of
+        a higher priority than the new request is never shed. Must be called
+        with the condition held.
+
+        Inputs:
+            priority (int) - Priority class of the request to be admitted
+
+        Returns:
+            True if a request was shed
+        """
+        for pclass in (POLL, READ):
+            if (pclass < priority):
+                break
+
+            oldest = None
+            for entry in self._heap:
+                if ((entry[2].priority == pclass) and
+                    ((oldest == None) or (entry[1] < oldest[1]))):
+                    oldest = entry
+
+            if (oldest != None):
+                self._heap.remove(oldest)
+                heapq.heapify(self._heap)
+
+                req = oldest[2]
+                req.exc = Busy(f'{CLASS_NAMES[pclass]} request shed')
+                self._num_shed[pclass] += 1
+                req.done.set()
+
+                return True
+
+        return False
+
+    def _work(self):
+        """
+        Worker thread. Executes queued requests in priority order.
+        """
+        while True:
+            with self._cond:
+                while (self._running and (len(self._heap) == 0)):
+                    self._cond.wait()
+
+                if (not self._running):
+                    return
+
+                req = heapq.heappop(self._heap)[2]
+
+            prev = tracing.attach(req.trace)
+            tracing.add_span('dispatch_wait', req.t_queued)
+            try:
+                with profiling.request(req.prof_key, False):
+                    req.result = req.func(*req.args)
+            except Exception as exc:
+                req.exc = exc
+            tracing.attach(prev)
+
+            with self._cond:
+                self._latency[req.priority].append(time.monotonic() - req.t_queued)
+                self._num_done[req.priority] += 1
+
+            req.done.set()
+
+    def depth(self) -> dict:
+        """
+        Returns the number of queued requests per priority class name.
+
+        Inputs:
+            None
+        """
+        depth = {CLASS_NAMES[pclass]: 0 for pclass in CLASS_NAMES}
+        with self._cond:
+            for entry in self._heap:
+                depth[CLASS_NAMES[entry[2].priority]] += 1
+
+        return depth
+
+    def admission_stats(self) -> dict:
+        """
+        Returns the admission control counters.
+
+        Inputs:
+            None
+
+        Returns:
+            dict - {"depth", "max_depth", "policy", "rejected", "shed"}. The
+                   counters are totals over all priority classes.
+        """
+        with self._cond:
+            stats = {"depth": len(self._heap),
+                     "max_depth": self._max_depth,
+                     "policy": self._policy,
+                     "rejected": sum(self._num_rejected.values()),
+                     "shed": sum(self._num_shed.values())}
+
+        return stats
+
+    def latency_stats(self) -> dict:
+        """
+        Returns latency statistics (in seconds) per priority class name. The
+        percentiles are computed over the last LAT_SAMPLES requests of the
+        class.
+
+        Inputs:
+            None
+
+        Returns:
+            dict - {class name: {"n", "preempted", "p50", "p99", "max"}}
+        """
+        stats = {}
+        with self._cond:
+            for pclass, name in CLASS_NAMES.items():
+                samples = sorted(self._latency[pclass])
+                stats[name] = {"n": self._num_done[pclass],
+                               "preempted": self._num_preempted[pclass],
+                               "p50": percentile(samples, 50.0),
+                               "p99": percentile(samples, 99.0),
+                               "max": samples[-1] if (samples) else 0.0}
+
+        return stats
+
+    def stop(self):
+        """
+        Stops the worker threads. Requests still in the queue are dropped.
+
+        Inputs:
+            None
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        return
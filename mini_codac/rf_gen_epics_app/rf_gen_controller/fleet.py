@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Fleet of RF generators, grouped by chord (CHORD_NAMES). Fleet.status reads
+# the status of every generator of a chord, Fleet.status_all of every
+# generator, through rf_gen_controller.py. The generators are read at the same
+# time, one thread each, so a call takes about as long as reading a single
+# generator. The result is columnar, a NumPy array per field with a row per
+# generator:
+#
+#     fleet = Fleet()
+#     gad0 = fleet.status("GAD0")
+#     gad0["fwd_pwr"].sum(), gad0["name"][gad0["state"] != 1]
+#
+# The fields are float arrays. A generator that does not answer has "ok" False
+# and NaN in its fields, so it does not count in a sum (use np.nansum) or a
+# comparison.
+
+import argparse
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from parameters        import CHORD_NAMES, CMDS, GENERATORS
+from psi_message       import ERROR, configure
+from rf_gen_controller import read_raw
+
+# CMDS read for the status of a generator
+STATUS_FIELDS = ['state', 'ctrl_src', 'power_set_point', 'fwd_pwr', 'rfl_pwr',
+                 'match_mode', 'read_load_cap', 'read_tune_cap', 'phase_shift']
+
+class Fleet():
+    """
+    The generators of all chords.
+    """
+
+    def __init__(self, generators: dict=None, fields: list=None):
+        """
+        Initializes the Fleet class.
+
+        Inputs:
+            generators (optional, dict) - Generators, in the format of
+                                          GENERATORS in parameters.py (the
+                                          default)
+            fields     (optional, list) - CMDS read for the status. Defaults
+                                          to STATUS_FIELDS
+        """
+        if (generators == None): generators = GENERATORS
+        if (fields == None): fields = STATUS_FIELDS
+
+        self.generators = generators
+        self.fields     = list(fields)
+
+        # Chord -> names of its generators, in the order of CHORD_NAMES
+        self.chords = {chord: [] for chord in CHORD_NAMES}
+        for name, conf in generators.items():
+            if (conf.get("chord") != None):
+                self.chords.setdefault(conf["chord"].upper(), []).append(name)
+
+        # The threads are kept between calls
+        self._pool = ThreadPoolExecutor(max(len(generators), 1),
+                                        thread_name_prefix='fleet')
+
+        return
+
+    def close(self):
+        """
+        Stops the threads of the fleet.
+        """
+        self._pool.shutdown()
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def members(self, chord: str) -> list:
+        """
+        Returns the names of the generators of a chord.
+
+        Inputs:
+            chord (str) - Name of the chord (i.e. "GAD0")
+        """
+        names = self.chords.get(chord.upper())
+        if (names == None):
+            raise ValueError(f'Unknown chord {chord}, the chords are '
+                             f'{", ".join(self.chords)}')
+
+        return list(names)
+
+    def _read_gen(self, name: str) -> tuple:
+        """
+        Reads the status fields of a generator.
+
+        Returns:
+            (ok, time, values) - ok is False if a read failed, time is the time
+                                 of the first read. The values are NaN if a
+                                 read failed
+        """
+        conf = self.generators[name]
+        t_read = time.time()
+        try:
+            values = [read_raw(CMDS[field][0], "int", conf["ip"],
+                               conf.get("port"))
+                      for field in self.fields]
+        except (OSError, ValueError):
+            return (False, t_read, [float('nan')]*len(self.fields))
+
+        return (True, t_read, values)
+
+    def read(self, names: list) -> dict:
+        """
+        Reads the status of generators at the same time.
+
+        Inputs:
+            names (list) - Names of the generators
+
+        Returns:
+            dict - Columns {"name", "chord", "ok", "time", <fields>}, NumPy
+                   arrays with a row per generator, in the order of names.
+                   The fields are float, NaN for a generator that failed
+        """
+        # Imported on use, numpy is slow to import and the other tools of
+        # the driver do not need it
+        import numpy as np
+
+        rows = list(self._pool.map(self._read_gen, names))
+
+        status = {"name": np.array(names, dtype=str),
+                  "chord": np.array([self.generators[name].get("chord") or ''
+                                     for name in names], dtype=str),
+                  "ok": np.array([row[0] for row in rows], dtype=bool),
+                  "time": np.array([row[1] for row in rows], dtype=float)}
+        values = np.array([row[2] for row in rows], dtype=float)
+        values = values.reshape(len(names), len(self.fields))
+        for ifield, field in enumerate(self.fields):
+            status[field] = values[:, ifield]
+
+        return status
+
+    def status(self, chord: str) -> dict:
+        """
+        Reads the status of the generators of a chord, see read.
+
+        Inputs:
+            chord (str) - Name of the chord (i.e. "GAD0")
+        """
+        return self.read(self.members(chord))
+
+    def status_all(self) -> dict:
+        """
+        Reads the status of all generators, see read.
+        """
+        return self.read(list(self.generators))
+
+def print_status(status: dict, fields: list):
+    """
+    Prints a status, a line per generator.
+    """
+    print(f'{"name":<8}{"chord":<6}{"ok":<4}' +
+          ''.join(f'{field:>16}' for field in fields))
+    for irow, name in enumerate(status["name"]):
+        ok = 'ok' if (status["ok"][irow]) else '--'
+        print(f'{name:<8}{status["chord"][irow]:<6}{ok:<4}' +
+              ''.join(f'{status[field][irow]:>16.0f}' for field in fields))
+
+    return
+
+def main():
+    descript = '''Reads the status of all RF generators of a chord, or of all
+                  chords, at the same time'''
+    chd_help = f'''Chords to read ({", ".join(CHORD_NAMES)}). Default: all
+                   generators'''
+    gen_help = '''Generator, NAME=IP[:PORT][@CHORD]. May be given several
+                  times. Default: GENERATORS in parameters.py'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('CHORD', help = chd_help, nargs = '*', default = [])
+    parser.add_argument('-g', '--gen', help = gen_help, action = 'append',
+                        default = None)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    # Only errors are logged, so the output stays a clean table
+    configure(ERROR)
+
+    generators = None
+    if (args['gen'] != None):
+        from gen_router import parse_gen_args
+        generators = parse_gen_args(args['gen'])
+
+    with Fleet(generators) as fleet:
+        for chord in args['CHORD']:
+            try:
+                fleet.members(chord)
+            except ValueError as exc:
+                parser.error(str(exc))
+
+        t_start = time.perf_counter()
+        if (args['CHORD']):
+            statuses = [fleet.status(chord) for chord in args['CHORD']]
+        else:
+            statuses = [fleet.status_all()]
+        t_read = time.perf_counter() - t_start
+
+        for status in statuses:
+            print_status(status, fleet.fields)
+        print(f'read in {1000.0*t_read:.1f} ms')
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+# Optional per-host daemon of the command line tools. A call of gen_test_app.py
+# otherwise opens a new Modbus connection for its commands and reads every
+# value from the generator. The daemon serves the text protocol of the driver
+# (see tcp_server.py) on a Unix domain socket for all generators in GENERATORS
+# (or --GEN). It keeps the Modbus connections of the generators open, polls
+# them every DAEMON_POLL seconds and answers reads of polled commands from the
+# polled values while they are at most DAEMON_MAX_AGE seconds old (see
+# Cmd_Lookup.set_cache). A read after a write always goes to the generator.
+#
+#     gen_daemon.py &
+#     gen_test_app.py -s -fp -rp     # forwarded to the daemon
+#
+# A tool calls connect(), which returns a Daemon_Backend if the daemon is
+# running, or None, in which case the tool talks to the generator itself.
+# Daemon_Backend has the functions of rf_gen_controller.py, so the tool can use
+# either one. Parameters that are not part of the driver protocol (i.e. the
+# date) are read directly by the backend.
+
+import argparse
+import os
+import socket
+import sys
+
+from parameters    import DAEMON_MAX_AGE, DAEMON_POLL, DAEMON_SOCKET
+from rf_gen_client import Rf_Gen_Client
+
+# rf_gen_controller function: (driver command, type of the response)
+READS = {"get_ip": ('IPADDR?', str),
+         "get_power": ('GETPOWER?', int),
+         "get_state": ('GETSTATE?', int),
+         "get_control_source": ('GETCTRLSRC?', int),
+         "get_forward_power": ('GETFWDPWR?', int),
+         "get_reflected_power": ('GETRFLPWR?', int),
+         "get_match_mode": ('GETMATCHMODE?', int),
+         "get_load_cap": ('GETLDCAP?', int),
+         "get_tune_cap": ('GETTNCAP?', int),
+         "get_phase": ('GETPHASE?', int)}
+
+# rf_gen_controller function: (driver command, fixed value). Functions without
+# a fixed value take the value as their argument.
+WRITES = {"set_power": ('SETPOWER$', None),
+          "set_match_mode": ('SETMATCHMODE$', None),
+          "set_load_cap": ('SETLDCAP$', None),
+          "set_tune_cap": ('SETTNCAP$', None),
+          "rf_on": ('SETRF$', 1),
+          "rf_off": ('SETRF$', 0)}
+
+class Daemon_Backend():
+    """
+    Connection to the daemon, with the functions of rf_gen_controller.py. The
+    functions address the default (first) generator of the daemon.
+    """
+
+    def __init__(self, path: str=None):
+        """
+        Initializes the Daemon_Backend class and connects to the daemon.
+
+        Inputs:
+            path (optional, str) - Socket of the daemon. Defaults to
+                                   DAEMON_SOCKET in parameters.py
+        """
+        if (path == None): path = DAEMON_SOCKET
+
+        self.client = Rf_Gen_Client(path, None)
+
+        return
+
+    def close(self):
+        """
+        Closes the connection to the daemon.
+        """
+        self.client.close()
+
+        return
+
+    def __getattr__(self, name: str):
+        # Parameters the driver protocol does not have (i.e. get_date) are
+        # read from the generator directly
+        import rf_gen_controller
+
+        return getattr(rf_gen_controller, name)
+
+def _make_read(cmd: str, conv):
+    """
+    Builds a read function of Daemon_Backend.
+    """
+    def read(self, ipaddr: str=None, port: int=None):
+        return conv(self.client.query(cmd))
+
+    read.__doc__ = f'Sends {cmd} to the daemon'
+
+    return read
+
+def _make_write(cmd: str, fixed: int):
+    """
+    Builds a write function of Daemon_Backend. It returns once the daemon
+    executed the write.
+    """
+    if (fixed == None):
+        def write(self, value: int, ipaddr: str=None, port: int=None):
+            self.client.write(cmd, value, wait=True)
+    else:
+        def write(self, ipaddr: str=None, port: int=None):
+            self.client.write(cmd, fixed, wait=True)
+
+    write.__doc__ = f'Sends {cmd} to the daemon'
+
+    return write
+
+for _name, (_cmd, _conv) in READS.items():
+    setattr(Daemon_Backend, _name, _make_read(_cmd, _conv))
+
+for _name, (_cmd, _fixed) in WRITES.items():
+    setattr(Daemon_Backend, _name, _make_write(_cmd, _fixed))
+
+def connect(path: str=None) -> Daemon_Backend:
+    """
+    Connects to the daemon.
+
+    Inputs:
+        path (optional, str) - Socket of the daemon. Defaults to DAEMON_SOCKET
+
+    Returns:
+        The backend, or None if the daemon is not running
+    """
+    if (path == None): path = DAEMON_SOCKET
+
+    if (not os.path.exists(path)):
+        return None
+
+    try:
+        return Daemon_Backend(path)
+    except OSError:
+        return None
+
+def gen_daemon(path: str=None, poll_period: float=None, max_age: float=None,
+               generators: dict=None, bug_level: bool=None) -> bool:
+    """
+    Runs the daemon. Does not return, unless another daemon is already running
+    on path.
+
+    Inputs:
+        path        (opt, str)   - Socket to listen on. Defaults to
+                                   DAEMON_SOCKET in parameters.py
+        poll_period (opt, float) - Polling period (seconds). Defaults to
+                                   DAEMON_POLL
+        max_age     (opt, float) - Maximum age (seconds) of a polled value
+                                   that answers a read. Defaults to
+                                   DAEMON_MAX_AGE
+        generators  (opt, dict)  - Generators served by the daemon. Defaults
+                                   to GENERATORS in parameters.py
+        bug_level   (opt, bool)  - Write a debug log file (LOG_FILE)
+
+    Returns:
+        bool - False if a daemon is already running
+    """
+    # The server side is only imported here, so the tools that just forward
+    # to the daemon stay fast to start
+    from gen_router  import Gen_Router
+    from psi_message import DEBUG, ERROR, Psi_Message, configure
+    from tcp_server  import serve
+
+    func_id = f'{__name__}.gen_daemon'
+
+    if (path == None): path = DAEMON_SOCKET
+    if (poll_period == None): poll_period = DAEMON_POLL
+    if (max_age == None): max_age = DAEMON_MAX_AGE
+
+    if (bug_level):
+        configure(DEBUG, True, console_level=ERROR)
+    else:
+        configure(ERROR)
+    pmsg = Psi_Message()
+
+    # A socket file left behind by a daemon that died is removed, but a
+    # running daemon is not replaced
+    if (os.path.exists(path)):
+        backend = connect(path)
+        if (backend != None):
+            backend.close()
+            pmsg.error(func_id, f'A daemon is already running on {path}')
+            return False
+        os.unlink(path)
+
+    router = Gen_Router(generators, poll_period=poll_period, max_age=max_age)
+    router.start()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(path)
+        os.chmod(path, 0o660)
+        sock.listen()
+        try:
+            serve(sock, router)
+        finally:
+            os.unlink(path)
+
+    return True
+
+def main():
+    descript = '''Daemon that keeps the connections to the RF generators open
+                  and answers the command line tools (gen_test_app.py) over a
+                  Unix domain socket'''
+    soc_help = f'''Socket to listen on. Default: {DAEMON_SOCKET}'''
+    pol_help = f'''Polling period (seconds). Default: {DAEMON_POLL}'''
+    age_help = f'''Reads are answered from polled values that are at most this
+                   many seconds old. Default: {DAEMON_MAX_AGE}'''
+    gen_help = '''Generator served by the daemon, NAME=IP[:PORT][@CHORD]. May
+                  be given several times. Default: GENERATORS in
+                  parameters.py'''
+    log_help = '''Create a debug log file'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('-s', '--SOCKET', help = soc_help, default = None)
+    parser.add_argument('-p', '--POLL', help = pol_help, type = float,
+                        default = None)
+    parser.add_argument('-a', '--MAX_AGE', help = age_help, type = float,
+                        default = None)
+    parser.add_argument('-g', '--GEN', help = gen_help, action = 'append',
+                        default = None)
+    parser.add_argument('-l', '--LOG', help = log_help, action = 'store_true',
+                        default = False)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    generators = None
+    if (args['GEN'] != None):
+        from gen_router import parse_gen_args
+        generators = parse_gen_args(args['GEN'])
+
+    if (not gen_daemon(args['SOCKET'], args['POLL'], args['MAX_AGE'],
+                       generators, args['LOG'])):
+        sys.exit(1)
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
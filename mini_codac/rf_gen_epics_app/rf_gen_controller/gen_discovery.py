@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# Finds the Cito Plus generators on a network. Every address of the targets
+# (CIDR ranges, single addresses, port ranges) is probed concurrently with
+# asyncio: connect to the Modbus port, then read the host name (5105) and the
+# IP address (5100) of the generator. At most DISCOVERY_CONCURRENCY probes run
+# at once, and a probe gives up after DISCOVERY_TIMEOUT seconds, so a /24 is
+# scanned in about a second.
+#
+#     gen_discovery.py 169.254.1.0/24 192.168.0.150
+#     gen_discovery.py 127.0.0.1:15000-15063         (simulators, see
+#                                                     gen_simulator.py -n)
+#
+# With --gen the inventory is printed as --GEN arguments of the driver
+# (rf_gen_tcp_driver.py), i.e. "-g GEN1=169.254.1.1:502".
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import struct
+import time
+
+from modbus_client import Modbus_Client
+from parameters    import (CMDS, DEFAULT_TCP_PORT, DISCOVERY_CONCURRENCY,
+                           DISCOVERY_TIMEOUT)
+from psi_message   import ERROR, Psi_Message, configure
+
+FORMATS = ['table', 'json', 'gen']
+
+def parse_targets(targets: list, port: int=None) -> list:
+    """
+    Expands the targets into addresses.
+
+    Inputs:
+        targets (list)          - Strings "ADDR", "ADDR:PORT", "ADDR:PORT-PORT"
+                                  or "NETWORK/BITS" (CIDR, every host address)
+        port    (optional, int) - Port of the targets without one. Defaults to
+                                  DEFAULT_TCP_PORT
+
+    Returns:
+        list - [(ip, port)]
+    """
+    if (port == None): port = DEFAULT_TCP_PORT
+
+    addrs = []
+    for target in targets:
+        ports = [port]
+        if (target.find(':') >= 0):
+            target, port_str = target.split(':', 1)
+            if (port_str.find('-') >= 0):
+                first, last = port_str.split('-', 1)
+                ports = list(range(int(first), int(last) + 1))
+            else:
+                ports = [int(port_str)]
+
+        if (target.find('/') >= 0):
+            network = ipaddress.ip_network(target, strict=False)
+            hosts = list(network.hosts())
+            if (not hosts): hosts = [network.network_address] # i.e. a /32
+        else:
+            hosts = [ipaddress.ip_address(target)]
+
+        for host in hosts:
+            for host_port in ports:
+                addrs.append((str(host), host_port))
+
+    return addrs
+
+async def _read(reader, writer, mbc: Modbus_Client, param: str) -> bytes:
+    """
+    Reads a parameter over an open connection.
+
+    Returns:
+        bytes - Data of the response, None if the generator rejected the read
+    """
+    writer.write(mbc.build_mb_cmd(CMDS[param][0], 'r'))
+    hdr = await reader.readexactly(6)
+    body = await reader.readexactly(struct.unpack('>H', hdr[4:6])[0])
+
+    return mbc.parse_read_response(hdr + body)
+
+async def probe(ip: str, port: int, timeout: float) -> dict:
+    """
+    Probes one address.
+
+    Inputs:
+        ip      (str)   - IP address
+        port    (int)   - Modbus port
+        timeout (float) - Time for the whole probe (seconds)
+
+    Returns:
+        dict - {"ip", "port", "hostname", "gen_ip", "rtt_ms"} if a generator
+               answered, None otherwise
+    """
+    func_id = f'{__name__}.probe'
+    pmsg = Psi_Message()
+
+    t_start = time.perf_counter()
+    writer = None
+    try:
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(ip, port)
+            mbc = Modbus_Client(ip, port)
+            hostname = await _read(reader, writer, mbc, 'hostname')
+            raw_ip = await _read(reader, writer, mbc, 'get_ip')
+    except (OSError, TimeoutError, asyncio.IncompleteReadError) as exc:
+        pmsg.debug(func_id, '%s:%s: %r', ip, port, exc)
+        return None
+    except (struct.error, IndexError) as exc:
+        # A malformed reply, the device is not a Cito Plus
+        pmsg.debug(func_id, '%s:%s answered a malformed reply: %r', ip, port,
+                   exc)
+        return None
+    finally:
+        if (writer != None):
+            writer.close()
+
+    if ((hostname == None) or (raw_ip == None) or (len(raw_ip) < 4)):
+        pmsg.debug(func_id, '%s:%s answered, but is not a Cito Plus', ip, port)
+        return None
+
+    return {"ip": ip, "port": port,
+            "hostname": hostname.decode("utf-8", "replace").strip('\x00 '),
+            "gen_ip": '.'.join(str(byte) for byte in raw_ip[:4]),
+            "rtt_ms": round((time.perf_counter() - t_start)*1000.0, 2)}
+
+async def discover_async(addrs: list, limit: int=None,
+                         timeout: float=None) -> list:
+    """
+    Probes addresses concurrently.
+
+    Inputs:
+        addrs   (list)            - [(ip, port)], see parse_targets
+        limit   (optional, int)   - Maximum number of probes at once. Defaults
+                                    to DISCOVERY_CONCURRENCY
+        timeout (optional, float) - Timeout of a probe (seconds). Defaults to
+                                    DISCOVERY_TIMEOUT
+
+    Returns:
+        list - The generators found (see probe), in the order of addrs
+    """
+    if (limit == None): limit = DISCOVERY_CONCURRENCY
+    if (timeout == None): timeout = DISCOVERY_TIMEOUT
+
+    slots = asyncio.Semaphore(limit)
+
+    async def limited(ip: str, port: int) -> dict:
+        async with slots:
+            return await probe(ip, port, timeout)
+
+    found = await asyncio.gather(*(limited(ip, port) for ip, port in addrs))
+
+    return [gen for gen in found if (gen != None)]
+
+def discover(targets: list, port: int=None, limit: int=None,
+             timeout: float=None) -> list:
+    """
+    Finds the generators of the targets. Blocking version of discover_async.
+
+    Inputs:
+        targets (list)            - Targets, see parse_targets
+        port    (optional, int)   - Port of the targets without one
+        limit   (optional, int)   - Maximum number of probes at once
+        timeout (optional, float) - Timeout of a probe (seconds)
+
+    Returns:
+        list - The generators found (see probe)
+    """
+    return asyncio.run(discover_async(parse_targets(targets, port), limit,
+                                      timeout))
+
+def print_inventory(gens: list, fmt: str):
+    """
+    Prints the generators found as a table, as JSON or as --GEN arguments of
+    the driver.
+    """
+    if (fmt == 'json'):
+        print(json.dumps(gens, indent=2))
+
+    elif (fmt == 'gen'):
+        print(' '.join(f'-g GEN{igen+1}={gen["ip"]}:{gen["port"]}'
+                       for igen, gen in enumerate(gens)))
+
+    else:
+        print(f'{"address":<22}{"hostname":<24}{"generator ip":<16}'
+              f'{"rtt ms":>8}')
+        for gen in gens:
+            print(f'{gen["ip"] + ":" + str(gen["port"]):<22}'
+                  f'{gen["hostname"]:<24}{gen["gen_ip"]:<16}'
+                  f'{gen["rtt_ms"]:>8.2f}')
+
+    return
+
+def main():
+    descript = '''Finds the Cito Plus RF generators on a network'''
+    tgt_help = '''Addresses to probe: ADDR, ADDR:PORT, ADDR:FIRST-LAST (port
+                  range) or NETWORK/BITS (CIDR)'''
+    prt_help = f'''Port of the targets without one. Default: {DEFAULT_TCP_PORT}'''
+    lim_help = f'''Maximum number of probes at once. Default:
+                   {DISCOVERY_CONCURRENCY}'''
+    tmo_help = f'''Timeout of a probe (seconds). Default: {DISCOVERY_TIMEOUT}'''
+    fmt_help = '''Output: a table, JSON, or the --GEN arguments of the driver'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('TARGETS', help = tgt_help, nargs = '+')
+    parser.add_argument('-p', '--port', help = prt_help, type = int,
+                        default = None)
+    parser.add_argument('-n', '--limit', help = lim_help, type = int,
+                        default = None)
+    parser.add_argument('-t', '--timeout', help = tmo_help, type = float,
+                        default = None)
+    parser.add_argument('-f', '--format', help = fmt_help, choices = FORMATS,
+                        default = 'table')
+    parser.add_argument('-g', '--gen', help = 'Same as --format gen',
+                        action = 'store_true', default = False)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    # Invalid command errors of devices that are not generators are expected
+    configure(ERROR + 10)
+
+    fmt = 'gen' if (args['gen']) else args['format']
+
+    t_start = time.perf_counter()
+    gens = discover(args['TARGETS'], args['port'], args['limit'],
+                    args['timeout'])
+    print_inventory(gens, fmt)
+
+    if (fmt == 'table'):
+        print(f'{len(gens)} generators found in '
+              f'{time.perf_counter() - t_start:.2f} s')
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
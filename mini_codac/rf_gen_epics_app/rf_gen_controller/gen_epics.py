@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Generates the StreamDevice protocol file and the EPICS database of the driver
+# from its command table (cmd_lookup.py), so that they do not drift apart.
+#
+# Reads that belong to a scan class (SCAN_CLASSES in parameters.py) are not
+# scanned one by one. A single record per class sends the batched command
+# (i.e. GETFAST?) and its protocol parses the response into the records of the
+# class, which are passive. Every other exported read gets its own protocol and
+# record, and every write an output record.
+#
+# The database uses the macros P (record name prefix, i.e. "RFGEN:GEN1:") and
+# PORT (asyn port of the driver connection).
+#
+# Run it after changing the command table or the scan classes. With --check it
+# only reports whether the files are up to date, i.e. for a build step.
+
+import argparse
+import os
+import sys
+
+from cmd_lookup  import Cmd_Lookup
+from parameters  import SCAN_CLASSES
+from psi_message import Psi_Message
+
+PROTO_FILE = 'rf_gen_driver_cmds.proto'
+
+APP_DIR  = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROTO_PATH = os.path.join(APP_DIR, 'proto_files', PROTO_FILE)
+DB_PATH    = os.path.join(APP_DIR, 'db_files', 'rf_gen_driver.db')
+
+# Reads. cmd: (record, record type, protocol, format, SCAN). The SCAN of reads
+# in a scan class is ignored. SCAN None reads the value once at IOC start.
+# A command mapped to None is not exported.
+READS = {'IPADDR?': ('IPADDR', 'stringin', 'ipaddr-rb', '%39c', None),
+         'IPMODE?': ('IPMODE', 'longin', 'ipmode-rb', '%d', None),
+         'HOSTNAME?': ('HOSTNAME', 'stringin', 'hostname-rb', '%39c', None),
+         'GETPOWER?': ('POWER_RBV', 'longin', 'rf-power-rb', '%d', None),
+         'GETSTATE?': ('STATE', 'longin', 'state-rb', '%d', None),
+         'GETCTRLSRC?': ('CTRL_SRC', 'longin', 'ctrl-src-rb', '%d', None),
+         'GETFWDPWR?': ('FWD_PWR', 'longin', 'fwd-power-rb', '%d', None),
+         'GETRFLPWR?': ('RFL_PWR', 'longin', 'rfl-power-rb', '%d', None),
+         'GETMATCHMODE?': ('MATCH_MODE_RBV', 'longin', 'match-mode-rb', '%d',
+                           None),
+         'GETLDCAP?': ('LOAD_CAP_RBV', 'longin', 'load-cap-rb', '%d', None),
+         'GETTNCAP?': ('TUNE_CAP_RBV', 'longin', 'tune-cap-rb', '%d', None),
+         'GETPHASE?': ('PHASE', 'longin', 'phase-rb', '%d', None),
+         'MACROSTAT?': ('MACRO_STAT', 'stringin', 'macro-stat-rb', '%39c',
+                        '1 second'),
+         'GETQLATENCY?': None,
+         'GETQDEPTH?': None,
+         'METRICS?': None,
+         'PING?': None,
+         'MACRORESULT?': None}
+
+# Writes. cmd: (record, record type, protocol, format, read of the initial value)
+WRITES = {'SETPOWER$': ('POWER_SP', 'longout', 'set-point-rb', '%d',
+                        'GETPOWER?'),
+          'SETRF$': ('RF_SP', 'bo', 'rf-set', '%d', None),
+          'SETMATCHMODE$': ('MATCH_MODE_SP', 'longout', 'match-mode-set', '%d',
+                            'GETMATCHMODE?'),
+          'SETLDCAP$': ('LOAD_CAP_SP', 'longout', 'load-cap-set', '%d',
+                        'GETLDCAP?'),
+          'SETTNCAP$': ('TUNE_CAP_SP', 'longout', 'tune-cap-set', '%d',
+                        'GETTNCAP?'),
+          'MACRO$': ('MACRO', 'stringout', 'macro-start', '%s', None),
+          'MACROABORT$': ('MACRO_ABORT', 'bo', 'macro-abort', '%d', None)}
+
+# Extra fields of some record types
+RTYP_FIELDS = {'bo': [('ZNAM', 'Off'), ('ONAM', 'On')]}
+
+def check_table(cmds: list) -> list:
+    """
+    Compares the command table with READS and WRITES.
+
+    Inputs:
+        cmds (list) - Commands of the lookup table
+
+    Returns:
+        list - Error messages, empty if every command is described
+    """
+    batched = {f'GET{name}?' for name in SCAN_CLASSES}
+
+    errors = []
+    for cmd in cmds:
+        if ((cmd not in batched) and (cmd not in READS) and
+            (cmd not in WRITES)):
+            errors.append(f'{cmd} is not in READS or WRITES of {__name__}')
+
+    for cmd in list(READS) + list(WRITES):
+        if (cmd not in cmds):
+            errors.append(f'{cmd} is not a command of the lookup table')
+
+    for name, (scan, class_cmds) in SCAN_CLASSES.items():
+        for cmd in class_cmds:
+            if (READS.get(cmd) == None):
+                errors.append(f'{cmd} of scan class {name} is not exported')
+
+    return errors
+
+def gen_proto() -> str:
+    """
+    Returns the StreamDevice protocol file.
+    """
+    lines = [f'# Stream protocol file for the RF Generator driver',
+             f'# Generated by {os.path.basename(__file__)}, do not edit',
+             '',
+             '# The driver terminates every response with a line feed',
+             'Terminator = LF;',
+             '',
+             '# Batched reads of the scan classes. Each value of the response',
+             '# is written to a record, $1 is the record name prefix']
+
+    for name, (scan, cmds) in SCAN_CLASSES.items():
+        fmts = [f'%(\\$1{READS[cmd][0]}){READS[cmd][3][1:]}' for cmd in cmds]
+        lines += [f'scan-{name.lower()} {{',
+                  f'  out "GET{name}?";',
+                  f'  in  "{" ".join(fmts)}";',
+                  '}']
+
+    lines += ['', '# Single reads']
+    for cmd, rec in READS.items():
+        if (rec == None):
+            continue
+
+        record, rtyp, proto, fmt, scan = rec
+        lines += [f'{proto} {{', f'  out "{cmd}";', f'  in  "{fmt}";', '}']
+
+    lines += ['', '# Writes. The driver does not answer writes']
+    for cmd, (record, rtyp, proto, fmt, init) in WRITES.items():
+        lines += [f'{proto} {{', f'  out "{cmd} {fmt}";']
+        if (init != None):
+            lines.append(f'  @init {{ {READS[init][2]}; }}')
+        lines.append('}')
+
+    return '\n'.join(lines) + '\n'
+
+def _record(rtyp: str, name: str, fields: list) -> list:
+    """
+    Returns the lines of one database record.
+    """
+    lines = [f'record({rtyp}, "$(P){name}") {{']
+    for field, value in fields + RTYP_FIELDS.get(rtyp, []):
+        lines.append(f'    field({field}, "{value}")')
+    lines.append('}')
+
+    return lines
+
+def gen_db() -> str:
+    """
+    Returns the EPICS database.
+    """
+    lines = [f'# Records of the RF Generator driver',
+             f'# Generated by {os.path.basename(__file__)}, do not edit',
+             '#',
+             '# Macros: P    - record name prefix',
+             '#         PORT - asyn port of the connection to the driver']
+
+    batched = {}
+    for name, (scan, cmds) in SCAN_CLASSES.items():
+        lines += ['', f'# Scan class {name}: {", ".join(cmds)}']
+        lines += _record('longin', f'SCAN_{name}',
+                         [('DESC', f'{name.lower()} batched read'),
+                          ('DTYP', 'stream'),
+                          ('INP', f'@{PROTO_FILE} scan-{name.lower()}($(P)) '
+                                  f'$(PORT)'),
+                          ('SCAN', scan)])
+        for cmd in cmds:
+            batched[cmd] = name
+
+    lines += ['', '# Reads']
+    for cmd, rec in READS.items():
+        if (rec == None):
+            continue
+
+        record, rtyp, proto, fmt, scan = rec
+        if (cmd in batched):
+            fields = [('DESC', f'{cmd} (SCAN_{batched[cmd]})'),
+                      ('SCAN', 'Passive')]
+        else:
+            fields = [('DESC', cmd), ('DTYP', 'stream'),
+                      ('INP', f'@{PROTO_FILE} {proto} $(PORT)')]
+            if (scan == None):
+                fields += [('SCAN', 'Passive'), ('PINI', 'YES')]
+            else:
+                fields.append(('SCAN', scan))
+        lines += _record(rtyp, record, fields)
+
+    lines += ['', '# Writes']
+    for cmd, (record, rtyp, proto, fmt, init) in WRITES.items():
+        lines += _record(rtyp, record,
+                         [('DESC', cmd), ('DTYP', 'stream'),
+                          ('OUT', f'@{PROTO_FILE} {proto} $(PORT)')])
+
+    return '\n'.join(lines) + '\n'
+
+def main():
+    descript = '''Generates the StreamDevice protocol file and the EPICS
+                  database of the RF generator driver from its command table'''
+    pro_help = f'''Protocol file to write. Default: {PROTO_PATH}'''
+    db_help  = f'''Database file to write. Default: {DB_PATH}'''
+    chk_help = '''Do not write the files, exit with status 1 if they are not
+                  up to date'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('-p', '--proto', help = pro_help, default = PROTO_PATH)
+    parser.add_argument('-d', '--db', help = db_help, default = DB_PATH)
+    parser.add_argument('-c', '--check', help = chk_help, action = 'store_true',
+                        default = False)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    func_id = f'{__name__}.main'
+    pmsg = Psi_Message()
+
+    errors = check_table(Cmd_Lookup().cmds())
+    for error in errors:
+        pmsg.error(func_id, error)
+    if (errors):
+        sys.exit(1)
+
+    stale = []
+    for path, text in ((args['proto'], gen_proto()), (args['db'], gen_db())):
+        current = None
+        if (os.path.exists(path)):
+            with open(path) as file:
+                current = file.read()
+
+        if (current == text):
+            continue
+
+        stale.append(path)
+        if (not args['check']):
+            with open(path, 'w') as file:
+                file.write(text)
+            print(f'Wrote {path}')
+
+    if (args['check'] and stale):
+        for path in stale:
+            print(f'{path} is out of date')
+        sys.exit(1)
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
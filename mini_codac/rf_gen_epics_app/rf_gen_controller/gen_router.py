@@ -0,0 +1,263 @@
+# Routing of client commands to the RF generators served by one driver. A
+# command may be prefixed by the name of a generator, or by the name of a
+# chord that has a single generator, followed by a colon (i.e.
+# "GEN2:GETPOWER?" or "GAD0:SETPOWER$ 5000"). Commands without a prefix go to
+# the first generator. Every generator has its own lookup table, dispatch
+# queue, Modbus connection pool and poller, so generators are served
+# concurrently and a slow generator does not hold up the others.
+
+from admission     import Conn_Registry
+from cmd_lookup    import Cmd_Lookup
+from metrics       import Metrics
+from modbus_client import MB_COUNTERS
+from parameters    import (DEFAULT_TCP_PORT, GENERATORS, POLL_CLASSES,
+                           POLL_CMDS)
+from poller        import Poller, Scan_Poller
+from psi_message   import Psi_Message
+
+class Generator():
+    """
+    A single RF generator served by the driver.
+    """
+
+    def __init__(self, name: str, ipaddr: str, port: int=None,
+                 chord: str=None, max_depth: int=None, policy: str=None,
+                 conns: Conn_Registry=None, poll_period: float=None,
+                 metrics: Metrics=None, poll_cmds: list=None,
+                 max_age: float=None, scan_classes: dict=None,
+                 adaptive: bool=False):
+        """
+        Initializes the Generator class.
+
+        Inputs:
+            name        (str)             - Name used to address the generator
+            ipaddr      (str)             - IP address of the generator
+            port        (optional, int)   - Modbus port of the generator
+            chord       (optional, str)   - Chord the generator belongs to
+            max_depth   (optional, int)   - Maximum depth of the dispatch queue
+            policy      (optional, str)   - Overload policy ("busy" or "shed")
+            conns       (optional, Conn_Registry) - Registry of client queues
+            poll_period (optional, float) - Polling period (seconds). Polling
+                                            is disabled if not given.
+            metrics     (optional, Metrics) - Metrics of the driver
+            poll_cmds   (optional, list)  - Commands that are polled. Defaults
+                                            to POLL_CMDS in parameters.py
+            max_age     (optional, float) - Answer reads of polled commands
+                                            from the poller while the polled
+                                            value is at most max_age seconds
+                                            old. Every read goes to the
+                                            generator if not given.
+            scan_classes (optional, dict) - Poll by scan class (see
+                                            Scan_Poller in poller.py) instead
+                                            of every poll_period
+            adaptive    (optional, bool)  - Adapt the periods of the scan
+                                            classes to the state of the
+                                            generator
+        """
+        self.name   = name
+        self.ipaddr = ipaddr
+        self.port   = port
+        if (self.port == None): self.port = DEFAULT_TCP_PORT
+        self.chord  = chord
+
+        self.cmd_table = Cmd_Lookup(max_depth, policy, self.ipaddr, self.port,
+                                    conns, metrics)
+
+        self.poller = None
+        if (scan_classes != None):
+            self.poller = Scan_Poller(self.cmd_table, scan_classes, adaptive)
+            self.cmd_table.add_local('GETPOLL?', self.poller.rates)
+        elif (poll_period != None):
+            self.poller = Poller(self.cmd_table, poll_period, poll_cmds)
+
+        if (self.poller != None):
+            if (max_age != None):
+                self.cmd_table.set_cache(
+                    lambda cmd, t_min: self.poller.cached(cmd, max_age, t_min))
+
+        self.board = None # Shared memory board, see telemetry_shm.py
+
+        return
+
+    def start(self):
+        """
+        Starts the poller of the generator (if polling is enabled).
+        """
+        if (self.poller != None):
+            self.poller.start()
+
+        return
+
+    def stop(self):
+        """
+        Stops the poller of the generator (if polling is enabled).
+        """
+        if (self.poller != None):
+            self.poller.stop()
+
+        return
+
+class Gen_Router():
+    """
+    Maps command prefixes to generators.
+    """
+
+    def __init__(self, generators: dict=None, max_depth: int=None,
+                 policy: str=None, poll_period: float=None, publisher=None,
+                 shm: bool=False, max_age: float=None, scan: bool=False,
+                 adaptive: bool=False):
+        """
+        Initializes the Gen_Router class.
+
+        Inputs:
+            generators  (optional, dict)  - Generators to serve, in the format
+                                            of GENERATORS in parameters.py
+                                            (the default)
+            max_depth   (optional, int)   - Maximum depth of the dispatch queue
+                                            of each generator
+            policy      (optional, str)   - Overload policy ("busy" or "shed")
+            poll_period (optional, float) - Default polling period (seconds),
+                                            can be overridden per generator
+            publisher   (optional, Mcast_Publisher) - Publishes the snapshots
+                                            of the pollers (telemetry_mcast.py)
+            shm         (optional, bool)  - Write the snapshots of the pollers
+                                            to shared memory (telemetry_shm.py)
+            max_age     (optional, float) - Answer reads from the pollers
+                                            while the polled value is at most
+                                            max_age seconds old (see Generator)
+            scan        (optional, bool)  - Poll by the scan classes of
+                                            POLL_CLASSES in parameters.py
+                                            instead of every poll_period
+            adaptive    (optional, bool)  - Adapt the periods of the scan
+                                            classes to the state of each
+                                            generator (requires scan)
+        """
+        if (generators == None): generators = GENERATORS
+
+        # Client queues and metrics are shared by all generators
+        self.conns = Conn_Registry()
+        self.metrics = Metrics()
+        self.metrics.add_source('mb_', MB_COUNTERS.get)
+        self.metrics.add_source('conn_', self.conns.stats)
+
+        # The shared memory boards hold all the CMDS reads, not just POLL_CMDS
+        poll_cmds = None
+        if (shm):
+            # Imported on use, multiprocessing is slow to import
+            from telemetry_shm import GEN_FIELDS, gen_board, snapshot_writer
+            poll_cmds = POLL_CMDS + [cmd for cmd in GEN_FIELDS.values()
+                                     if (cmd not in POLL_CMDS)]
+
+        scan_classes = POLL_CLASSES if (scan) else None
+
+        self._gens = {}
+        chords = {}
+        for name, conf in generators.items():
+            gen = Generator(name, conf["ip"], conf.get("port"),
+                            conf.get("chord"), max_depth, policy, self.conns,
+                            conf.get("poll", poll_period), self.metrics,
+                            poll_cmds, max_age, scan_classes, adaptive)
+            self._gens[name.upper()] = gen
+            self.metrics.add_source(f'{name}.', gen.cmd_table.stats)
+            if (scan):
+                self.metrics.add_source(f'{name}.scan_', gen.poller.stats)
+            if ((publisher != None) and (gen.poller != None)):
+                gen.poller.add_listener(publisher.listener(name))
+            if (shm and (gen.poller != None)):
+                gen.board = gen_board(name, True)
+                gen.poller.add_listener(snapshot_writer(gen.board))
+            if (gen.chord != None):
+                chords.setdefault(gen.chord.upper(), []).append(gen)
+
+        # A chord name is an alias of its generator, if it has only one
+        self._alias = {chord: gens[0] for chord, gens in chords.items()
+                       if ((len(gens) == 1) and (chord not in self._gens))}
+
+        self.default = list(self._gens.values())[0]
+
+        return
+
+    def route(self, line: str) -> tuple:
+        """
+        Finds the generator a command is addressed to.
+
+        Inputs:
+            line (str) - Command received from a client, with or without prefix
+
+        Returns:
+            (generator, command) - The generator (None if the prefix is unknown)
+                                   and the command without the prefix
+        """
+        idx = line.find(':')
+        if (idx <= 0):
+            return (self.default, line)
+
+        prefix = line[:idx]
+        if ((prefix.find('?') >= 0) or (prefix.find('$') >= 0)):
+            return (self.default, line)
+
+        prefix = prefix.strip().upper()
+        gen = self._gens.get(prefix)
+        if (gen == None):
+            gen = self._alias.get(prefix)
+
+        return (gen, line[idx+1:].strip())
+
+    def generators(self) -> list:
+        """
+        Returns the list of generators.
+
+        Inputs:
+            None
+        """
+        return list(self._gens.values())
+
+    def start(self):
+        """
+        Starts the pollers of all generators.
+        """
+        func_id = f'{__name__}.start'
+        pmsg = Psi_Message()
+
+        for gen in self._gens.values():
+            pmsg.debug(func_id, f'{gen.name}: {gen.ipaddr}:{gen.port} '
+                                f'(chord {gen.chord})')
+            gen.start()
+
+        return
+
+    def stop(self):
+        """
+        Stops the pollers of all generators.
+        """
+        for gen in self._gens.values():
+            gen.stop()
+
+        return
+
+def parse_gen_args(gen_args: list) -> dict:
+    """
+    Builds a generator table from command line arguments.
+
+    Inputs:
+        gen_args (list) - Strings in the format "NAME=IP[:PORT][@CHORD]"
+
+    Returns:
+        dict - Generators in the format of GENERATORS in parameters.py
+    """
+    generators = {}
+    for arg in gen_args:
+        name, addr = arg.split('=', 1)
+
+        chord = None
+        if (addr.find('@') >= 0):
+            addr, chord = addr.split('@', 1)
+
+        port = DEFAULT_TCP_PORT
+        if (addr.find(':') >= 0):
+            addr, port = addr.split(':', 1)
+
+        generators[name.strip()] = {"ip": addr.strip(), "port": int(port),
+                                    "chord": chord}
+
+    return generators
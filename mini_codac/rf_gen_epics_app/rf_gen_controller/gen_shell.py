@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+# Interactive shell for a Cito Plus RF generator, for checks on the bench.
+# It talks Modbus to the generator through rf_gen_controller.py, and the
+# connection stays open for the whole session (see Modbus_Pool in
+# modbus_client.py). Every command prints its round-trip time.
+#
+#     cito> get fwd_pwr
+#     cito> set power_set_point 50000
+#     cito> read 8000 i          (raw command number, like "Read" in the GUI)
+#     cito> repeat 1000 get state
+#     cito> every 0.5 get rfl_pwr
+#
+# "repeat N <command>" runs a command N times as fast as possible and prints
+# the latency percentiles and the throughput. "every T <command>" runs it every
+# T seconds, on a fixed schedule, until Ctrl-C.
+
+import argparse
+import cmd
+import math
+import time
+
+from metrics           import percentile
+from parameters        import CMDS, DEFAULT_IP_ADDR, DEFAULT_TCP_PORT
+from psi_message       import ERROR, configure
+from rf_gen_controller import list_params, read_raw, write_raw
+
+# Response types of the raw reads, as in the GUI ("i" and "s")
+RESP_TYPES = {"i": "int", "s": "str", "b": "bytes",
+              "int": "int", "str": "str", "bytes": "bytes"}
+
+def _format(value) -> str:
+    """
+    Returns a response for printing. Bytes are printed as numbers, i.e. the IP
+    address as "192 168 0 150".
+    """
+    if (isinstance(value, bytes)):
+        return ' '.join(str(byte) for byte in value)
+
+    return str(value)
+
+class Gen_Shell(cmd.Cmd):
+    """
+    The shell. Every command that talks to the generator is parsed into a
+    function by _parse, so that repeat and every can run it.
+    """
+
+    intro = 'Cito Plus shell. Type help or ? to list the commands.'
+
+    def __init__(self, ipaddr: str=None, port: int=None):
+        """
+        Initializes the Gen_Shell class.
+
+        Inputs:
+            ipaddr (optional, str) - IP address of the generator. Defaults to
+                                     DEFAULT_IP_ADDR in parameters.py
+            port   (optional, int) - Modbus port. Defaults to DEFAULT_TCP_PORT
+        """
+        super().__init__()
+        self._connect(ipaddr, port)
+
+        return
+
+    def _connect(self, ipaddr: str, port: int):
+        if (ipaddr == None): ipaddr = DEFAULT_IP_ADDR
+        if (port == None): port = DEFAULT_TCP_PORT
+
+        self.ipaddr = ipaddr
+        self.port   = int(port)
+        self.prompt = f'cito {self.ipaddr}:{self.port}> '
+
+        return
+
+    def _parse(self, line: str):
+        """
+        Parses a generator command (get, set, read or write).
+
+        Returns:
+            A function that executes the command and returns its response
+        """
+        words = line.split()
+        if (not words):
+            raise ValueError('Missing command')
+
+        verb, args = words[0], words[1:]
+        dev = (self.ipaddr, self.port)
+
+        if (verb == 'get'):
+            if ((len(args) != 1) or (args[0] not in CMDS)):
+                raise ValueError('Usage: get PARAM (see params)')
+            cmd_num, resp_type = CMDS[args[0]]
+            return lambda: read_raw(cmd_num, resp_type, *dev)
+
+        if (verb == 'set'):
+            if ((len(args) != 2) or (args[0] not in CMDS)):
+                raise ValueError('Usage: set PARAM VALUE (see params)')
+            cmd_num, value = CMDS[args[0]][0], int(args[1])
+            return lambda: write_raw(cmd_num, value, *dev)
+
+        if (verb == 'read'):
+            if ((len(args) < 1) or (len(args) > 2)):
+                raise ValueError('Usage: read NUMBER [i|s|b]')
+            resp_type = RESP_TYPES.get(args[1] if (len(args) > 1) else 'i')
+            if (resp_type == None):
+                raise ValueError('The type is i (integer), s (string) or b '
+                                 '(bytes)')
+            cmd_num = int(args[0])
+            return lambda: read_raw(cmd_num, resp_type, *dev)
+
+        if (verb == 'write'):
+            if (len(args) != 2):
+                raise ValueError('Usage: write NUMBER VALUE')
+            cmd_num, value = int(args[0]), int(args[1])
+            return lambda: write_raw(cmd_num, value, *dev)
+
+        raise ValueError(f'Unknown command: {verb}')
+
+    def _run_once(self, line: str):
+        """
+        Executes a generator command and prints the response and the round-
+        trip time.
+        """
+        try:
+            func = self._parse(line)
+        except ValueError as exc:
+            print(exc)
+            return
+
+        t_start = time.perf_counter()
+        try:
+            resp = func()
+        except Exception as exc:
+            print(f'ERROR: {exc}')
+            return
+        rtt = time.perf_counter() - t_start
+
+        if (resp == None): resp = 'OK'
+        print(f'{_format(resp)}  ({1000.0*rtt:.2f} ms)')
+
+        return
+
+    def do_get(self, arg: str):
+        """get PARAM - Reads a parameter (see params)"""
+        self._run_once(f'get {arg}')
+
+    def do_set(self, arg: str):
+        """set PARAM VALUE - Writes a parameter (see params)"""
+        self._run_once(f'set {arg}')
+
+    def do_read(self, arg: str):
+        """read NUMBER [i|s|b] - Reads a command number, the response is an
+        integer (default), a string or bytes"""
+        self._run_once(f'read {arg}')
+
+    def do_write(self, arg: str):
+        """write NUMBER VALUE - Writes an integer to a command number"""
+        self._run_once(f'write {arg}')
+
+    def do_params(self, arg: str):
+        """params - Lists the parameters of get and set"""
+        for name in list_params():
+            cmd_num, resp_type = CMDS[name]
+            print(f'{name:<20}{cmd_num:>6}  {resp_type}')
+
+    def do_repeat(self, arg: str):
+        """repeat N COMMAND - Runs a generator command N times back to back
+        and prints the latency and the throughput"""
+        words = arg.split(None, 1)
+        try:
+            num = int(words[0])
+            func = self._parse(words[1])
+        except (IndexError, ValueError) as exc:
+            print(f'Usage: repeat N COMMAND ({exc})')
+            return
+
+        rtts = []
+        errors = 0
+        t_start = time.perf_counter()
+        try:
+            for irep in range(num):
+                t_cmd = time.perf_counter()
+                try:
+                    func()
+                except Exception:
+                    errors += 1
+                    continue
+                rtts.append(time.perf_counter() - t_cmd)
+        except KeyboardInterrupt:
+            pass
+        t_total = time.perf_counter() - t_start
+
+        if (not rtts):
+            print(f'{errors} errors')
+            return
+
+        rtts.sort()
+        print(f'{len(rtts)} ok, {errors} errors in {t_total:.3f} s: '
+              f'{(len(rtts) + errors)/t_total:.1f} cmd/s')
+        print(f'rtt ms: min {1000.0*rtts[0]:.2f}  '
+              f'mean {1000.0*sum(rtts)/len(rtts):.2f}  '
+              f'p50 {1000.0*percentile(rtts, 50.0):.2f}  '
+              f'p99 {1000.0*percentile(rtts, 99.0):.2f}  '
+              f'max {1000.0*rtts[-1]:.2f}')
+
+    def do_every(self, arg: str):
+        """every T COMMAND - Runs a generator command every T seconds, until
+        Ctrl-C. Prints the time, the response and the round-trip time"""
+        words = arg.split(None, 1)
+        try:
+            period = float(words[0])
+            self._parse(words[1])
+        except (IndexError, ValueError) as exc:
+            print(f'Usage: every T COMMAND ({exc})')
+            return
+        if ((not math.isfinite(period)) or (period <= 0.0)):
+            print(f'Usage: every T COMMAND (T must be a number greater than '
+                  f'0, not {words[0]})')
+            return
+
+        # Fixed schedule from the start, so the period does not drift. Missed
+        # times are skipped
+        t_next = time.monotonic()
+        try:
+            while True:
+                # In steps, time.sleep overflows for very long delays
+                delay = t_next - time.monotonic()
+                while (delay > 0):
+                    time.sleep(min(delay, 60.0))
+                    delay = t_next - time.monotonic()
+                print(time.strftime('%H:%M:%S '), end='')
+                self._run_once(words[1])
+
+                t_next += period
+                t_now = time.monotonic()
+                if (t_next < t_now):
+                    t_next += (int((t_now - t_next)/period) + 1)*period
+        except KeyboardInterrupt:
+            print()
+
+    def do_connect(self, arg: str):
+        """connect IP [PORT] - Talks to another generator"""
+        words = arg.split()
+        if ((len(words) < 1) or (len(words) > 2)):
+            print('Usage: connect IP [PORT]')
+            return
+
+        port = None
+        if (len(words) > 1):
+            try:
+                port = int(words[1])
+            except ValueError as exc:
+                print(f'Usage: connect IP [PORT] ({exc})')
+                return
+            if ((port < 1) or (port > 65535)):
+                print(f'Usage: connect IP [PORT] (PORT must be 1..65535, not '
+                      f'{port})')
+                return
+
+        self._connect(words[0], port)
+
+    def do_quit(self, arg: str):
+        """quit - Leaves the shell"""
+        return True
+
+    do_exit = do_quit
+
+    def do_EOF(self, arg: str):
+        print()
+        return True
+
+    def emptyline(self):
+        # Do not repeat the last command, it may be a write
+        return False
+
+def main():
+    descript = '''Interactive shell for a Cito Plus RF generator'''
+    ip_help  = f'''IP address of the generator. Default: {DEFAULT_IP_ADDR}'''
+    prt_help = f'''Modbus port of the generator. Default: {DEFAULT_TCP_PORT}'''
+    cmd_help = '''Run these shell commands (separated by ";") and exit'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('-i', '--ip', help = ip_help, default = None)
+    parser.add_argument('-p', '--port', help = prt_help, type = int,
+                        default = None)
+    parser.add_argument('-c', '--command', help = cmd_help, default = None)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    # Errors are printed by the shell itself
+    configure(ERROR)
+
+    shell = Gen_Shell(args['ip'], args['port'])
+    if (args['command'] != None):
+        for line in args['command'].split(';'):
+            shell.onecmd(line.strip())
+        return
+
+    shell.cmdloop()
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
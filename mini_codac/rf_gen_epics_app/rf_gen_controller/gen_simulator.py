@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+# Simulator of the Modbus-TCP interface of a Cito Plus RF generator. It answers
+# the read (0x41) and write (0x42) commands of the CMDS table in parameters.py
+# the same way the generator does, so the driver, the load generator and the
+# command line tools can be run without hardware. Writes to the power set
+# point, RF on/off, match mode and capacitor positions change the simulated
+# state, i.e. the forward power follows the set point while RF is on.
+
+import argparse
+import random
+import socket
+import struct
+import threading
+import time
+
+from parameters import CMDS
+
+# Generator states (command 8000)
+READY  = 1 # Ready (RF Off)
+ACTIVE = 2 # Active (RF On)
+
+class Gen_Simulator():
+    """
+    Simulated RF generator listening on one TCP port.
+    """
+
+    def __init__(self, host_ip: str='127.0.0.1', port: int=0,
+                 latency: float=0.0, jitter: float=0.0, name: str=None):
+        """
+        Initializes the Gen_Simulator class.
+
+        Inputs:
+            host_ip (optional, str)   - IP address to listen on
+            port    (optional, int)   - Port to listen on. 0 picks a free port
+            latency (optional, float) - Time the generator takes to answer a
+                                        command (seconds)
+            jitter  (optional, float) - Random extra time added to the latency
+                                        (seconds, uniformly distributed)
+            name    (optional, str)   - Host name reported by the generator
+        """
+        self.latency = latency
+        self.jitter  = jitter
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host_ip, port))
+        self._sock.listen()
+        self.host_ip, self.port = self._sock.getsockname()[:2]
+
+        if (name == None): name = f'citoplus-{self.port}'
+
+        self._lock = threading.Lock()
+        self._vals = {CMDS["get_ip"][0]: socket.inet_aton(self.host_ip),
+                      CMDS["get_date"][0]: time.strftime('%Y-%m-%d').encode(),
+                      CMDS["ctrl_src"][0]: 2,
+                      CMDS["power_set_point"][0]: 5000,
+                      CMDS["state"][0]: READY,
+                      CMDS["rf"][0]: 0,
+                      CMDS["read_load_cap"][0]: 500,
+                      CMDS["read_tune_cap"][0]: 500,
+                      CMDS["match_mode"][0]: 2,
+                      CMDS["hostname"][0]: name.encode(),
+                      CMDS["domain_name"][0]: b'local',
+                      CMDS["phase_shift"][0]: 0}
+
+        self.num_cmds = 0
+        self._running = True
+        self._thread  = None
+
+        return
+
+    def start(self):
+        """
+        Starts accepting connections in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve, daemon=True)
+        self._thread.start()
+
+        return
+
+    def stop(self):
+        """
+        Stops accepting connections.
+        """
+        self._running = False
+        self._sock.close()
+
+        return
+
+    def serve(self):
+        """
+        Accepts connections until stopped. Each connection is served in its own
+        thread.
+        """
+        while (self._running):
+            try:
+                conn, addr = self._sock.accept()
+            except OSError:
+                break
+
+            # Pipelined reads (see Modbus_Client.read_many) get their answers
+            # back to back, which Nagle would hold for the delayed ACK
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            client = threading.Thread(target=self._serve_conn, args=(conn,),
+                                      daemon=True)
+            client.start()
+
+        return
+
+    def _serve_conn(self, conn: socket.socket):
+        """
+        Answers the commands received on one connection, in order.
+        """
+        with conn:
+            while True:
+                hdr = _recv_exact(conn, 6)
+                if (hdr == None):
+                    break
+
+                body = _recv_exact(conn, struct.unpack('>H', hdr[4:6])[0])
+                if (body == None):
+                    break
+
+                delay = self.latency + random.uniform(0.0, self.jitter)
+                if (delay > 0.0):
+                    time.sleep(delay)
+
+                try:
+                    conn.sendall(hdr[0:4] + self._answer(body))
+                except OSError:
+                    break
+
+        return
+
+    def _answer(self, body: bytes) -> bytes:
+        """
+        Builds the response to a command.
+
+        Inputs:
+            body (bytes) - Command without the 6 byte header
+
+        Returns:
+            The response, starting with the length field of the header
+        """
+        addr, fcode, cmd_num = struct.unpack('>BBH', body[0:4])
+
+        with self._lock:
+            self.num_cmds += 1
+
+            if (fcode == 0x41):
+                value = self._read(cmd_num)
+                if (value == None):
+                    resp = struct.pack('>BBB', addr, fcode | 0x80, 0x02)
+                else:
+                    resp = struct.pack('>BBB', addr, fcode, len(value)) + value
+
+            elif (fcode == 0x42):
+                self._write(cmd_num, struct.unpack('>I', body[4:8])[0])
+                resp = struct.pack('>BBH', addr, fcode, cmd_num) + body[4:8]
+
+            else:
+                resp = struct.pack('>BBB', addr, fcode | 0x80, 0x01)
+
+        return struct.pack('>H', len(resp)) + resp
+
+    def _read(self, cmd_num: int) -> bytes:
+        """
+        Returns the value of a parameter as bytes, or None if unknown. Must be
+        called with the lock held.
+        """
+        if (cmd_num == CMDS["fwd_pwr"][0]):
+            value = 0
+            if (self._vals[CMDS["rf"][0]]):
+                value = int(self._vals[CMDS["power_set_point"][0]]*
+                            random.uniform(0.98, 1.0))
+        elif (cmd_num == CMDS["rfl_pwr"][0]):
+            value = 0
+            if (self._vals[CMDS["rf"][0]]):
+                value = random.randint(0, 50)
+        else:
+            value = self._vals.get(cmd_num)
+
+        if (value == None):
+            return None
+
+        if (isinstance(value, bytes)):
+            return value
+
+        return struct.pack('>i', value)
+
+    def _write(self, cmd_num: int, value: int):
+        """
+        Writes a parameter. Must be called with the lock held.
+        """
+        if (cmd_num == CMDS["move_load_cap"][0]):
+            self._vals[CMDS["read_load_cap"][0]] = value
+        elif (cmd_num == CMDS["move_tune_cap"][0]):
+            self._vals[CMDS["read_tune_cap"][0]] = value
+        else:
+            self._vals[cmd_num] = value
+
+        if (cmd_num == CMDS["rf"][0]):
+            self._vals[CMDS["state"][0]] = ACTIVE if (value) else READY
+
+        return
+
+def _recv_exact(conn: socket.socket, num: int) -> bytes:
+    """
+    Receives exactly num bytes, or returns None if the connection is closed.
+    """
+    data = b''
+    while (len(data) < num):
+        try:
+            chunk = conn.recv(num - len(data))
+        except OSError:
+            return None
+
+        if (not chunk):
+            return None
+        data += chunk
+
+    return data
+
+def main():
+    descript = '''Simulator of the Modbus-TCP interface of a Cito Plus RF
+                  generator'''
+    ip_help  = '''IP address to listen on'''
+    prt_help = '''First port to listen on'''
+    num_help = '''Number of simulated generators. They listen on consecutive
+                  ports starting at PORT'''
+    lat_help = '''Time (seconds) the generator takes to answer a command'''
+    jit_help = '''Random extra time (seconds) added to the latency'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('IP', help = ip_help)
+    parser.add_argument('PORT', help = prt_help, type = int)
+    parser.add_argument('-n', '--num', help = num_help, type = int, default = 1)
+    parser.add_argument('-l', '--latency', help = lat_help, type = float,
+                        default = 0.0)
+    parser.add_argument('-j', '--jitter', help = jit_help, type = float,
+                        default = 0.0)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    sims = []
+    for isim in range(args['num']):
+        sim = Gen_Simulator(args['IP'], args['PORT'] + isim, args['latency'],
+                            args['jitter'])
+        sim.start()
+        sims.append(sim)
+        print(f'Simulated generator listening on {sim.host_ip}:{sim.port}')
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+    for sim in sims:
+        sim.stop()
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+# Supervisor of driver worker processes. A single driver does the Modbus I/O
+# and the decoding of all its generators in one Python process, so with many
+# generators it is bound by the GIL to one core. The supervisor splits the
+# generators into groups, one per chord (CHORD_NAMES) by default or one per
+# generator with --PER device, and runs a complete driver (tcp_server.py) for
+# each group in its own process:
+#
+#     gen_supervisor.py 0.0.0.0 5000 -g GEN1=169.254.1.1@GAA0 \
+#                                    -g GEN2=169.254.1.2@GAB0 ...
+#
+#     GAA0  pid 4711  port 5000  GEN1
+#     GAB0  pid 4712  port 5001  GEN2
+#
+# The workers listen on consecutive ports from PORT, in the order of the
+# groups, and share nothing: each is started with the spawn method, has its own
+# lookup tables, connections and poller, and is restarted if it dies (see
+# SUPERVISOR_RESTART in parameters.py). A client talks to the worker of its
+# generator as it would to a driver.
+#
+# Every worker polls its generators and writes the snapshots to the shared
+# memory boards of telemetry_shm.py. The supervisor reads the boards of all
+# workers into one view of all generators (Gen_Supervisor.view), which it
+# prints every --VIEW seconds. It attaches to the boards of a worker once the
+# worker reports that they exist, and removes the boards of a dead worker
+# before it restarts it, so it never keeps reading a board nobody writes.
+
+import argparse
+import multiprocessing
+import signal
+import time
+
+from parameters  import (GENERATORS, SUPERVISOR_POLL, SUPERVISOR_RESTART,
+                         SUPERVISOR_RESTART_MAX, SUPERVISOR_STABLE)
+from psi_message import ERROR, Psi_Message, configure
+
+GROUPINGS = ['chord', 'device']
+
+def group_generators(generators: dict, per: str='chord') -> dict:
+    """
+    Splits generators into the groups served by the workers.
+
+    Inputs:
+        generators (dict)          - Generators, in the format of GENERATORS
+        per        (optional, str) - "chord" (a group per chord, generators
+                                     without a chord get their own group) or
+                                     "device" (a group per generator)
+
+    Returns:
+        dict - {group name: generators of the group}, in the order of the
+               generators
+    """
+    groups = {}
+    for name, conf in generators.items():
+        group = name
+        if ((per == 'chord') and (conf.get("chord") != None)):
+            group = conf["chord"].upper()
+        groups.setdefault(group, {})[name] = conf
+
+    return groups
+
+def _run_worker(host_ip: str, port: int, generators: dict, poll_period: float,
+                max_queue: int, policy: str, ready):
+    """
+    Entry point of a worker process: a driver for a group of generators.
+    ready (multiprocessing.Event) is set once its boards exist.
+    """
+    # Ctrl-C goes to the whole process group, the supervisor stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from tcp_server import tcp_server
+
+    tcp_server(host_ip, port, None, poll_period, max_queue, None, policy,
+               generators, shm=True, ready=ready)
+
+    return
+
+class Worker():
+    """
+    A worker process and its restart state.
+    """
+
+    def __init__(self, group: str, port: int, generators: dict):
+        """
+        Initializes the Worker class.
+
+        Inputs:
+            group      (str)  - Name of the group (chord or generator)
+            port       (int)  - Port the worker listens on
+            generators (dict) - Generators of the group
+        """
+        self.group      = group
+        self.port       = port
+        self.generators = generators
+        self.proc       = None
+        self.ready      = None # Set by the worker once its boards exist
+        self.restarts   = 0
+        self.t_start    = 0.0
+        self.t_restart  = None # Time of the pending restart
+        self.delay      = SUPERVISOR_RESTART
+
+        return
+
+class Gen_Supervisor():
+    """
+    Starts the workers, restarts them when they die and aggregates their
+    telemetry.
+    """
+
+    def __init__(self, host_ip: str, port: int, generators: dict=None,
+                 per: str='chord', poll_period: float=None,
+                 max_queue: int=None, policy: str=None):
+        """
+        Initializes the Gen_Supervisor class.
+
+        Inputs:
+            host_ip     (str)             - IP address the workers listen on
+            port        (int)             - Port of the first worker, the
+                                            others use the following ports
+            generators  (optional, dict)  - Generators to serve. Defaults to
+                                            GENERATORS in parameters.py
+            per         (optional, str)   - Worker per "chord" or per "device"
+            poll_period (optional, float) - Polling period of the workers.
+                                            Defaults to SUPERVISOR_POLL
+            max_queue   (optional, int)   - Maximum depth of the dispatch
+                                            queues of the workers
+            policy      (optional, str)   - Overload policy of the workers
+        """
+        if (generators == None): generators = GENERATORS
+        if (poll_period == None): poll_period = SUPERVISOR_POLL
+
+        self.host_ip     = host_ip
+        self.poll_period = poll_period
+        self.max_queue   = max_queue
+        self.policy      = policy
+
+        # Nothing is inherited from the supervisor
+        self._ctx = multiprocessing.get_context('spawn')
+
+        self.workers = [Worker(group, int(port) + igroup, gens)
+                        for igroup, (group, gens) in
+                        enumerate(group_generators(generators, per).items())]
+
+        self._boards = {} # Generator name -> attached telemetry board
+
+        return
+
+    def _start(self, worker: Worker):
+        # A new worker creates new boards. The boards of a worker that died
+        # are removed first, or the view could attach to one of them again
+        # before the new worker has replaced it.
+        from telemetry_shm import remove_gen_board
+        for name in worker.generators:
+            board = self._boards.pop(name, None)
+            if (board != None):
+                board.close()
+            remove_gen_board(name)
+
+        worker.ready = self._ctx.Event()
+        worker.proc = self._ctx.Process(target=_run_worker,
+                                        name=f'rf_gen_{worker.group}',
+                                        args=(self.host_ip, worker.port,
+                                              worker.generators,
+                                              self.poll_period,
+                                              self.max_queue, self.policy,
+                                              worker.ready),
+                                        daemon=True)
+        worker.proc.start()
+        worker.t_start = time.monotonic()
+        worker.t_restart = None
+
+        return
+
+    def start(self):
+        """
+        Starts all workers.
+        """
+        for worker in self.workers:
+            self._start(worker)
+
+        return
+
+    def check(self):
+        """
+        Restarts the workers that died. A worker that keeps dying soon after
+        its start is restarted with a growing delay.
+        """
+        func_id = f'{__name__}.check'
+        pmsg = Psi_Message()
+
+        t_now = time.monotonic()
+        for worker in self.workers:
+            if (worker.proc.is_alive()):
+                continue
+
+            if (worker.t_restart == None):
+                if (t_now - worker.t_start >= SUPERVISOR_STABLE):
+                    worker.delay = SUPERVISOR_RESTART
+                pmsg.error(func_id, f'Worker {worker.group} (pid '
+                                    f'{worker.proc.pid}) exited with '
+                                    f'{worker.proc.exitcode}, restart in '
+                                    f'{worker.delay:.1f} s')
+                worker.t_restart = t_now + worker.delay
+                worker.delay = min(2.0*worker.delay, SUPERVISOR_RESTART_MAX)
+
+            elif (t_now >= worker.t_restart):
+                worker.restarts += 1
+                self._start(worker)
+
+        return
+
+    def stop(self):
+        """
+        Stops all workers.
+        """
+        for worker in self.workers:
+            if (worker.proc.is_alive()):
+                worker.proc.terminate()
+        for worker in self.workers:
+            worker.proc.join(5.0)
+
+        for board in self._boards.values():
+            board.close()
+        self._boards = {}
+
+        # The workers were terminated and could not remove their boards
+        from telemetry_shm import remove_gen_board
+        for worker in self.workers:
+            for name in worker.generators:
+                remove_gen_board(name)
+
+        return
+
+    def _board(self, worker: Worker, name: str):
+        board = self._boards.get(name)
+        if (board == None):
+            # The worker has not created it yet
+            if (not worker.ready.is_set()):
+                return None
+
+            from telemetry_shm import gen_board
+            try:
+                board = gen_board(name)
+            except FileNotFoundError:
+                return None
+            self._boards[name] = board
+
+        return board
+
+    def view(self) -> dict:
+        """
+        Returns the latest telemetry of all generators, read from the boards of
+        the workers.
+
+        Returns:
+            dict - {generator name: {"group", "pid", "alive", "restarts",
+                   "time", "values"}}, "time" and "values" as read by
+                   Shm_Board.read (None and {} before the first snapshot)
+        """
+        gens = {}
+        for worker in self.workers:
+            for name in worker.generators:
+                snap = None
+                board = self._board(worker, name)
+                if (board != None):
+                    snap = board.read()
+                if (snap == None):
+                    snap = {"time": None, "values": {}}
+
+                gens[name] = {"group": worker.group, "pid": worker.proc.pid,
+                              "alive": worker.proc.is_alive(),
+                              "restarts": worker.restarts,
+                              "time": snap["time"], "values": snap["values"]}
+
+        return gens
+
+    def status(self) -> list:
+        """
+        Returns a line per worker: group, pid, port, restarts and generators.
+        """
+        lines = []
+        for worker in self.workers:
+            state = '' if (worker.proc.is_alive()) else '  (down)'
+            lines.append(f'{worker.group:<6}pid {worker.proc.pid:<8}'
+                         f'port {worker.port:<7}restarts {worker.restarts:<4}'
+                         f'{" ".join(worker.generators)}{state}')
+
+        return lines
+
+def print_view(view: dict):
+    """
+    Prints the view of Gen_Supervisor.view, a line per generator.
+    """
+    t_now = time.time()
+    for name, gen in view.items():
+        age = '-' if (gen["time"] == None) else f'{t_now - gen["time"]:.1f}s'
+        values = ' '.join(f'{field}={value}'
+                          for field, value in gen["values"].items())
+        state = 'up' if (gen["alive"]) else 'DOWN'
+        print(f'{name:<8}{gen["group"]:<6}{state:<5}age {age:<7}{values}')
+    print()
+
+    return
+
+def main():
+    descript = '''Runs a driver worker process per chord or per generator and
+                  restarts the workers that die'''
+    ip_help  = '''IP address the workers listen on'''
+    prt_help = '''Port of the first worker, the other workers listen on the
+                  following ports'''
+    per_help = '''Run a worker per chord (default) or per device'''
+    gen_help = '''Generator, NAME=IP[:PORT][@CHORD]. May be given several
+                  times. Default: GENERATORS in parameters.py'''
+    pol_help = f'''Polling period (seconds) of the workers. Default:
+                   {SUPERVISOR_POLL}'''
+    que_help = '''Maximum number of requests waiting for a generator'''
+    ovl_help = '''What to do when a queue is full, see rf_gen_tcp_driver.py'''
+    viw_help = '''Print the telemetry of all generators every VIEW seconds'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('IP', help = ip_help)
+    parser.add_argument('PORT', help = prt_help, type = int)
+    parser.add_argument('-w', '--PER', help = per_help, choices = GROUPINGS,
+                        default = 'chord')
+    parser.add_argument('-g', '--GEN', help = gen_help, action = 'append',
+                        default = None)
+    parser.add_argument('-p', '--POLL', help = pol_help, type = float,
+                        default = None)
+    parser.add_argument('-q', '--QUEUE', help = que_help, type = int,
+                        default = None)
+    parser.add_argument('-o', '--POLICY', help = ovl_help,
+                        choices = ['busy', 'shed'], default = None)
+    parser.add_argument('-v', '--VIEW', help = viw_help, type = float,
+                        default = None)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    configure(ERROR)
+
+    generators = None
+    if (args['GEN'] != None):
+        from gen_router import parse_gen_args
+        generators = parse_gen_args(args['GEN'])
+
+    sup = Gen_Supervisor(args['IP'], args['PORT'], generators, args['PER'],
+                         args['POLL'], args['QUEUE'], args['POLICY'])
+
+    # SIGTERM stops the workers like Ctrl-C
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+
+    sup.start()
+    for line in sup.status():
+        print(line)
+
+    t_view = time.monotonic()
+    try:
+        while True:
+            time.sleep(0.2)
+            sup.check()
+            if ((args['VIEW'] != None) and (time.monotonic() >= t_view)):
+                print_view(sup.view())
+                t_view += args['VIEW']
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sup.stop()
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
@@ -1,53 +1,280 @@
 #!/usr/bin/env python3
 
+# Several operations may be given in one invocation (batch mode), i.e.
+#
+#     gen_test_app.py -s -fp -rp -tcp -lcp -p 50000
+#
+# They are executed in command line order, in one process, so every command
+# goes over the same pooled connection to the generator (see modbus_client.py).
+# The results are printed as one record, CSV (a header line and a value line)
+# or JSON, with a column per operation. A single operation prints its result
+# as text, unless --format is given.
+#
+# With --watch PERIOD the parameters read by the given options (WATCH_OPS if
+# none is given) are read every PERIOD seconds until interrupted, i.e.
+#
+#     gen_test_app.py --watch 0.1 -fp -rp -o power.csv
+#
+# Every sample is a timestamped row (CSV, or a JSON line with --format json)
+# with the value and the read time (ms) of each parameter. Samples are
+# scheduled at fixed times from the start, so the rate does not drift, and
+# "late_ms" is how late a sample started. Sample times that are missed because
+# the reads took longer than the period are skipped and counted in "missed".
+#
+# If the local daemon (gen_daemon.py) is running, the commands are forwarded
+# to it, which holds the connections to the generator open and answers recent
+# reads from its polled values. --no_daemon talks to the generator directly.
+
 import argparse
+import sys
+import time
+
+from gen_daemon  import connect
+from psi_message import ERROR, configure
+
+# Functions that talk to the generator: rf_gen_controller, or the daemon
+# backend with the same functions (see gen_daemon.py). Set by main()
+ctrl = None
+
+# Operations of batch mode. option: (kind, read function, write function)
+#     read  - option without a value, the parameter is read
+#     write - option without a value, the write function is called
+#     value - the value is written, or the parameter read if the value is "get"
+OPS = {'ctrl_src': ('read', 'get_control_source', None),
+       'date': ('read', 'get_date', None),
+       'domain': ('read', 'get_domain', None),
+       'fwd_pwr': ('read', 'get_forward_power', None),
+       'ip_addr': ('value', 'get_ip', None),
+       'match': ('value', 'get_match_mode', 'set_match_mode'),
+       'hostname': ('read', 'get_hostname', None),
+       'power': ('value', 'get_power', 'set_power'),
+       'rf_off': ('write', None, 'rf_off'),
+       'rf_on': ('write', None, 'rf_on'),
+       'rfl_pwr': ('read', 'get_reflected_power', None),
+       'state': ('read', 'get_state', None),
+       'rd_tc': ('read', 'get_tune_cap', None),
+       'rd_lc': ('read', 'get_load_cap', None),
+       'set_tc': ('value', None, 'set_tune_cap'),
+       'set_lc': ('value', None, 'set_load_cap'),
+       'phase': ('read', 'get_phase', None)}
+
+FORMATS = ['csv', 'json']
+
+# Parameters read by --watch if no operation is given
+WATCH_OPS = ['state', 'power', 'fwd_pwr', 'rfl_pwr', 'rd_tc', 'rd_lc']
+
+class Record_Op(argparse.Action):
+    """
+    Stores an operation option like the default actions, and also appends it
+    to the "ops" list of the namespace, which keeps the command line order.
+    Options without a value (nargs=0) are stored as True.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if (self.nargs == 0): values = True
+
+        setattr(namespace, self.dest, values)
+        ops = getattr(namespace, 'ops', None)
+        if (ops == None): ops = []
+        ops.append((self.dest, values))
+        namespace.ops = ops
+
+        return
 
-from modbus_client import Modbus_Client
-from rf_gen_controller import (get_forward_power,
-                               get_control_source,
-                               get_date,
-                               get_domain,
-                               get_hostname,
-                               get_ip,
-                               get_match_mode,
-                               get_phase,
-                               get_power,
-                               get_state,
-                               get_reflected_power,
-                               get_load_cap,
-                               get_tune_cap,
-                               rf_on, rf_off,
-                               set_load_cap,
-                               set_match_mode,
-                               set_power,
-                               set_tune_cap)
+def run_op(dest: str, value: str|bool) -> str|int:
+    """
+    Runs one operation of batch mode.
+
+    Inputs:
+        dest  (str)      - Option of the operation (key of OPS)
+        value (str|bool) - Value of the option, True if it takes none
+
+    Returns:
+        The value read, the value written, or 1 for a write without a value
+    """
+    kind, read_name, write_name = OPS[dest]
+    read_func = getattr(ctrl, read_name) if (read_name) else None
+    write_func = getattr(ctrl, write_name) if (write_name) else None
+
+    if ((kind == 'read') or ((kind == 'value') and (value == 'get'))):
+        if (read_func == None):
+            raise ValueError(f'{dest} cannot be read')
+        return read_func()
+
+    if (kind == 'write'):
+        write_func()
+        return 1
+
+    if (write_func == None):
+        raise ValueError(f'{dest} cannot be set')
+
+    value = int(value)
+    if ((dest == 'match') and ((value < 1) or (value > 2))):
+        raise ValueError(f'The match mode should be either 1 or 2, not {value}')
+    write_func(value)
+
+    return value
+
+def run_batch(ops: list, fmt: str, header: bool=True) -> bool:
+    """
+    Runs the operations in order and prints the results as one record. An
+    operation that fails gets "ERROR: <reason>" as its value, and the other
+    operations still run.
+
+    Inputs:
+        ops    (list)           - [(option, value)] in command line order
+        fmt    (str)            - "csv" or "json"
+        header (optional, bool) - Print the CSV header line
+
+    Returns:
+        bool - True if every operation succeeded
+    """
+    record = {"time": time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+    success = True
+    for dest, value in ops:
+        # An operation given twice gets a numbered column
+        column = dest
+        num = 2
+        while (column in record):
+            column = f'{dest}_{num}'
+            num += 1
+
+        try:
+            record[column] = run_op(dest, value)
+        except Exception as exc:
+            record[column] = f'ERROR: {exc}'
+            success = False
+
+    if (fmt == 'json'):
+        import json
+        print(json.dumps(record))
+    else:
+        import csv
+        writer = csv.writer(sys.stdout)
+        if (header):
+            writer.writerow(record.keys())
+        writer.writerow(record.values())
+
+    return success
+
+def _timestamp(t_wall: float) -> str:
+    """
+    Returns a time.time() as an ISO 8601 local time with milliseconds.
+    """
+    msec = int((t_wall % 1.0)*1000.0)
+
+    return time.strftime(f'%Y-%m-%dT%H:%M:%S.{msec:03d}%z',
+                         time.localtime(t_wall))
+
+def watch(ops: list, period: float, fmt: str, out_file: str=None,
+          count: int=None, header: bool=True):
+    """
+    Reads parameters at a fixed rate and writes a row per sample, until
+    interrupted (Ctrl-C) or count samples were written.
+
+    Inputs:
+        ops      (list)           - [(option, value)] of read operations. The
+                                    value of an option that takes one must be
+                                    "get"
+        period   (float)          - Sample period (seconds)
+        fmt      (str)            - "csv" or "json" (JSON lines)
+        out_file (optional, str)  - File the rows are appended to. Defaults
+                                    to stdout
+        count    (optional, int)  - Number of samples. Defaults to unlimited
+        header   (optional, bool) - Write the CSV header line
+    """
+    if (not (period > 0.0)):
+        raise ValueError(f'The --watch period must be greater than 0, not '
+                         f'{period}')
+
+    for dest, value in ops:
+        if ((OPS[dest][0] == 'write') or
+            ((OPS[dest][0] == 'value') and (value != 'get')) or
+            (OPS[dest][1] == None)):
+            raise ValueError(f'--watch only reads parameters, {dest} is not '
+                             f'a read')
+
+    columns = ['time', 'late_ms', 'missed']
+    for dest, value in ops:
+        columns += [dest, f'{dest}_ms']
+
+    out = sys.stdout if (out_file == None) else open(out_file, 'a')
+    if (fmt == 'json'):
+        import json
+        write_row = lambda row: out.write(json.dumps(dict(zip(columns, row)))
+                                          + '\n')
+    else:
+        import csv
+        write_row = csv.writer(out).writerow
+        if (header):
+            write_row(columns)
+
+    missed = 0
+    num = 0
+    t_start = time.monotonic()
+    t_next = t_start
+    try:
+        while ((count == None) or (num < count)):
+            delay = t_next - time.monotonic()
+            if (delay > 0):
+                time.sleep(delay)
+
+            t_sample = time.monotonic()
+            row = [_timestamp(time.time()),
+                   round((t_sample - t_next)*1000.0, 3), missed]
+            for dest, value in ops:
+                t_read = time.perf_counter()
+                try:
+                    result = getattr(ctrl, OPS[dest][1])()
+                except Exception as exc:
+                    result = f'ERROR: {exc}'
+                row += [result, round((time.perf_counter() - t_read)*1000.0, 3)]
+
+            write_row(row)
+            out.flush()
+            num += 1
+
+            # Next sample time on the fixed grid, skipping the missed ones
+            t_next += period
+            t_now = time.monotonic()
+            if (t_next < t_now):
+                skip = int((t_now - t_next)/period) + 1
+                missed += skip
+                t_next += skip*period
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if (out_file != None):
+            out.close()
+
+    return
 
 def get_ip_address():
-    print(f'Current IP addr: {get_ip()}')
+    print(f'Current IP addr: {ctrl.get_ip()}')
     return
 
 def get_date_time():
-    print(f'{get_date()}')
+    print(f'{ctrl.get_date()}')
     return
 
 def get_hostname_please():
-    print(f'Hostname: {get_hostname()}')
+    print(f'Hostname: {ctrl.get_hostname()}')
     return
 
 def get_domain_please():
-    print(f'Domain name: {get_domain()}')
+    print(f'Domain name: {ctrl.get_domain()}')
     return
 
 def get_ctrl_src():
-    print(f'Current ctrl source: {get_control_source()}')
+    print(f'Current ctrl source: {ctrl.get_control_source()}')
     return
 
 def please_get_state():
-    print(f'Current state: {get_state()}')
+    print(f'Current state: {ctrl.get_state()}')
     return
 
 def get_power_set_point():
-    print(f'Power set to: {get_power()}')
+    print(f'Power set to: {ctrl.get_power()}')
     return
 
 def set_power_set_point(set_point: str):
@@ -57,33 +284,33 @@ def set_power_set_point(set_point: str):
         print(f'ERROR: Invalid value ({set_point}. Argument must be an integer')
         return
 
-    set_power(power)
+    ctrl.set_power(power)
     get_power_set_point()
 
     return
 
 def turn_rf_on():
-    rf_on()
+    ctrl.rf_on()
     return
 
 def turn_rf_off():
-    rf_off()
+    ctrl.rf_off()
     return
 
 def forward_power_please():
-    print(f'Forward power: {get_forward_power()}')
+    print(f'Forward power: {ctrl.get_forward_power()}')
     return
 
 def reflected_power_please():
-    print(f'Reflected power: {get_reflected_power()}')
+    print(f'Reflected power: {ctrl.get_reflected_power()}')
     return
 
 def read_tune_cap_please():
-    print(f'Tune cap (%): {get_tune_cap()}')
+    print(f'Tune cap (%): {ctrl.get_tune_cap()}')
     return
 
 def read_load_cap_please():
-    print(f'Load cap (%): {get_load_cap()}')
+    print(f'Load cap (%): {ctrl.get_load_cap()}')
     return
 
 def set_load_cap_please(pos):
@@ -94,17 +321,17 @@ def set_load_cap_please(pos):
         return
 
     read_load_cap_please()
-    set_load_cap(cap_pos)
+    ctrl.set_load_cap(cap_pos)
     read_load_cap_please()
 
     return
 
 def get_match_mode_now():
-    print(f'Match mode: {get_match_mode()}')
+    print(f'Match mode: {ctrl.get_match_mode()}')
     return
 
 def get_phase_now():
-    print(f'The current phase is {get_phase()}')
+    print(f'The current phase is {ctrl.get_phase()}')
     return
 
 def set_match_mode_now(m_mode):
@@ -117,7 +344,7 @@ def set_match_mode_now(m_mode):
         print(f'ERROR: Invalid value ({m_mode}. Argument must be an integer')
         return
 
-    set_match_mode(mode)
+    ctrl.set_match_mode(mode)
 
     return
 
@@ -158,43 +385,103 @@ def main():
                   2 for "Automatic"'''
     hsn_help = '''Gets the host name of the RF Generator'''
     pha_help = '''Get the phase of the RF Generator'''
+    fmt_help = '''Output format of batch mode (several operations in one
+                  call, executed in command line order): one CSV record (a
+                  header and a value line) or one JSON object. Default: csv'''
+    hdr_help = '''Do not print the CSV header line, i.e. to append records to
+                  a file'''
+    wat_help = f'''Read the parameters of the given options (default:
+                   {" ".join(WATCH_OPS)}) every WATCH seconds and write a
+                   timestamped row per sample, until interrupted'''
+    out_help = '''File the --watch rows are appended to. Default: stdout'''
+    cnt_help = '''Stop --watch after this many samples'''
+    dmn_help = '''Talk to the generator directly, even if the local daemon
+                  (gen_daemon.py) is running'''
 
     parser = argparse.ArgumentParser(description = descript)
 #    parser.add_argument('arg', help = arg_help)
 #    parser.add_argument('-o', '--opt', help = opt_help, metavar = 'opt_display_name')
-    parser.add_argument('-c', '--ctrl_src', help = ctl_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-d', '--date', help = dte_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-dn', '--domain', help = dte_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-fp', '--fwd_pwr', help = rfd_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-i', '--ip_addr', help = adr_help)
-    parser.add_argument('-m', '--match', help = mth_help)
-    parser.add_argument('-n', '--hostname', help = hsn_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-p', '--power', help = pwr_help)
-    parser.add_argument('-rfd', '--rf_off', help = rfd_help, action = 'store_true',
+    parser.add_argument('-c', '--ctrl_src', help = ctl_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-d', '--date', help = dte_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-dn', '--domain', help = dte_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-fp', '--fwd_pwr', help = rfd_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-i', '--ip_addr', help = adr_help, action = Record_Op)
+    parser.add_argument('-m', '--match', help = mth_help, action = Record_Op)
+    parser.add_argument('-n', '--hostname', help = hsn_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-p', '--power', help = pwr_help, action = Record_Op)
+    parser.add_argument('-rfd', '--rf_off', help = rfd_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-rfu', '--rf_on', help = rfd_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-rp', '--rfl_pwr', help = rfd_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-s', '--state', help = ste_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-tcp', '--rd_tc', help = rfd_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-lcp', '--rd_lc', help = rfd_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-stc', '--set_tc', help = rfd_help, action = Record_Op)
+    parser.add_argument('-slc', '--set_lc', help = rfd_help, action = Record_Op)
+    parser.add_argument('-ph', '--phase', help = rfd_help, action = Record_Op,
+                        nargs = 0, default = False)
+    parser.add_argument('-f', '--format', help = fmt_help, choices = FORMATS,
+                        default = None)
+    parser.add_argument('--no_header', help = hdr_help, action = 'store_true',
                         default = False)
-    parser.add_argument('-rfu', '--rf_on', help = rfd_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-rp', '--rfl_pwr', help = rfd_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-s', '--state', help = ste_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-tcp', '--rd_tc', help = rfd_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-lcp', '--rd_lc', help = rfd_help, action = 'store_true',
-                        default = False)
-    parser.add_argument('-stc', '--set_tc', help = rfd_help)
-    parser.add_argument('-slc', '--set_lc', help = rfd_help)
-    parser.add_argument('-ph', '--phase', help = rfd_help, action = 'store_true',
+    parser.add_argument('-w', '--watch', help = wat_help, type = float,
+                        default = None)
+    parser.add_argument('-o', '--output', help = out_help, default = None)
+    parser.add_argument('-N', '--count', help = cnt_help, type = int,
+                        default = None)
+    parser.add_argument('--no_daemon', help = dmn_help, action = 'store_true',
                         default = False)
     
     # Create list of keys to the args dictionary
     args = parser.parse_args().__dict__
 
+    if ((args['watch'] != None) and (not (args['watch'] > 0.0))):
+        parser.error(f'argument -w/--watch: must be greater than 0, not '
+                     f'{args["watch"]}')
+
+    global ctrl
+
+    if (not args['no_daemon']):
+        ctrl = connect()
+    if (ctrl == None):
+        import rf_gen_controller as ctrl
+
+    ops = args.get('ops', [])
+    if (args['watch'] != None):
+        configure(ERROR)
+        if (not ops):
+            ops = [(dest, 'get') for dest in WATCH_OPS]
+
+        fmt = args['format']
+        if (fmt == None): fmt = 'csv'
+        try:
+            watch(ops, args['watch'], fmt, args['output'], args['count'],
+                  not args['no_header'])
+        except ValueError as exc:
+            print(f'ERROR: {exc}')
+            sys.exit(1)
+        return
+
+    if ((len(ops) > 1) or ((ops) and (args['format'] != None))):
+        # Only errors are logged, so the output stays a clean record
+        configure(ERROR)
+
+        fmt = args['format']
+        if (fmt == None): fmt = 'csv'
+        if (not run_batch(ops, fmt, not args['no_header'])):
+            sys.exit(1)
+        return
+
     if (args['ip_addr'] == 'get'):
         get_ip_address()
         return
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Measures how long the driver and the command line tools take to start. Each
+# module is imported in a fresh interpreter (python -X importtime), several
+# times, and the fastest run is reported: the import time of the module itself
+# and the wall time of the whole process, interpreter start up included. With
+# --top the slowest imports of the fastest run are listed, which shows what to
+# defer when a module gets slow to start.
+#
+# With --budget the script exits with status 1 if a module takes longer to
+# import, i.e. to catch a heavy import (numpy, pymodbus, caproto) slipping back
+# onto the command path.
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Entry points of the driver and the CLIs
+MODULES = ['rf_gen_tcp_driver', 'gen_test_app', 'rf_gen_client', 'gen_epics',
+           'tcp_server', 'cmd_lookup', 'modbus_client']
+
+def import_times(module: str) -> tuple:
+    """
+    Imports a module in a fresh interpreter.
+
+    Inputs:
+        module (str) - Module to import
+
+    Returns:
+        tuple - (wall time of the process (s),
+                 {imported module: cumulative import time (s)})
+    """
+    t_start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                           f'import {module}'], capture_output=True, text=True)
+    t_wall = time.perf_counter() - t_start
+
+    if (proc.returncode != 0):
+        raise RuntimeError(f'import {module} failed: {proc.stderr.strip()}')
+
+    # Lines are "import time: self [us] | cumulative | imported package"
+    times = {}
+    for line in proc.stderr.splitlines():
+        if (not line.startswith('import time:')):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            times[fields[2].strip()] = int(fields[1])/1e6
+        except (IndexError, ValueError):
+            continue # header line
+
+    return t_wall, times
+
+def bench(module: str, num: int) -> dict:
+    """
+    Imports a module num times.
+
+    Returns:
+        dict - {"import": fastest import time (s), "median": median import time,
+                "wall": fastest process wall time (s), "times": import times of
+                the fastest run}
+    """
+    runs = [import_times(module) for irun in range(num)]
+    imports = [times[module] for t_wall, times in runs]
+    best = min(range(num), key=lambda irun: imports[irun])
+
+    return {"import": imports[best], "median": statistics.median(imports),
+            "wall": min(t_wall for t_wall, times in runs),
+            "times": runs[best][1]}
+
+def main():
+    descript = '''Measures the import (start up) time of the RF generator driver
+                  and its command line tools'''
+    mod_help = f'''Modules to measure. Default: {" ".join(MODULES)}'''
+    num_help = '''Number of runs per module, the fastest is reported'''
+    top_help = '''Also list the N slowest imports of each module'''
+    bud_help = '''Exit with status 1 if a module takes longer than this many
+                  milliseconds to import'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('MODULES', help = mod_help, nargs = '*',
+                        default = MODULES)
+    parser.add_argument('-n', '--num', help = num_help, type = int, default = 5)
+    parser.add_argument('-t', '--top', help = top_help, type = int, default = 0)
+    parser.add_argument('-b', '--budget', help = bud_help, type = float,
+                        default = None)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    print(f'{"module":<20}{"import ms":>11}{"median ms":>11}{"process ms":>12}')
+
+    over = []
+    for module in args['MODULES']:
+        result = bench(module, args['num'])
+        print(f'{module:<20}{1000.0*result["import"]:>11.1f}'
+              f'{1000.0*result["median"]:>11.1f}{1000.0*result["wall"]:>12.1f}')
+
+        if (args['top'] > 0):
+            slowest = sorted(result["times"].items(), key=lambda item: -item[1])
+            for name, t_import in slowest[1:args['top']+1]:
+                print(f'    {name:<32}{1000.0*t_import:>8.1f}')
+
+        if ((args['budget'] != None) and
+            (1000.0*result["import"] > args['budget'])):
+            over.append(module)
+
+    if (over):
+        print(f'Over the budget of {args["budget"]} ms: {", ".join(over)}')
+        sys.exit(1)
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
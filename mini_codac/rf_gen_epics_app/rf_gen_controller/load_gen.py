@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+# Load generator and latency benchmark for the RF generator driver
+# (rf_gen_tcp_driver.py / tcp_server.py).
+#
+# Each simulated client keeps one connection open and sends a random mix of
+# commands. In closed-loop mode a client keeps PIPELINE requests outstanding
+# and sends a new one as soon as a response arrives. In open-loop mode
+# requests are sent at a fixed average rate (Poisson arrivals) whether or not
+# the previous ones have been answered (PIPELINE does not apply), and latency
+# is measured from the time a request was due, so a server that falls behind
+# is not hidden by clients that slow down with it.
+#
+# Write commands ('$') have no response, so a write is sent followed by PING?
+# and is complete when the PING? response arrives. The driver answers that
+# PING? with BUSY or an Error if the write was rejected or failed, and the
+# write is counted as such, not as a success.
+#
+# Use --local to benchmark against a driver and a simulated generator
+# (gen_simulator.py) started in this process.
+
+import argparse
+import collections
+import json
+import random
+import socket
+import threading
+import time
+
+from metrics import percentile
+
+DEFAULT_MIX = 'GETPOWER?=4,GETFWDPWR?=4,GETRFLPWR?=4,GETSTATE?=2,SETPOWER$ 5000=1'
+
+class Load_Client():
+    """
+    One simulated client of the driver.
+    """
+
+    def __init__(self, server_ip: str, port: int, mix: list, pipeline: int,
+                 rate: float=None):
+        """
+        Initializes the Load_Client class and connects to the driver.
+
+        Inputs:
+            server_ip (str)             - IP address of the driver
+            port      (int)             - Port of the driver
+            mix       (list)            - [(command, weight)] request mix
+            pipeline  (int)             - Maximum outstanding requests
+                                          (closed-loop)
+            rate      (optional, float) - Requests per second (open-loop). If
+                                          not given the client runs closed-loop
+        """
+        self._sock = socket.create_connection((server_ip, int(port)))
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self._cmds    = [cmd for cmd, weight in mix]
+        self._weights = [weight for cmd, weight in mix]
+        self._rate    = rate
+        self._slots   = threading.Semaphore(pipeline)
+        self._pending = collections.deque() # (t_due, cmd) in send order
+        self._stop    = threading.Event()
+
+        self.latency = collections.defaultdict(list) # cmd -> [seconds]
+        self.failed  = collections.Counter()         # cmd -> BUSY or Error
+        self.num_busy  = 0
+        self.num_error = 0
+
+        return
+
+    def run(self, duration: float):
+        """
+        Sends requests for duration seconds, then waits for the outstanding
+        responses.
+
+        Inputs:
+            duration (float) - Length of the run (seconds)
+        """
+        receiver = threading.Thread(target=self._receive, daemon=True)
+        receiver.start()
+
+        t_end = time.monotonic() + duration
+        t_due = time.monotonic()
+        while (time.monotonic() < t_end):
+            if (self._rate != None):
+                t_due += random.expovariate(self._rate)
+                t_wait = t_due - time.monotonic()
+                if (t_wait > 0.0):
+                    time.sleep(t_wait)
+            else:
+                t_due = time.monotonic()
+
+            # Open-loop requests are sent when due, answered or not
+            if (self._rate == None):
+                t_left = max(t_end - time.monotonic(), 0.0)
+                if (not self._slots.acquire(timeout=t_left)):
+                    break
+
+            cmd = random.choices(self._cmds, self._weights)[0]
+            msg = f'{cmd}\n'
+            if (cmd.find('$') >= 0):
+                msg += 'PING?\n'
+
+            self._pending.append((t_due, cmd))
+            try:
+                self._sock.sendall(msg.encode("utf-8"))
+            except OSError:
+                break
+
+        # Wait (a little) for the last responses
+        t_drain = time.monotonic() + 5.0
+        while ((len(self._pending) > 0) and (time.monotonic() < t_drain)):
+            time.sleep(0.01)
+
+        self._stop.set()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        receiver.join()
+        self._sock.close()
+
+        return
+
+    def _receive(self):
+        """
+        Reads the responses and matches them, in order, to the requests.
+        """
+        buf = b''
+        while (not self._stop.is_set()):
+            try:
+                data = self._sock.recv(65536)
+            except OSError:
+                break
+
+            if (not data):
+                break
+
+            t_recv = time.monotonic()
+            buf += data
+            lines = buf.split(b'\n')
+            buf = lines.pop()
+
+            for line in lines:
+                if (len(self._pending) == 0):
+                    self.num_error += 1
+                    continue
+
+                t_due, cmd = self._pending.popleft()
+                if (self._rate == None):
+                    self._slots.release()
+
+                # For a write this is the answer of its PING?
+                if (line == b'BUSY'):
+                    self.num_busy += 1
+                    self.failed[cmd] += 1
+                elif (line.startswith(b'Error')):
+                    self.num_error += 1
+                    self.failed[cmd] += 1
+                else:
+                    self.latency[cmd].append(t_recv - t_due)
+
+        return
+
+def parse_mix(mix: str) -> list:
+    """
+    Parses a request mix.
+
+    Inputs:
+        mix (str) - "cmd=weight,cmd=weight,..." (i.e. "GETPOWER?=3,SETPOWER$ 5000=1")
+
+    Returns:
+        list - [(command, weight)]
+    """
+    entries = []
+    for entry in mix.split(','):
+        cmd, weight = entry.rsplit('=', 1)
+        entries.append((cmd.strip(), float(weight)))
+
+    return entries
+
+def run_load(server_ip: str, port: int, num_clients: int, mix: list,
+             duration: float, pipeline: int=1, rate: float=None) -> dict:
+    """
+    Runs a load test against a driver.
+
+    Inputs:
+        server_ip   (str)             - IP address of the driver
+        port        (int)             - Port of the driver
+        num_clients (int)             - Number of concurrent clients
+        mix         (list)            - [(command, weight)] request mix
+        duration    (float)           - Length of the run (seconds)
+        pipeline    (optional, int)   - Maximum outstanding requests per client
+                                        (closed-loop)
+        rate        (optional, float) - Total requests per second over all
+                                        clients (open-loop). Closed-loop if not
+                                        given
+
+    Returns:
+        dict - Throughput (requests/s), BUSY/error counts and latency
+               percentiles (ms) of the successful requests, overall and per
+               command ("failed": answered BUSY or Error)
+    """
+    client_rate = None
+    if (rate != None): client_rate = rate/num_clients
+
+    clients = [Load_Client(server_ip, port, mix, pipeline, client_rate)
+               for iclient in range(num_clients)]
+    threads = [threading.Thread(target=client.run, args=(duration,))
+               for client in clients]
+
+    t_start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    t_run = time.monotonic() - t_start
+
+    latency = collections.defaultdict(list)
+    failed = collections.Counter()
+    for client in clients:
+        for cmd, samples in client.latency.items():
+            latency[cmd].extend(samples)
+        failed.update(client.failed)
+
+    all_samples = sorted(sample for samples in latency.values()
+                         for sample in samples)
+
+    report = {"clients": num_clients, "pipeline": pipeline,
+              "mode": "closed" if (rate == None) else "open",
+              "duration": round(t_run, 2),
+              "requests": len(all_samples),
+              "throughput": round(len(all_samples)/t_run, 1),
+              "busy": sum(client.num_busy for client in clients),
+              "errors": sum(client.num_error for client in clients)}
+    report.update(_latency_report(all_samples))
+
+    report["commands"] = {}
+    for cmd in list(latency) + [cmd for cmd in failed if (cmd not in latency)]:
+        samples = latency[cmd]
+        report["commands"][cmd] = {"n": len(samples), "failed": failed[cmd]}
+        report["commands"][cmd].update(_latency_report(sorted(samples)))
+
+    return report
+
+def _latency_report(samples: list) -> dict:
+    """
+    Returns the p50, p99, p999 and max of a sorted list of latencies in ms.
+    """
+    report = {}
+    for name, pct in (("p50", 50.0), ("p99", 99.0), ("p999", 99.9)):
+        report[name] = round(percentile(samples, pct)*1000.0, 3)
+    report["max"] = round((samples[-1] if (samples) else 0.0)*1000.0, 3)
+
+    return report
+
+def start_local(latency: float) -> tuple:
+    """
+    Starts a simulated generator and a driver in this process.
+
+    Inputs:
+        latency (float) - Response time of the simulated generator (seconds)
+
+    Returns:
+        (ip, port) - Address of the driver
+    """
+    from gen_simulator import Gen_Simulator
+    from tcp_server    import tcp_server
+
+    sim = Gen_Simulator(latency=latency)
+    sim.start()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    generators = {"SIM": {"ip": sim.host_ip, "port": sim.port}}
+    server = threading.Thread(target=tcp_server,
+                              args=('127.0.0.1', port, False),
+                              kwargs={"generators": generators}, daemon=True)
+    server.start()
+
+    for itry in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    return ('127.0.0.1', port)
+
+def print_report(report: dict):
+    """
+    Prints a load test report as a table.
+    """
+    print(f'{report["mode"]}-loop, {report["clients"]} clients, pipeline '
+          f'{report["pipeline"]}, {report["duration"]} s')
+    print(f'{report["requests"]} requests, {report["throughput"]} req/s, '
+          f'{report["busy"]} BUSY, {report["errors"]} errors')
+    print(f'{"command":<20}{"n":>8}{"failed":>8}{"p50 ms":>10}{"p99 ms":>10}'
+          f'{"p999 ms":>10}{"max ms":>10}')
+
+    rows = [("ALL", report)] + list(report["commands"].items())
+    for cmd, stat in rows:
+        num = stat.get("n", report["requests"])
+        failed = stat.get("failed", report["busy"] + report["errors"])
+        print(f'{cmd:<20}{num:>8}{failed:>8}{stat["p50"]:>10}'
+              f'{stat["p99"]:>10}{stat["p999"]:>10}{stat["max"]:>10}')
+
+    return
+
+def main():
+    descript = '''Load generator and latency benchmark for the RF generator
+                  driver'''
+    ip_help  = '''Ip address of the driver (ignored with --local)'''
+    prt_help = '''Port of the driver (ignored with --local)'''
+    cli_help = '''Number of concurrent clients'''
+    mix_help = f'''Request mix as "cmd=weight,...". Default: "{DEFAULT_MIX}"'''
+    dur_help = '''Length of the run in seconds'''
+    pip_help = '''Maximum number of outstanding requests per client
+                  (closed-loop only)'''
+    rte_help = '''Total request rate (requests/s). Runs open-loop when given,
+                  closed-loop otherwise'''
+    loc_help = '''Start a driver and a simulated generator in this process'''
+    lat_help = '''Response time (seconds) of the simulated generator'''
+    jsn_help = '''Print the report as JSON'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('IP', help = ip_help, nargs = '?', default = '127.0.0.1')
+    parser.add_argument('PORT', help = prt_help, nargs = '?', default = None)
+    parser.add_argument('-c', '--clients', help = cli_help, type = int,
+                        default = 4)
+    parser.add_argument('-m', '--mix', help = mix_help, default = DEFAULT_MIX)
+    parser.add_argument('-d', '--duration', help = dur_help, type = float,
+                        default = 10.0)
+    parser.add_argument('-p', '--pipeline', help = pip_help, type = int,
+                        default = 1)
+    parser.add_argument('-r', '--rate', help = rte_help, type = float,
+                        default = None)
+    parser.add_argument('-l', '--local', help = loc_help, action = 'store_true',
+                        default = False)
+    parser.add_argument('-s', '--sim_latency', help = lat_help, type = float,
+                        default = 0.002)
+    parser.add_argument('-j', '--json', help = jsn_help, action = 'store_true',
+                        default = False)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    if (args['local']):
+        server_ip, port = start_local(args['sim_latency'])
+    elif (args['PORT'] == None):
+        parser.error('PORT is required unless --local is given')
+    else:
+        server_ip, port = args['IP'], int(args['PORT'])
+
+    report = run_load(server_ip, port, args['clients'], parse_mix(args['mix']),
+                      args['duration'], args['pipeline'], args['rate'])
+
+    if (args['json']):
+        print(json.dumps(report))
+    else:
+        print_report(report)
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,362 @@
+# Macro commands. A macro is a multi-step procedure that is executed by the
+# driver, next to the generator, instead of by a client issuing one command
+# per step. A macro is started with
+#
+#     MACRO$ <NAME> <arg1> <arg2> ...
+#
+# and runs in the background. Its progress and completion status are read
+# with MACROSTAT?, the values it collected with MACRORESULT?, and a running
+# macro is stopped with MACROABORT$ 1. One macro runs at a time per generator.
+#
+# As macros are added you must add a function that takes the Macro_Context
+# followed by the (integer) arguments, then add it to MACROS along with the
+# names of its arguments.
+
+import threading
+import time
+
+from admission   import BUSY_RESP
+from psi_message import Psi_Message
+
+# Macro states
+IDLE    = 'IDLE'
+RUNNING = 'RUNNING'
+DONE    = 'DONE'
+FAILED  = 'FAILED'
+ABORTED = 'ABORTED'
+
+# Match modes (see rf_gen_controller.set_match_mode)
+MANUAL_MATCH = 1
+
+# Capacitor positions are within CAP_TOL of the target once a move is done
+CAP_TOL      = 5
+CAP_TIMEOUT  = 30.0 # seconds
+CAP_POLL     = 0.1  # seconds
+
+class Macro_Aborted(Exception):
+    """
+    Raised inside a macro when it is aborted.
+    """
+    pass
+
+class Macro_Context():
+    """
+    Handed to a running macro. Gives it access to the generator, through the
+    lookup table, and lets it report its progress.
+    """
+
+    def __init__(self, cmd_table, abort: threading.Event):
+        self._cmd_table = cmd_table
+        self._abort     = abort
+
+        self.step   = 0
+        self.total  = 0
+        self.result = []
+
+        return
+
+    def read(self, cmd: str) -> int:
+        """
+        Reads a value from the generator (i.e. read("GETFWDPWR?")).
+
+        Inputs:
+            cmd (str) - Read command of the lookup table
+        """
+        self.check()
+        value = self._cmd_table.cmd_lookup(cmd)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise RuntimeError(f'{cmd} returned "{value}"')
+
+    def write(self, cmd: str, value: int):
+        """
+        Writes a value to the generator (i.e. write("SETPOWER$", 5000)).
+
+        Inputs:
+            cmd   (str) - Write command of the lookup table
+            value (int) - Value to be written
+        """
+        self.check()
+        result = self._cmd_table.cmd_lookup(cmd, args=value)
+
+        # The write was not done: the generator was busy, or the command is
+        # not in the lookup table
+        if ((result == BUSY_RESP) or (str(result).startswith('Error'))):
+            raise RuntimeError(f'{cmd} {value} returned "{result}"')
+
+        return
+
+    def sleep(self, dwell: float):
+        """
+        Waits, returning early (with Macro_Aborted) if the macro is aborted.
+
+        Inputs:
+            dwell (float) - Time to wait (seconds)
+        """
+        if (self._abort.wait(dwell)):
+            raise Macro_Aborted()
+
+        return
+
+    def check(self):
+        """
+        Raises Macro_Aborted if the macro was aborted.
+        """
+        if (self._abort.is_set()):
+            raise Macro_Aborted()
+
+        return
+
+    def progress(self, step: int, total: int=None):
+        """
+        Reports the progress of the macro.
+
+        Inputs:
+            step  (int)           - Number of steps done
+            total (optional, int) - Total number of steps
+        """
+        self.step = step
+        if (total != None): self.total = total
+
+        return
+
+def _steps(start: int, stop: int, step: int) -> list:
+    """
+    Returns the values from start to stop (both included) in increments of
+    step, in the direction of stop.
+    """
+    step = max(abs(step), 1)
+    if (stop < start):
+        step = -step
+
+    values = list(range(start, stop, step))
+    values.append(stop)
+
+    return values
+
+def _move_cap(ctx: Macro_Context, cap: str, pos: int):
+    """
+    Moves a capacitor and waits until it has reached its position.
+
+    Inputs:
+        ctx (Macro_Context) - Context of the running macro
+        cap (str)           - "LD" (load) or "TN" (tune)
+        pos (int)           - Position (1000 = 100.0%)
+    """
+    ctx.write(f'SET{cap}CAP$', pos)
+
+    t_end = time.monotonic() + CAP_TIMEOUT
+    while (abs(ctx.read(f'GET{cap}CAP?') - pos) > CAP_TOL):
+        if (time.monotonic() > t_end):
+            raise RuntimeError(f'{cap} cap did not reach {pos}')
+        ctx.sleep(CAP_POLL)
+
+    return
+
+def ramp(ctx: Macro_Context, target: int, step: int, dwell_ms: int):
+    """
+    Ramps the power set point from its current value to target.
+
+    Inputs:
+        ctx      (Macro_Context) - Context of the running macro
+        target   (int)           - Final power set point (mW)
+        step     (int)           - Size of each step (mW)
+        dwell_ms (int)           - Time between steps (ms)
+    """
+    start = ctx.read('GETPOWER?')
+    values = _steps(start, target, step)[1:]
+    ctx.progress(0, len(values))
+
+    for ival, value in enumerate(values):
+        ctx.write('SETPOWER$', value)
+        ctx.result.append(value)
+        ctx.progress(ival + 1)
+        if (ival < len(values) - 1):
+            ctx.sleep(dwell_ms/1000.0)
+
+    return
+
+def cap_sweep(ctx: Macro_Context, cap: int, start: int, stop: int,
+              step: int, dwell_ms: int):
+    """
+    Switches to manual matching and sweeps one capacitor, recording the
+    forward and reflected power at each position.
+
+    Inputs:
+        ctx      (Macro_Context) - Context of the running macro
+        cap      (int)           - 0 for the load cap, 1 for the tune cap
+        start    (int)           - First position (1000 = 100.0%)
+        stop     (int)           - Last position
+        step     (int)           - Size of each step
+        dwell_ms (int)           - Settling time at each position (ms)
+    """
+    cap_name = 'TN' if (cap) else 'LD'
+    values = _steps(start, stop, step)
+    ctx.progress(0, len(values))
+
+    ctx.write('SETMATCHMODE$', MANUAL_MATCH)
+    for ival, pos in enumerate(values):
+        _move_cap(ctx, cap_name, pos)
+        ctx.sleep(dwell_ms/1000.0)
+        ctx.result.append(f'{pos}:{ctx.read("GETFWDPWR?")}:'
+                          f'{ctx.read("GETRFLPWR?")}')
+        ctx.progress(ival + 1)
+
+    return
+
+def manual_caps(ctx: Macro_Context, load_pos: int, tune_pos: int):
+    """
+    Switches to manual matching, then moves both capacitors.
+
+    Inputs:
+        ctx      (Macro_Context) - Context of the running macro
+        load_pos (int)           - Load cap position (1000 = 100.0%)
+        tune_pos (int)           - Tune cap position (1000 = 100.0%)
+    """
+    ctx.progress(0, 3)
+
+    ctx.write('SETMATCHMODE$', MANUAL_MATCH)
+    ctx.progress(1)
+
+    _move_cap(ctx, 'LD', load_pos)
+    ctx.progress(2)
+
+    _move_cap(ctx, 'TN', tune_pos)
+    ctx.progress(3)
+
+    return
+
+# name: (function, argument names)
+MACROS = {"RAMP": (ramp, ("target", "step", "dwell_ms")),
+          "CAPSWEEP": (cap_sweep, ("cap", "start", "stop", "step", "dwell_ms")),
+          "MANUALCAPS": (manual_caps, ("load_pos", "tune_pos"))}
+
+class Macro_Runner():
+    """
+    Runs the macros of one generator, one at a time, in a background thread.
+    """
+
+    def __init__(self, cmd_table):
+        """
+        Initializes the Macro_Runner class.
+
+        Inputs:
+            cmd_table (Cmd_Lookup) - Lookup table of the generator
+        """
+        self._cmd_table = cmd_table
+        self._lock      = threading.Lock()
+        self._abort     = threading.Event()
+        self._thread    = None
+
+        self._num_macros = 0
+        self._name  = '-'
+        self._state = IDLE
+        self._msg   = ''
+        self._ctx   = Macro_Context(cmd_table, self._abort)
+
+        return
+
+    def start(self, macro_args: str) -> bool:
+        """
+        Starts a macro.
+
+        Inputs:
+            macro_args (str) - Name of the macro followed by its arguments,
+                               separated by spaces (i.e. "RAMP 50000 5000 500")
+
+        Returns:
+            True if the macro was started
+        """
+        func_id = f'{__name__}.start'
+        pmsg = Psi_Message()
+
+        tokens = str(macro_args).split()
+        if ((len(tokens) == 0) or (tokens[0].upper() not in MACROS)):
+            pmsg.error(func_id, f'Unknown macro "{macro_args}"')
+            return False
+
+        name = tokens[0].upper()
+        func, arg_names = MACROS[name]
+        try:
+            args = [int(tok) for tok in tokens[1:]]
+        except ValueError:
+            args = []
+
+        if (len(args) != len(arg_names)):
+            pmsg.error(func_id, f'{name} takes the integer arguments: '
+                                f'{" ".join(arg_names)}')
+            return False
+
+        with self._lock:
+            if (self._state == RUNNING):
+                pmsg.error(func_id, f'{self._name} is still running')
+                return False
+
+            self._num_macros += 1
+            self._name  = name
+            self._state = RUNNING
+            self._msg   = ''
+            self._abort.clear()
+            self._ctx   = Macro_Context(self._cmd_table, self._abort)
+
+            self._thread = threading.Thread(target=self._run,
+                                            args=(func, args, self._ctx),
+                                            daemon=True)
+            self._thread.start()
+
+        pmsg.debug(func_id, f'Started macro {self._num_macros}: {macro_args}')
+
+        return True
+
+    def _run(self, func, args: list, ctx: Macro_Context):
+        """
+        Executes a macro and records how it ended.
+        """
+        func_id = f'{__name__}._run'
+        pmsg = Psi_Message()
+
+        state = DONE
+        msg = ''
+        try:
+            func(ctx, *args)
+        except Macro_Aborted:
+            state = ABORTED
+        except Exception as exc:
+            state = FAILED
+            msg = str(exc)
+            pmsg.error(func_id, f'{self._name} failed: {exc}')
+
+        with self._lock:
+            self._state = state
+            self._msg   = msg
+
+        return
+
+    def abort(self):
+        """
+        Aborts the running macro. The step being executed is completed.
+        """
+        self._abort.set()
+
+        return
+
+    def status(self) -> str:
+        """
+        Returns the status of the current (or last) macro as
+        "<number> <name> <state> <step>/<total> [<error message>]"
+        """
+        with self._lock:
+            status = (f'{self._num_macros} {self._name} {self._state} '
+                      f'{self._ctx.step}/{self._ctx.total}')
+            if (self._msg):
+                status += f' {self._msg}'
+
+        return status
+
+    def result(self) -> str:
+        """
+        Returns the values collected by the current (or last) macro,
+        separated by commas.
+        """
+        return ','.join(str(val) for val in list(self._ctx.result))
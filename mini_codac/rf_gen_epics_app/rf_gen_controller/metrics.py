@@ -0,0 +1,152 @@
+# In-process counters of the driver. Recording a sample costs a lock and an
+# append, everything else (sorting, percentiles, formatting) is only done when
+# the METRICS? command is received.
+
+import collections
+import threading
+import time
+
+# Number of latency samples that are kept per command
+LAT_SAMPLES = 1024
+
+class Counters():
+    """
+    Thread safe named counters.
+    """
+
+    def __init__(self, names: list):
+        """
+        Initializes the Counters class.
+
+        Inputs:
+            names (list) - Names of the counters
+        """
+        self._lock = threading.Lock()
+        self._counts = {name: 0 for name in names}
+
+        return
+
+    def incr(self, name: str, num: int=1):
+        """
+        Increments a counter.
+
+        Inputs:
+            name (str)           - Name of the counter
+            num  (optional, int) - Increment
+        """
+        with self._lock:
+            self._counts[name] += num
+
+        return
+
+    def get(self) -> dict:
+        """
+        Returns a copy of the counters.
+        """
+        with self._lock:
+            return dict(self._counts)
+
+class Metrics():
+    """
+    Request counts and latencies per command, plus statistics gathered from
+    other parts of the driver (sources) when the metrics are reported.
+    """
+
+    def __init__(self):
+        """
+        Initializes the Metrics class.
+
+        Inputs:
+            None
+        """
+        self._lock    = threading.Lock()
+        self._t_start = time.monotonic()
+        self._count   = collections.Counter()
+        self._latency = collections.defaultdict(
+                            lambda: collections.deque(maxlen=LAT_SAMPLES))
+        self._sources = []
+
+        return
+
+    def record(self, cmd: str, seconds: float):
+        """
+        Records a request.
+
+        Inputs:
+            cmd     (str)   - Command (without arguments)
+            seconds (float) - Time it took to answer the request
+        """
+        with self._lock:
+            self._count[cmd] += 1
+            self._latency[cmd].append(seconds)
+
+        return
+
+    def add_source(self, prefix: str, func):
+        """
+        Adds a source of statistics.
+
+        Inputs:
+            prefix (str)      - Prefix of the keys of the source (may be empty)
+            func   (callable) - Function without arguments that returns a dict
+                                of numbers
+        """
+        self._sources.append((prefix, func))
+
+        return
+
+    def report(self) -> dict:
+        """
+        Returns all metrics. Latencies are in milli-seconds.
+
+        Inputs:
+            None
+
+        Returns:
+            dict - {key: number}
+        """
+        with self._lock:
+            counts = dict(self._count)
+            samples = {cmd: sorted(lat) for cmd, lat in self._latency.items()}
+
+        report = {"uptime": round(time.monotonic() - self._t_start, 1),
+                  "requests": sum(counts.values())}
+
+        for cmd in sorted(counts):
+            name = cmd.rstrip('?$')
+            report[f'{name}.n'] = counts[cmd]
+            report[f'{name}.p50'] = round(percentile(samples[cmd], 50.0)*1000.0, 2)
+            report[f'{name}.p99'] = round(percentile(samples[cmd], 99.0)*1000.0, 2)
+
+        for prefix, func in self._sources:
+            for key, value in func().items():
+                report[f'{prefix}{key}'] = value
+
+        return report
+
+    def format(self) -> str:
+        """
+        Returns all metrics as "key=value" pairs separated by spaces.
+
+        Inputs:
+            None
+        """
+        return ' '.join(f'{key}={value}' for key, value in self.report().items())
+
+def percentile(samples: list, pct: float) -> float:
+    """
+    Nearest-rank percentile of a sorted list.
+
+    Inputs:
+        samples (list)  - Sorted list of samples
+        pct     (float) - Percentile (0 -> 100)
+
+    Returns:
+        The percentile, or 0.0 if there are no samples
+    """
+    if (len(samples) == 0):
+        return 0.0
+
+    idx = int(round(pct/100.0*(len(samples) - 1)))
+
+    return samples[idx]
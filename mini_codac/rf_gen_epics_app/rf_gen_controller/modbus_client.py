@@ -1,13 +1,135 @@
 
+# The Modbus commands of the generator are built and parsed here, so a
+# connection is just a TCP socket. pymodbus is not used, which keeps the import
+# of this module (and of the CLIs that use it) fast.
+
+import socket
 import struct
+import threading
+import tracing
 
 from parameters      import (CMDS,
                              DEFAULT_IP_ADDR,
-                             DEFAULT_TCP_PORT)
+                             DEFAULT_TCP_PORT,
+                             MODBUS_POOL_SIZE,
+                             MODBUS_TIMEOUT)
+from metrics         import Counters
 from psi_message     import Psi_Message
-from pymodbus.client import ModbusTcpClient
 
-class Modbus_Client(ModbusTcpClient):
+# Transaction counters of all Modbus clients in the process. "exceptions" are
+# exception responses sent by the generator (i.e. invalid command).
+MB_COUNTERS = Counters(['transactions', 'errors', 'timeouts',
+                        'connect_failures', 'exceptions'])
+
+# Connection pools, one per generator (key is (ipaddr, port))
+_pools = {}
+_pools_lock = threading.Lock()
+
+class Modbus_Pool():
+    """
+    Pool of open connections to one Modbus server. Connections are opened on
+    demand, kept open after use, and reused by the next command, so that a
+    command does not pay for a TCP connect.
+    """
+
+    def __init__(self, ipaddr: str, tcp_port: int, size: int=None):
+        """
+        Initializes the Modbus_Pool
+
+        Inputs:
+           ipaddr   (str)           - IP address of the Modbus server
+           tcp_port (int)           - Port of the Modbus server
+           size     (optional, int) - Maximum number of open connections.
+                                      Defaults to MODBUS_POOL_SIZE
+        """
+        self.ipaddr = ipaddr
+        self.port   = tcp_port
+        self.size   = size
+        if (self.size == None): self.size = MODBUS_POOL_SIZE
+
+        self._idle  = []
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock  = threading.Lock()
+
+        return
+
+    def acquire(self) -> socket.socket:
+        """
+        Returns a connected socket, waiting for a free one if all connections
+        are in use.
+
+        Outputs:
+           sock (socket) - Connected socket, or None if the connection could
+                           not be established
+        """
+        func_id = f'{__name__}.acquire'
+
+        self._slots.acquire()
+
+        with self._lock:
+            sock = self._idle.pop() if (self._idle) else None
+
+        if (sock == None):
+            try:
+                sock = socket.create_connection((self.ipaddr, self.port),
+                                                timeout=MODBUS_TIMEOUT)
+            except OSError as exc:
+                Psi_Message().debug(func_id, 'connect to %s:%s failed: %s',
+                                    self.ipaddr, self.port, exc)
+                self._slots.release()
+                return None
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        return sock
+
+    def release(self, sock: socket.socket, broken: bool=False):
+        """
+        Gives a socket back to the pool.
+
+        Inputs:
+           sock   (socket)         - Socket obtained from acquire
+           broken (optional, bool) - Set to True if the connection failed. It
+                                     is then closed instead of being reused.
+        """
+        if (broken):
+            sock.close()
+        else:
+            with self._lock:
+                self._idle.append(sock)
+
+        self._slots.release()
+
+        return
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        with self._lock:
+            for sock in self._idle:
+                sock.close()
+            self._idle = []
+
+        return
+
+def get_pool(ipaddr: str, tcp_port: int) -> Modbus_Pool:
+    """
+    Returns the connection pool of a Modbus server, creating it on first use.
+
+    Inputs:
+       ipaddr   (str) - IP address of the Modbus server
+       tcp_port (int) - Port of the Modbus server
+    """
+    with _pools_lock:
+        pool = _pools.get((ipaddr, tcp_port))
+        if (pool == None):
+            pool = Modbus_Pool(ipaddr, tcp_port)
+            _pools[(ipaddr, tcp_port)] = pool
+
+    return pool
+
+class Modbus_Client():
 
     def __init__(self, ipaddr: str=None, tcp_port: int=None):
         """
@@ -97,6 +219,7 @@ class Modbus_Client(ModbusTcpClient):
         if (fcode > 127):
             err_msg = f'Invalid command error: {resp[msg_len_idx]}'
             self.pmsg.error(func_id, err_msg)
+            MB_COUNTERS.incr('exceptions')
             return 
 
         length_data = resp[msg_len_idx]
@@ -129,6 +252,7 @@ class Modbus_Client(ModbusTcpClient):
         if (fcode > 127):
             err_msg = f'Invalid command error: {resp[cmd_num_high]}'
             self.pmsg.error(func_id, err_msg)
+            MB_COUNTERS.incr('exceptions')
             return None
 
         return None
@@ -152,34 +276,128 @@ class Modbus_Client(ModbusTcpClient):
         """
         func_id = f'{__name__}.send_cmd'
 
-        resp = None
-        with ModbusTcpClient(self.ipaddr, port=self.port) as client:
-            if (client.connect()):
-                client.socket.send(cmd)
-                response = client.socket.recv(1024)
-                if (func_code == 'r'):
-                    resp = self.parse_read_response(response)
-                else:
-                    resp = self.parse_write_response(response)
-
-            else:
+        pool = get_pool(self.ipaddr, self.port)
+
+        # A pooled connection may have been closed by the server while it was
+        # idle, so a failed send on a reused connection is retried once on a
+        # fresh connection. A write is only retried if it cannot have reached
+        # the generator, it must not be applied twice.
+        resp = -1
+        for attempt in range(2):
+            with tracing.span('mb_acquire'):
+                sock = pool.acquire()
+            if (sock == None):
                 err_msg = 'Cannot connect to server'
                 self.pmsg.error(func_id, err_msg)
+                MB_COUNTERS.incr('connect_failures')
                 resp = -1
+                break
+
+            MB_COUNTERS.incr('transactions')
+            sent = False
+            try:
+                with tracing.span('mb_io'):
+                    sock.sendall(cmd)
+                    sent = True
+                    # The whole response, as given by the MBAP length, so
+                    # nothing is left on the connection for the next command
+                    hdr = _recv_exact(sock, 6)
+                    body = _recv_exact(sock, struct.unpack('>H', hdr[4:6])[0])
+                if (hdr[:2] != cmd[:2]):
+                    raise ConnectionError('Response out of sequence')
+                response = hdr + body
+            except OSError as exc:
+                MB_COUNTERS.incr('timeouts' if (isinstance(exc, TimeoutError))
+                                 else 'errors')
+                pool.release(sock, broken=True)
+                self.pmsg.error(func_id, f'Modbus transaction failed: {exc}')
+                if ((func_code == 'r') or (not sent) or
+                    (isinstance(exc, (Connection_Closed, BrokenPipeError,
+                                      ConnectionResetError)))):
+                    continue
+                break
+
+            pool.release(sock)
+            if (func_code == 'r'):
+                resp = self.parse_read_response(response)
+            else:
+                resp = self.parse_write_response(response)
+            break
 
         return resp
 
+    def read_many(self, cmd_nums: list) -> list:
+        """
+        Reads several commands in one pipelined exchange: the read commands are
+        sent back to back on one connection, then the responses are read. The
+        batch costs one network round trip instead of one per command.
 
+        Inputs:
+            cmd_nums (list) - Command numbers to read
 
-
-
-
-
-
-
-
-
-
-
-
-
+        Outputs:
+            resps (list) - Response data of each command, in order (None for
+                           an exception response, see parse_read_response).
+                           Returns -1 if the exchange failed.
+        """
+        func_id = f'{__name__}.read_many'
+
+        cmds = [self.build_mb_cmd(cmd_num, 'r') for cmd_num in cmd_nums]
+        trans_nums = [cmd[:2] for cmd in cmds]
+
+        pool = get_pool(self.ipaddr, self.port)
+
+        # As in send_cmd, a failure on a reused connection is retried once
+        resps = -1
+        for attempt in range(2):
+            with tracing.span('mb_acquire'):
+                sock = pool.acquire()
+            if (sock == None):
+                self.pmsg.error(func_id, 'Cannot connect to server')
+                MB_COUNTERS.incr('connect_failures')
+                break
+
+            MB_COUNTERS.incr('transactions', len(cmds))
+            try:
+                with tracing.span('mb_io'):
+                    sock.sendall(b''.join(cmds))
+                    responses = []
+                    for trans_num in trans_nums:
+                        hdr = _recv_exact(sock, 6)
+                        body = _recv_exact(sock,
+                                           struct.unpack('>H', hdr[4:6])[0])
+                        if (hdr[:2] != trans_num):
+                            raise ConnectionError('Response out of sequence')
+                        responses.append(hdr + body)
+            except OSError as exc:
+                MB_COUNTERS.incr('timeouts' if (isinstance(exc, TimeoutError))
+                                 else 'errors')
+                pool.release(sock, broken=True)
+                self.pmsg.error(func_id, f'Modbus transaction failed: {exc}')
+                continue
+
+            pool.release(sock)
+            resps = [self.parse_read_response(resp) for resp in responses]
+            break
+
+        return resps
+
+class Connection_Closed(ConnectionError):
+    """
+    Raised when the server closed the connection (i.e. an idle pooled one).
+    """
+    pass
+
+def _recv_exact(sock: socket.socket, num: int) -> bytes:
+    """
+    Receives exactly num bytes. Raises Connection_Closed if the connection is
+    closed before.
+    """
+    data = b''
+    while (len(data) < num):
+        chunk = sock.recv(num - len(data))
+        if (len(chunk) == 0):
+            raise Connection_Closed('Connection closed by server')
+        data += chunk
+
+    return data
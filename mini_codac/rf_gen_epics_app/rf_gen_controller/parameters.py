@@ -5,6 +5,22 @@ import logging
 DEFAULT_IP_ADDR  = "192.168.0.150"
 DEFAULT_TCP_PORT = 502
 
+# Modbus connections. Each generator gets a pool of at most MODBUS_POOL_SIZE
+# connections, which are kept open between commands. MODBUS_TIMEOUT is the
+# connect/receive timeout in seconds.
+MODBUS_POOL_SIZE = 1
+MODBUS_TIMEOUT   = 2.0
+
+CHORD_NAMES = ['GAA0', 'GAB0', 'GAC0', 'GAD0']
+
+# Generators served by the driver. The key is the name used to address the
+# generator (i.e. "GEN2:GETPOWER?"). A generator can also be addressed by the
+# name of its chord, as long as it is the only generator of that chord. The
+# optional "poll" entry overrides the polling period (seconds) of the driver
+# for that generator.
+GENERATORS = {"GEN1": {"ip": DEFAULT_IP_ADDR, "port": DEFAULT_TCP_PORT,
+                       "chord": "GAD0"}}
+
 # A description of the command numbers in CMDS can be found in the Cito Plus
 # user manual "Air Cooled RF Generator cito and cito Plus" starting on page 262.
 CMDS = {"get_ip":(5100, "bytes"), "get_date":(7102, "str"),
@@ -16,6 +32,108 @@ CMDS = {"get_ip":(5100, "bytes"), "get_date":(7102, "str"),
         "hostname":(5105, "str"), "domain_name":(5106, "str"),
         "phase_shift":(1112, "int")}
 
+# Commands read by the background poller in the driver (see poller.py)
+POLL_CMDS = ['GETSTATE?', 'GETPOWER?', 'GETFWDPWR?', 'GETRFLPWR?',
+             'GETMATCHMODE?', 'GETLDCAP?', 'GETTNCAP?']
+
+# Adaptive polling by scan class (see Scan_Poller in poller.py). While RF is
+# off the periods of the classes are multiplied by ADAPT_IDLE_SCALE, for
+# ADAPT_HOLD seconds after a write, or after a value changed by more than
+# ADAPT_CHANGE (relative) and more than ADAPT_DEADBAND (raw units, i.e. the
+# noise of the reflected power near 0) between two reads, by
+# ADAPT_TRANSIENT_SCALE. No period goes below ADAPT_MIN_PERIOD or above
+# ADAPT_MAX_PERIOD (seconds).
+ADAPT_IDLE_SCALE      = 5.0
+ADAPT_TRANSIENT_SCALE = 0.25
+ADAPT_CHANGE          = 0.05
+ADAPT_DEADBAND        = 100
+ADAPT_HOLD            = 3.0
+ADAPT_MIN_PERIOD      = 0.05
+ADAPT_MAX_PERIOD      = 10.0
+
+# Scan classes of the EPICS records (see gen_epics.py), grouped by how fast
+# the parameters change. The commands of a class are read with one batched
+# command, GET<CLASS>? (i.e. GETFAST?), which answers with the values of the
+# commands separated by spaces, in this order. name: (SCAN, commands)
+SCAN_CLASSES = {"FAST": (".5 second", ['GETSTATE?', 'GETFWDPWR?',
+                                       'GETRFLPWR?']),
+                "MEDIUM": ("2 second", ['GETPOWER?', 'GETLDCAP?', 'GETTNCAP?',
+                                        'GETPHASE?']),
+                "SLOW": ("10 second", ['GETMATCHMODE?', 'GETCTRLSRC?'])}
+
+# Scan classes of the background poller when it polls by scan class (see
+# Scan_Poller in poller.py). name: (period in seconds, commands). The commands
+# that are due at the same time are read in one pipelined batch. The classes
+# group the commands like SCAN_CLASSES, and are polled faster than the records
+# scan them, so the records get fresh values. GETSTATE? has a class of its own:
+# an adaptive poller keeps reading it at full rate while RF is off, so that RF
+# on is seen at once, and slows down the other classes.
+POLL_CLASSES = {"STATE": (0.5, ['GETSTATE?']),
+                "FAST": (0.2, ['GETFWDPWR?', 'GETRFLPWR?']),
+                "MEDIUM": (1.0, ['GETPOWER?', 'GETLDCAP?', 'GETTNCAP?',
+                                 'GETPHASE?']),
+                "SLOW": (5.0, ['GETMATCHMODE?', 'GETCTRLSRC?'])}
+
+# Multicast telemetry (see telemetry_mcast.py). When enabled the driver
+# publishes every polled snapshot to MCAST_GROUP:MCAST_PORT. MCAST_TTL 1 keeps
+# the datagrams on the local subnet.
+MCAST_GROUP = "239.192.0.150"
+MCAST_PORT  = 5150
+MCAST_TTL   = 1
+
+# Default file of the request traces written by the driver (see tracing.py)
+TRACE_FILE = "rf_gen_trace.jsonl"
+
+# Profiling of the driver (see profiling.py). PROFILE_SAMPLE is the fraction
+# of the requests run under cProfile, PROFILE_TOP the number of functions and
+# source lines in a dump, PROFILE_FRAMES the traceback depth of tracemalloc.
+PROFILE_DIR    = "."
+PROFILE_SAMPLE = 0.05
+PROFILE_TOP    = 25
+PROFILE_FRAMES = 10
+
+# Local daemon of the command line tools (see gen_daemon.py). It listens on
+# DAEMON_SOCKET, polls the generators every DAEMON_POLL seconds and answers
+# reads from the polled values that are at most DAEMON_MAX_AGE seconds old.
+DAEMON_SOCKET  = "/tmp/rf_gen_daemon.sock"
+DAEMON_POLL    = 0.5
+DAEMON_MAX_AGE = 1.0
+
+# Discovery of the generators on a network (see gen_discovery.py). At most
+# DISCOVERY_CONCURRENCY addresses are probed at once, and a probe gives up
+# after DISCOVERY_TIMEOUT seconds.
+DISCOVERY_CONCURRENCY = 256
+DISCOVERY_TIMEOUT     = 0.5
+
+# Supervisor of the driver worker processes (see gen_supervisor.py). The
+# workers poll their generators every SUPERVISOR_POLL seconds. A worker that
+# dies is restarted after SUPERVISOR_RESTART seconds, doubled for every crash
+# within SUPERVISOR_STABLE seconds of its start, up to SUPERVISOR_RESTART_MAX.
+SUPERVISOR_POLL        = 0.5
+SUPERVISOR_RESTART     = 1.0
+SUPERVISOR_RESTART_MAX = 30.0
+SUPERVISOR_STABLE      = 10.0
+
+# Prefix of the PVs served by the driver itself (see pv_server.py)
+PV_PREFIX = "RFGEN:"
+
+# Admission control in the driver (see dispatch_queue.py and admission.py).
+# MAX_QUEUE_DEPTH bounds the requests waiting for the generator, and
+# MAX_CONN_QUEUE the lines waiting on a single client connection. When a
+# queue is full the OVERLOAD_POLICY is applied, either "busy" (reject the new
+# request with BUSY) or "shed" (drop the oldest queued poll/read request).
+MAX_QUEUE_DEPTH = 64
+MAX_CONN_QUEUE  = 16
+OVERLOAD_POLICY = "busy"
+
+# Messages (see psi_message.py). The debug log file of the driver is rotated
+# once it reaches LOG_MAX_BYTES, keeping LOG_BACKUPS old files. At most
+# LOG_QUEUE_SIZE messages wait for the writer thread, more are dropped.
+LOG_FILE       = "dbg_log.txt"
+LOG_MAX_BYTES  = 10000000
+LOG_BACKUPS    = 5
+LOG_QUEUE_SIZE = 10000
+
 MAX_POWER = 999 # mili-Watts
 MIN_POWER = 1000000 # mili-Watts
 
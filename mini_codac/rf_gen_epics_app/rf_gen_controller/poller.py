@@ -0,0 +1,412 @@
+import threading
+import time
+
+from dispatch_queue import Busy, POLL, Preempted
+from parameters     import (ADAPT_CHANGE, ADAPT_DEADBAND, ADAPT_HOLD,
+                            ADAPT_IDLE_SCALE, ADAPT_MAX_PERIOD,
+                            ADAPT_MIN_PERIOD, ADAPT_TRANSIENT_SCALE,
+                            POLL_CLASSES, POLL_CMDS)
+from psi_message    import Psi_Message
+
+# Minimum time (seconds) between two overrun messages of a Scan_Poller
+OVERRUN_REPORT = 10.0
+
+# Generator state (command 8000) in which the adaptive Scan_Poller is idle
+STATE_READY = 1 # Ready (RF Off)
+
+# Modes of the adaptive Scan_Poller: scale of the periods of the scan classes
+ADAPT_MODES = {"idle": ADAPT_IDLE_SCALE, "active": 1.0,
+               "transient": ADAPT_TRANSIENT_SCALE}
+
+class Poller():
+    """
+    Background poller. Periodically reads a list of commands through the
+    lookup table at the lowest priority (POLL) and keeps the latest value of
+    each one.
+    """
+
+    def __init__(self, cmd_table, period: float, cmds: list=None):
+        """
+        Initializes the Poller class.
+
+        Inputs:
+            cmd_table (Cmd_Lookup)    - Lookup table used to read the commands
+            period    (float)         - Time between polling cycles (seconds)
+            cmds      (optional, list) - Commands that are polled. Defaults to
+                                         POLL_CMDS in parameters.py
+        """
+        self._cmd_table = cmd_table
+        self._period    = period
+        self._cmds      = cmds
+        if (self._cmds == None): self._cmds = POLL_CMDS
+
+        self._lock     = threading.Lock()
+        self._snapshot = {} # cmd -> (value, time of the read)
+        self._listeners = []
+        self._stop     = threading.Event()
+        self._thread   = None
+
+        return
+
+    def start(self):
+        """
+        Starts the polling thread.
+
+        Inputs:
+            None
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        return
+
+    def stop(self):
+        """
+        Stops the polling thread.
+
+        Inputs:
+            None
+        """
+        self._stop.set()
+        if (self._thread != None):
+            self._thread.join()
+
+        return
+
+    def add_listener(self, func):
+        """
+        Registers a function that is called with the snapshot at the end of
+        every polling cycle. It is called from the polling thread, so it must
+        not block.
+
+        Inputs:
+            func (callable) - func(snapshot), snapshot as returned by snapshot()
+        """
+        self._listeners.append(func)
+
+        return
+
+    def cmds(self) -> list:
+        """
+        Returns the list of polled commands.
+
+        Inputs:
+            None
+        """
+        return list(self._cmds)
+
+    def snapshot(self) -> dict:
+        """
+        Returns a copy of the latest polled values.
+
+        Inputs:
+            None
+
+        Returns:
+            dict - {cmd: (value, time.time() at which the read was issued)}
+        """
+        with self._lock:
+            return dict(self._snapshot)
+
+    def cached(self, cmd: str, max_age: float, t_min: float=0.0) -> str|int:
+        """
+        Returns the latest polled value of a command if it is recent enough.
+
+        Inputs:
+            cmd     (str)             - Command
+            max_age (float)           - Maximum age of the value (seconds)
+            t_min   (optional, float) - The value must also have been read
+                                        after this time.time()
+
+        Returns:
+            The value, or None if the command was not polled recently
+        """
+        with self._lock:
+            entry = self._snapshot.get(cmd)
+
+        if (entry == None):
+            return None
+
+        value, t_read = entry
+        if ((t_read < t_min) or (time.time() - t_read > max_age)):
+            return None
+
+        return value
+
+    def _run(self):
+        """
+        Polling loop. A read that was preempted by a safety command, or shed
+        because the driver is overloaded, is simply skipped, it will be read
+        again during the next cycle.
+        """
+        func_id = f'{__name__}._run'
+        pmsg = Psi_Message()
+
+        while (not self._stop.is_set()):
+            t_start = time.monotonic()
+
+            for cmd in self._cmds:
+                # Stamped before the read: a write that finishes while it
+                # waits in the queue must not look older than the value
+                t_read = time.time()
+                try:
+                    value = self._cmd_table.cmd_lookup(cmd, priority=POLL)
+                except (Preempted, Busy):
+                    continue
+                except Exception as exc:
+                    pmsg.error(func_id, f'Failed to poll {cmd}: {exc}')
+                    continue
+
+                with self._lock:
+                    self._snapshot[cmd] = (value, t_read)
+
+            snapshot = self.snapshot()
+            for func in self._listeners:
+                try:
+                    func(snapshot)
+                except Exception as exc:
+                    pmsg.error(func_id, f'Snapshot listener failed: {exc}')
+
+            t_wait = self._period - (time.monotonic() - t_start)
+            if (t_wait > 0.0):
+                self._stop.wait(t_wait)
+
+        return
+
+class Scan_Poller(Poller):
+    """
+    Background poller with scan classes. Every class has its own period, and
+    the commands of all classes that are due are read in one pipelined batch
+    (see Cmd_Lookup.read_pipelined), so that the fast values are read often and
+    the slow ones do not take bus time they do not need. A class whose next
+    read is already due when its batch is done has overrun its schedule: the
+    missed reads are skipped and counted (see stats).
+
+    An adaptive poller scales the periods of the classes with the state of the
+    generator: it slows down while RF is off ("idle"), except for the read of
+    the state, so that RF on is still seen at once, and it speeds up
+    for ADAPT_HOLD seconds after a write or after a value changed by more than
+    ADAPT_CHANGE and ADAPT_DEADBAND between two reads ("transient"). The periods stay within
+    ADAPT_MIN_PERIOD and ADAPT_MAX_PERIOD.
+    """
+
+    def __init__(self, cmd_table, classes: dict=None, adaptive: bool=False):
+        """
+        Initializes the Scan_Poller class.
+
+        Inputs:
+            cmd_table (Cmd_Lookup)     - Lookup table used to read the commands
+            classes   (optional, dict) - {name: (period, commands)}. Defaults
+                                         to POLL_CLASSES in parameters.py
+            adaptive  (optional, bool) - Adapt the periods to the state of the
+                                         generator
+        """
+        if (classes == None): classes = POLL_CLASSES
+
+        cmds = []
+        for period, class_cmds in classes.values():
+            cmds += [cmd for cmd in class_cmds if (cmd not in cmds)]
+
+        super().__init__(cmd_table, min(period for period, class_cmds in
+                                        classes.values()), cmds)
+
+        self._classes = dict(classes)
+
+        # Only the state keeps its rate while idle, so an adaptive poller
+        # reads it in a class of its own, at the period of its class
+        if (adaptive):
+            for name, (period, class_cmds) in classes.items():
+                if (('GETSTATE?' in class_cmds) and (len(class_cmds) > 1)):
+                    self._classes[name] = (period, [cmd for cmd in class_cmds
+                                                    if (cmd != 'GETSTATE?')])
+                    self._classes[f'{name}_STATE'] = (period, ['GETSTATE?'])
+
+        self._num_batches = 0
+        self._t_batch     = 0.0 # Duration of the last batch (seconds)
+        self._overruns    = {name: 0 for name in self._classes}
+        self._missed      = {name: 0 for name in self._classes}
+        self._t_report    = 0.0
+
+        self._adaptive    = adaptive
+        self._mode        = "active"
+        self._t_transient = None # time.monotonic() of the last transient
+
+        return
+
+    def period(self, name: str) -> float:
+        """
+        Returns the current period (seconds) of a scan class.
+
+        Inputs:
+            name (str) - Name of the class
+        """
+        period, cmds = self._classes[name]
+        if (not self._adaptive):
+            return period
+
+        scale = ADAPT_MODES[self._mode]
+        if ((self._mode == "idle") and (cmds == ['GETSTATE?'])):
+            scale = 1.0
+
+        return min(max(period*scale, ADAPT_MIN_PERIOD), ADAPT_MAX_PERIOD)
+
+    def rates(self) -> str:
+        """
+        Returns the mode and the current period of every class, as
+        "mode=<mode> <class>=<period> ...", periods in seconds. Answers
+        GETPOLL?.
+
+        Inputs:
+            None
+        """
+        periods = ' '.join(f'{name}={self.period(name):.3f}'
+                           for name in self._classes)
+
+        return f'mode={self._mode} {periods}'
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the scheduler: the number of batches, the
+        duration of the last one (ms), and the overruns and missed reads of
+        every class.
+
+        Inputs:
+            None
+        """
+        stats = {"batches": self._num_batches,
+                 "batch_ms": round(self._t_batch*1000.0, 2)}
+        for name in self._classes:
+            stats[f'{name}_overruns'] = self._overruns[name]
+            stats[f'{name}_missed'] = self._missed[name]
+            stats[f'{name}_period_ms'] = round(self.period(name)*1000.0, 1)
+
+        return stats
+
+    def _run(self):
+        """
+        Scheduling loop. Each class is read on a fixed schedule from the start,
+        so the periods do not drift.
+        """
+        func_id = f'{__name__}._run'
+        pmsg = Psi_Message()
+
+        t_due = {name: time.monotonic() for name in self._classes}
+
+        while (not self._stop.is_set()):
+            t_now = time.monotonic()
+            due = [name for name in self._classes if (t_due[name] <= t_now)]
+            if (not due):
+                self._stop.wait(min(t_due.values()) - t_now)
+                continue
+
+            cmds = []
+            for name in due:
+                cmds += [cmd for cmd in self._classes[name][1]
+                         if (cmd not in cmds)]
+
+            # Stamped before the batch, see Poller._run
+            t_read = time.time()
+            try:
+                values = self._cmd_table.read_pipelined(cmds, POLL)
+            except (Preempted, Busy):
+                values = {}
+            except Exception as exc:
+                pmsg.error(func_id, f'Failed to poll {" ".join(cmds)}: {exc}')
+                values = {}
+
+            with self._lock:
+                previous = dict(self._snapshot)
+                for cmd, value in values.items():
+                    self._snapshot[cmd] = (value, t_read)
+
+            t_done = time.monotonic()
+            self._num_batches += 1
+            self._t_batch = t_done - t_now
+
+            if (values):
+                snapshot = self.snapshot()
+                for func in self._listeners:
+                    try:
+                        func(snapshot)
+                    except Exception as exc:
+                        pmsg.error(func_id, f'Snapshot listener failed: {exc}')
+
+            if (self._adaptive):
+                self._adapt(values, previous)
+                # A class that got faster is not left waiting for its old
+                # period
+                for name in self._classes:
+                    t_due[name] = min(t_due[name], t_done + self.period(name))
+
+            for name in due:
+                period = self.period(name)
+                t_due[name] += period
+                if (t_due[name] <= t_done):
+                    missed = int((t_done - t_due[name])/period) + 1
+                    t_due[name] += missed*period
+                    self._overruns[name] += 1
+                    self._missed[name] += missed
+                    self._report(name, missed)
+
+        return
+
+    def _adapt(self, values: dict, previous: dict):
+        """
+        Selects the mode from the values just read and the previous ones.
+        """
+        func_id = f'{__name__}._adapt'
+        pmsg = Psi_Message()
+
+        t_now = time.monotonic()
+
+        # A write is a transient from the time it was done
+        t_write = t_now - (time.time() - self._cmd_table.last_write())
+        if ((self._t_transient == None) or (t_write > self._t_transient)):
+            self._t_transient = t_write
+
+        for cmd, value in values.items():
+            old = previous.get(cmd)
+            if ((old == None) or (not isinstance(value, int)) or
+                (not isinstance(old[0], int))):
+                continue
+            if (abs(value - old[0]) > max(ADAPT_CHANGE*abs(old[0]),
+                                          ADAPT_DEADBAND)):
+                pmsg.debug(func_id, 'transient: %s %s -> %s', cmd, old[0],
+                           value)
+                self._t_transient = t_now
+
+        with self._lock:
+            state = self._snapshot.get('GETSTATE?', (None, 0.0))[0]
+
+        if ((self._t_transient != None) and
+            (t_now - self._t_transient < ADAPT_HOLD)):
+            mode = "transient"
+        elif (state == STATE_READY):
+            mode = "idle"
+        else:
+            mode = "active"
+
+        if (mode != self._mode):
+            pmsg.debug(func_id, 'poll mode %s -> %s', self._mode, mode)
+            self._mode = mode
+
+        return
+
+    def _report(self, name: str, missed: int):
+        """
+        Reports an overrun, at most once every OVERRUN_REPORT seconds.
+        """
+        func_id = f'{__name__}._report'
+        pmsg = Psi_Message()
+
+        t_now = time.monotonic()
+        if (t_now - self._t_report < OVERRUN_REPORT):
+            return
+        self._t_report = t_now
+
+        pmsg.error(func_id, f'Scan class {name} overran its period of '
+                            f'{self._classes[name][0]} s, {missed} reads '
+                            f'skipped (batch {self._t_batch*1000.0:.1f} ms, '
+                            f'{self._overruns[name]} overruns so far)')
+
+        return
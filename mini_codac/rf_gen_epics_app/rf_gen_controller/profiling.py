@@ -0,0 +1,369 @@
+# Opt-in profiling of the driver, to investigate CPU spikes and memory growth
+# on the driver host without editing code. Enabled with the --PROFILE option
+# of rf_gen_tcp_driver.py, or with the environment variables
+#
+#     RFGEN_PROFILE           cpu, mem or all
+#     RFGEN_PROFILE_INTERVAL  dump every this many seconds (default: only on
+#                             SIGUSR1)
+#     RFGEN_PROFILE_DIR       directory of the dump files (PROFILE_DIR)
+#     RFGEN_PROFILE_SAMPLE    fraction of the requests run under cProfile
+#                             (PROFILE_SAMPLE)
+#
+# Every request handled by tcp_server, and the work it queues for the
+# generator, is wrapped in request(). In cpu mode the CPU time of every
+# request is added up per command, and a sample of the requests is run under
+# cProfile. In mem mode tracemalloc runs, and the memory allocated (and not
+# freed) by each request is added up per command. A dump is written on SIGUSR1
+# (kill -USR1 <pid>) and every interval. It holds the statistics since the
+# previous dump and, in mem mode, the source lines whose allocations grew the
+# most since the previous dump.
+
+import collections
+import os
+import random
+import signal
+import threading
+import time
+
+from parameters  import (PROFILE_DIR, PROFILE_FRAMES, PROFILE_SAMPLE,
+                         PROFILE_TOP)
+from psi_message import Psi_Message
+
+MODES = ['cpu', 'mem', 'all']
+
+# Imported by start(), so that the driver does not pay for them when profiling
+# is disabled
+cProfile    = None
+pstats      = None
+tracemalloc = None
+
+_local    = threading.local()
+_profiler = None
+
+class _Null_Request():
+    """
+    Context manager that does nothing, used when profiling is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_REQUEST = _Null_Request()
+
+class _Request():
+    """
+    Context manager that profiles one request (or the part of it executed by
+    one thread).
+    """
+
+    def __init__(self, profiler, key: str, count: bool):
+        self._profiler = profiler
+        self._key      = key
+        self._count    = count
+
+        return
+
+    def __enter__(self):
+        self._prev = getattr(_local, 'key', None)
+        _local.key = self._key
+
+        self._prof = None
+        if (self._profiler.cpu and (random.random() < self._profiler.sample)):
+            self._prof = self._profiler._acquire(self._key)
+            self._prof.enable()
+
+        if (self._profiler.mem):
+            self._mem_start = tracemalloc.get_traced_memory()[0]
+        self._cpu_start = time.thread_time()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        cpu = time.thread_time() - self._cpu_start
+        mem = 0
+        if (self._profiler.mem):
+            mem = tracemalloc.get_traced_memory()[0] - self._mem_start
+
+        if (self._prof != None):
+            self._prof.disable()
+            self._profiler._release(self._key, self._prof)
+
+        self._profiler._record(self._key, self._count, cpu, mem)
+        _local.key = self._prev
+
+        return False
+
+class Profiler():
+    """
+    Collects the statistics and writes the dumps.
+    """
+
+    def __init__(self, mode: str, interval: float=None, out_dir: str=None,
+                 sample: float=None):
+        """
+        Initializes the Profiler class.
+
+        Inputs:
+            mode     (str)             - "cpu", "mem" or "all"
+            interval (optional, float) - Dump every interval seconds. Only on
+                                         SIGUSR1 if not given
+            out_dir  (optional, str)   - Directory of the dumps. Defaults to
+                                         PROFILE_DIR in parameters.py
+            sample   (optional, float) - Fraction of the requests run under
+                                         cProfile. Defaults to PROFILE_SAMPLE
+        """
+        if (out_dir == None): out_dir = PROFILE_DIR
+        if (sample == None): sample = PROFILE_SAMPLE
+
+        self.cpu      = mode in ('cpu', 'all')
+        self.mem      = mode in ('mem', 'all')
+        self.sample   = sample
+        self.interval = interval
+        self.out_dir  = out_dir
+
+        self._lock     = threading.Lock()
+        self._stats    = self._new_stats()
+        self._profs    = {} # (command, thread) -> cProfile.Profile
+        self._active   = set()
+        self._snapshot = None
+        self._num_dump = 0
+        self._t_dump   = time.time()
+        self._dump_now = threading.Event()
+
+        return
+
+    def start(self):
+        """
+        Starts tracemalloc (mem mode), the SIGUSR1 handler and the dump thread.
+        """
+        func_id = f'{__name__}.start'
+        pmsg = Psi_Message()
+
+        if (self.mem):
+            tracemalloc.start(PROFILE_FRAMES)
+            self._snapshot = tracemalloc.take_snapshot()
+
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame:
+                                              self._dump_now.set())
+        except (AttributeError, ValueError) as exc:
+            # No SIGUSR1 (Windows), or not called from the main thread
+            pmsg.error(func_id, f'Cannot dump on SIGUSR1: {exc}')
+
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+        return
+
+    def request(self, key: str, count: bool=True):
+        """
+        Returns a context manager that profiles a request.
+
+        Inputs:
+            key   (str)            - Command of the request
+            count (optional, bool) - Count the request. False for the part of
+                                     a request executed by another thread
+        """
+        return _Request(self, key, count)
+
+    def _new_stats(self) -> dict:
+        return collections.defaultdict(lambda: {"n": 0, "cpu": 0.0, "mem": 0})
+
+    def _acquire(self, key: str) -> 'cProfile.Profile':
+        """
+        Returns the cProfile of the command in this thread, marked active so
+        that it is not dumped while it runs.
+        """
+        with self._lock:
+            ident = (key, threading.get_ident())
+            prof = self._profs.get(ident)
+            if (prof == None):
+                prof = cProfile.Profile()
+                self._profs[ident] = prof
+            self._active.add(ident)
+
+        return prof
+
+    def _release(self, key: str, prof: 'cProfile.Profile'):
+        with self._lock:
+            self._active.discard((key, threading.get_ident()))
+
+        return
+
+    def _record(self, key: str, count: bool, cpu: float, mem: int):
+        with self._lock:
+            stats = self._stats[key]
+            if (count): stats["n"] += 1
+            stats["cpu"] += cpu
+            stats["mem"] += mem
+
+        return
+
+    def _run(self):
+        """
+        Dump thread. Dumps on SIGUSR1 and every interval.
+        """
+        func_id = f'{__name__}._run'
+        pmsg = Psi_Message()
+
+        while True:
+            self._dump_now.wait(self.interval)
+            self._dump_now.clear()
+            try:
+                path = self.dump()
+                pmsg.info(func_id, f'Profile written to {path}')
+            except Exception as exc:
+                pmsg.error(func_id, f'Profile dump failed: {exc!r}')
+
+    def dump(self) -> str:
+        """
+        Writes the statistics since the previous dump and resets them.
+
+        Returns:
+            str - Path of the dump file
+        """
+        with self._lock:
+            stats, self._stats = self._stats, self._new_stats()
+            profs = {ident: prof for ident, prof in self._profs.items()
+                     if (ident not in self._active)}
+            for ident in profs:
+                del self._profs[ident]
+
+        t_now = time.time()
+        self._num_dump += 1
+        path = os.path.join(self.out_dir, f'rf_gen_profile_{os.getpid()}_'
+                                          f'{self._num_dump:04d}.txt')
+
+        with open(path, 'w') as file:
+            file.write(f'# Profile {self._num_dump} of pid {os.getpid()}, '
+                       f'{time.ctime(self._t_dump)} to {time.ctime(t_now)}\n\n')
+            self._write_table(file, stats)
+            if (self.cpu):
+                self._write_cprofile(file, profs)
+            if (self.mem):
+                self._write_growth(file)
+
+        self._t_dump = t_now
+
+        return path
+
+    def _write_table(self, file, stats: dict):
+        """
+        Writes the per command CPU time and allocations.
+        """
+        file.write(f'{"command":<20}{"requests":>10}{"cpu ms":>12}'
+                   f'{"cpu us/req":>12}{"alloc KiB":>12}\n')
+
+        rows = sorted(stats.items(), key=lambda item: -item[1]["cpu"])
+        for key, stat in rows:
+            per_req = 1e6*stat["cpu"]/max(stat["n"], 1)
+            file.write(f'{key:<20}{stat["n"]:>10}{1000.0*stat["cpu"]:>12.1f}'
+                       f'{per_req:>12.1f}{stat["mem"]/1024.0:>12.1f}\n')
+
+        return
+
+    def _write_cprofile(self, file, profs: dict):
+        """
+        Writes the cProfile statistics of the sampled requests per command.
+        """
+        per_key = collections.defaultdict(list)
+        for (key, ident), prof in profs.items():
+            per_key[key].append(prof)
+
+        for key, key_profs in sorted(per_key.items()):
+            file.write(f'\n===== {key} (sampled requests) =====\n')
+            stats = pstats.Stats(key_profs[0], stream=file)
+            for prof in key_profs[1:]:
+                stats.add(prof)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+
+        return
+
+    def _write_growth(self, file):
+        """
+        Writes the source lines whose allocations grew the most.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+                       [tracemalloc.Filter(False, tracemalloc.__file__)])
+        current, peak = tracemalloc.get_traced_memory()
+
+        file.write(f'\n===== Memory: {current/1024.0:.1f} KiB traced, peak '
+                   f'{peak/1024.0:.1f} KiB. Largest growth since the '
+                   f'previous dump =====\n')
+        for diff in snapshot.compare_to(self._snapshot, 'lineno')[:PROFILE_TOP]:
+            file.write(f'{diff}\n')
+
+        self._snapshot = snapshot
+
+        return
+
+def start(mode: str=None, interval: float=None, out_dir: str=None,
+          sample: float=None) -> Profiler:
+    """
+    Enables profiling. Arguments that are not given are taken from the
+    RFGEN_PROFILE* environment variables.
+
+    Inputs:
+        mode     (optional, str)   - "cpu", "mem" or "all". Profiling stays
+                                     disabled if neither given nor set
+        interval (optional, float) - Dump interval (seconds)
+        out_dir  (optional, str)   - Directory of the dumps
+        sample   (optional, float) - Fraction of the requests run under
+                                     cProfile
+
+    Returns:
+        The profiler, or None if profiling is disabled
+    """
+    global _profiler, cProfile, pstats, tracemalloc
+
+    func_id = f'{__name__}.start'
+    pmsg = Psi_Message()
+
+    env = os.environ
+    if (mode == None): mode = env.get('RFGEN_PROFILE')
+    if ((interval == None) and (env.get('RFGEN_PROFILE_INTERVAL'))):
+        interval = float(env['RFGEN_PROFILE_INTERVAL'])
+    if (out_dir == None): out_dir = env.get('RFGEN_PROFILE_DIR')
+    if ((sample == None) and (env.get('RFGEN_PROFILE_SAMPLE'))):
+        sample = float(env['RFGEN_PROFILE_SAMPLE'])
+
+    if (not mode):
+        return None
+
+    if (mode not in MODES):
+        pmsg.error(func_id, f'Unknown profiling mode {mode}, use one of {MODES}')
+        return None
+
+    import cProfile, pstats, tracemalloc
+
+    _profiler = Profiler(mode, interval, out_dir, sample)
+    _profiler.start()
+
+    return _profiler
+
+def request(key: str, count: bool=True):
+    """
+    Returns a context manager that profiles a request, or does nothing if
+    profiling is disabled.
+
+    Inputs:
+        key   (str)            - Command of the request. None for work that
+                                 is not done for a client request
+        count (optional, bool) - Count the request
+    """
+    if (_profiler == None):
+        return _NULL_REQUEST
+
+    if (key == None): key = getattr(_local, 'key', None)
+    if (key == None): key = 'BACKGROUND' # i.e. the poller
+
+    return _profiler.request(key, count)
+
+def current() -> str:
+    """
+    Returns the command of the request profiled in this thread, or None.
+    """
+    return getattr(_local, 'key', None)
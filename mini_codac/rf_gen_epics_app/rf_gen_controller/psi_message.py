@@ -1,37 +1,196 @@
 
-import datetime
-
-class Psi_Message:
+# Messages are filtered by level before they are formatted, and are written by
+# a background thread, so that logging does not slow down the code that logs.
+# A message may be given as a %-format string with its arguments, i.e.
+#
+#     pmsg.debug(func_id, 'cmd=%s, args=%s', cmd, args)
+#
+# which costs almost nothing when DEBUG is disabled, since the string is only
+# built by the writer thread. Call configure() once at start up to set the
+# level and to write the messages to a rotating log file.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from parameters import LOG_BACKUPS, LOG_FILE, LOG_MAX_BYTES, LOG_QUEUE_SIZE
+
+DEBUG = logging.DEBUG
+INFO  = logging.INFO
+ERROR = logging.ERROR
+
+class _Formatter(logging.Formatter):
+    """
+    Formats a message as "<date time> : <LEVEL> : <id_str> : <msg>". The date
+    string only changes once per second, so it is cached.
+    """
 
     def __init__(self):
-        self.num_mess = 0
-        self.date_fmt = "%a %b %d %Y:%I:%M:%S %p"
+        super().__init__()
+        self.date_fmt  = "%a %b %d %Y:%I:%M:%S %p"
+        self._sec      = None
+        self._date_str = ''
 
         return
 
-    def debug(self, id_str: str, msg: str):
-        date_time = datetime.datetime.now().strftime(self.date_fmt)
-        print(f'{date_time} : DEBUG : {id_str} : {msg}')
+    def formatTime(self, record, datefmt=None) -> str:
+        sec = int(record.created)
+        if (sec != self._sec):
+            self._sec = sec
+            self._date_str = time.strftime(self.date_fmt, time.localtime(sec))
 
-        return
+        return self._date_str
 
-    def error(self, id_str: str, msg: str):
-        date_time = datetime.datetime.now().strftime(self.date_fmt)
-        print(f'{date_time} : ERROR : {id_str} : {msg}')
+    def format(self, record) -> str:
+        msg = f'{self.formatTime(record)} : {record.levelname} : ' \
+              f'{record.id_str} : {record.getMessage()}'
+        if (record.exc_info):
+            msg += '\n' + self.formatException(record.exc_info)
 
-        return
+        return msg
+
+class _Drop_Queue_Handler(logging.handlers.QueueHandler):
+    """
+    Queue handler that drops messages instead of blocking when the writer
+    thread falls behind.
+    """
 
+    num_dropped = 0
 
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _Drop_Queue_Handler.num_dropped += 1
 
+        return
 
+    def prepare(self, record):
+        # The writer thread formats the message, not the caller
+        return record
+
+_logger   = logging.getLogger('psi')
+_logger.propagate = False
+_logger.setLevel(DEBUG)
+_queue    = queue.Queue(LOG_QUEUE_SIZE)
+_listener = None
+_lock     = threading.Lock()
+_exiting  = False
+
+def configure(level: int=DEBUG, log_file: str=None, console_level: int=None,
+              max_bytes: int=None, backups: int=None):
+    """
+    Configures the messages of the process. May be called again to change the
+    configuration.
+
+    Inputs:
+        level         (optional, int) - Lowest level that is logged (DEBUG,
+                                        INFO or ERROR)
+        log_file      (optional, str) - Also write the messages to this file,
+                                        which is rotated when it gets too big.
+                                        True writes to LOG_FILE
+        console_level (optional, int) - Lowest level printed to stdout.
+                                        Defaults to level
+        max_bytes     (optional, int) - Size at which the log file is rotated.
+                                        Defaults to LOG_MAX_BYTES
+        backups       (optional, int) - Number of rotated log files that are
+                                        kept. Defaults to LOG_BACKUPS
+    """
+    global _listener
+
+    if (console_level == None): console_level = level
+    if (log_file == True): log_file = LOG_FILE
+    if (max_bytes == None): max_bytes = LOG_MAX_BYTES
+    if (backups == None): backups = LOG_BACKUPS
+
+    with _lock:
+        if (_listener != None):
+            _listener.stop()
+        _listener = _start(level, log_file, console_level, max_bytes, backups)
+
+    return
+
+def _start(level: int, log_file: str, console_level: int, max_bytes: int,
+           backups: int) -> logging.handlers.QueueListener:
+    """
+    Creates the handlers and starts the writer thread.
+    """
+    formatter = _Formatter()
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(console_level)
+    console.setFormatter(formatter)
+    handlers = [console]
+
+    if (log_file):
+        rotating = logging.handlers.RotatingFileHandler(log_file,
+                                                        maxBytes=max_bytes,
+                                                        backupCount=backups)
+        rotating.setLevel(level)
+        rotating.setFormatter(formatter)
+        handlers.append(rotating)
+
+    _logger.setLevel(min(level, console_level))
+    if (not _logger.handlers):
+        _logger.addHandler(_Drop_Queue_Handler(_queue))
+
+    listener = logging.handlers.QueueListener(_queue, *handlers,
+                                              respect_handler_level=True)
+    listener.start()
+
+    return listener
+
+def flush():
+    """
+    Writes the queued messages and stops the writer thread. Called at exit.
+    """
+    global _listener, _exiting
+
+    with _lock:
+        _exiting = True
+        if (_listener != None):
+            _listener.stop()
+            _listener = None
+
+    return
+
+atexit.register(flush)
 
+class Psi_Message:
 
+    def __init__(self):
+        self.num_mess = 0
 
+        # Print everything to stdout unless configure() was called
+        if ((_listener == None) and (not _exiting)):
+            configure()
 
+        return
 
+    def enabled(self, level: int) -> bool:
+        """
+        Returns True if messages of this level are logged.
+        """
+        return _logger.isEnabledFor(level)
 
+    def debug(self, id_str: str, msg: str, *args):
+        if (_logger.isEnabledFor(DEBUG)):
+            _logger.debug(msg, *args, extra={"id_str": id_str})
 
+        return
 
+    def info(self, id_str: str, msg: str, *args):
+        if (_logger.isEnabledFor(INFO)):
+            _logger.info(msg, *args, extra={"id_str": id_str})
 
+        return
 
+    def error(self, id_str: str, msg: str, *args):
+        if (_logger.isEnabledFor(ERROR)):
+            _logger.error(msg, *args, extra={"id_str": id_str})
 
+        return
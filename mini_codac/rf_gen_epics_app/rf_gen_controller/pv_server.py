@@ -0,0 +1,207 @@
+# Channel Access server built into the driver (optional, requires caproto).
+# It publishes the snapshots of the background pollers (see poller.py) as PVs,
+# so EPICS clients get monitor updates when a value changes instead of having
+# StreamDevice records send a text request to the driver on every scan.
+#
+# PV names are <PREFIX><GEN>:<NAME>, i.e. RFGEN:GEN1:FWD_PWR. There is a
+# readback PV for each polled command in READBACKS, and a set-point PV for
+# each command in SETPOINTS. A put to a set-point PV is executed like the
+# write command from a client, and the set-point PVs start at the first polled
+# value of their readback.
+
+import asyncio
+import threading
+
+from admission   import BUSY_RESP
+from parameters  import PV_PREFIX
+from psi_message import Psi_Message
+
+try:
+    from caproto                import ChannelInteger
+    from caproto.asyncio.server import Context
+    HAVE_CAPROTO = True
+except ImportError:
+    ChannelInteger = object
+    HAVE_CAPROTO = False
+
+# PV name -> polled command
+READBACKS = {"STATE": 'GETSTATE?', "POWER_RBV": 'GETPOWER?',
+             "FWD_PWR": 'GETFWDPWR?', "RFL_PWR": 'GETRFLPWR?',
+             "CTRL_SRC": 'GETCTRLSRC?', "MATCH_MODE_RBV": 'GETMATCHMODE?',
+             "LOAD_CAP_RBV": 'GETLDCAP?', "TUNE_CAP_RBV": 'GETTNCAP?',
+             "PHASE": 'GETPHASE?'}
+
+# PV name -> (write command, polled command of the readback)
+SETPOINTS = {"POWER_SP": ('SETPOWER$', 'GETPOWER?'),
+             "RF_SP": ('SETRF$', None),
+             "MATCH_MODE_SP": ('SETMATCHMODE$', 'GETMATCHMODE?'),
+             "LOAD_CAP_SP": ('SETLDCAP$', 'GETLDCAP?'),
+             "TUNE_CAP_SP": ('SETTNCAP$', 'GETTNCAP?')}
+
+class Setpoint_Channel(ChannelInteger):
+    """
+    Integer PV whose puts are sent to the generator.
+    """
+
+    def __init__(self, cmd_table, cmd: str, **kwargs):
+        """
+        Initializes the Setpoint_Channel class.
+
+        Inputs:
+            cmd_table (Cmd_Lookup) - Lookup table of the generator
+            cmd       (str)        - Write command, i.e. "SETPOWER$"
+        """
+        super().__init__(value=0, **kwargs)
+        self._cmd_table = cmd_table
+        self._cmd = cmd
+        self.synced = False # True once a value was put or read back
+
+        return
+
+    async def verify_value(self, data):
+        """
+        Called by caproto on a put. Executes the write command, the put fails
+        if the command fails.
+        """
+        func_id = f'{__name__}.verify_value'
+        pmsg = Psi_Message()
+
+        pmsg.debug(func_id, f'put {self._cmd} {data}')
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, self._cmd_table.cmd_lookup,
+                                            self._cmd, int(data))
+
+        # Raising rejects the put, the PV keeps its value
+        if ((result == BUSY_RESP) or (str(result).startswith('Error'))):
+            pmsg.error(func_id, f'{self._cmd} {data} returned "{result}"')
+            raise RuntimeError(f'{self._cmd} {data} returned "{result}"')
+        self.synced = True
+
+        return data
+
+class Pv_Server():
+    """
+    Channel Access server publishing the poller snapshots of the generators.
+    """
+
+    def __init__(self, prefix: str=None, interfaces: list=None):
+        """
+        Initializes the Pv_Server class.
+
+        Inputs:
+            prefix     (optional, str)  - Prefix of all PV names. Defaults to
+                                          PV_PREFIX in parameters.py
+            interfaces (optional, list) - IP addresses to serve on. Defaults
+                                          to all interfaces
+        """
+        if (not HAVE_CAPROTO):
+            raise ImportError('The PV server requires caproto')
+
+        if (prefix == None): prefix = PV_PREFIX
+
+        self._prefix     = prefix
+        self._interfaces = interfaces
+        self._pvdb       = {}
+        self._loop       = None
+        self._thread     = None
+
+        return
+
+    def add_generator(self, gen):
+        """
+        Creates the PVs of a generator and registers with its poller.
+
+        Inputs:
+            gen (Generator) - Generator with polling enabled (see gen_router.py)
+        """
+        polled = gen.poller.cmds()
+
+        readbacks = {}
+        for name, cmd in READBACKS.items():
+            if (cmd in polled):
+                chan = ChannelInteger(value=0)
+                self._pvdb[f'{self._prefix}{gen.name}:{name}'] = chan
+                readbacks[cmd] = chan
+
+        setpoints = {}
+        for name, (cmd, rb_cmd) in SETPOINTS.items():
+            chan = Setpoint_Channel(gen.cmd_table, cmd)
+            self._pvdb[f'{self._prefix}{gen.name}:{name}'] = chan
+            if (rb_cmd in polled):
+                setpoints[rb_cmd] = chan
+
+        gen.poller.add_listener(
+            lambda snapshot: self._update(snapshot, readbacks, setpoints))
+
+        return
+
+    def start(self):
+        """
+        Starts serving the PVs in a background thread.
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        return
+
+    def pv_names(self) -> list:
+        """
+        Returns the names of all PVs.
+        """
+        return list(self._pvdb.keys())
+
+    def _run(self):
+        """
+        Runs the event loop of the server.
+        """
+        func_id = f'{__name__}._run'
+        pmsg = Psi_Message()
+
+        pmsg.debug(func_id, f'Serving {len(self._pvdb)} PVs')
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+
+        return
+
+    async def _serve(self):
+        """
+        Serves the PVs. The context must be created in the event loop it runs
+        in.
+        """
+        ctx = Context(self._pvdb, self._interfaces)
+        await ctx.run()
+
+        return
+
+    def _update(self, snapshot: dict, readbacks: dict, setpoints: dict):
+        """
+        Poller listener. Hands the snapshot to the event loop of the server.
+        """
+        if (self._loop == None):
+            return
+
+        self._loop.call_soon_threadsafe(
+            lambda: self._loop.create_task(
+                        self._write(snapshot, readbacks, setpoints)))
+
+        return
+
+    async def _write(self, snapshot: dict, readbacks: dict, setpoints: dict):
+        """
+        Writes the values that changed, which posts monitor updates.
+        """
+        for cmd, (value, t_read) in snapshot.items():
+            if (not isinstance(value, int)):
+                continue
+
+            chan = readbacks.get(cmd)
+            if ((chan != None) and (chan.value != value)):
+                await chan.write(value, timestamp=t_read)
+
+            chan = setpoints.get(cmd)
+            if ((chan != None) and (not chan.synced)):
+                chan.synced = True
+                await chan.write(value, verify_value=False, timestamp=t_read)
+
+        return
@@ -0,0 +1,454 @@
+# Client library for the text protocol of the RF generator driver
+# (rf_gen_tcp_driver.py). A client keeps one connection to the driver open
+# and can pipeline requests, i.e. send several commands before the first
+# response has arrived. The driver executes the commands of a connection in
+# order, so responses are matched to requests in order.
+#
+#     with Rf_Gen_Client('127.0.0.1', 5000) as client:
+#         power = client.get_power()
+#         fwd, rfl = client.pipeline(['GETFWDPWR?', 'GETRFLPWR?'])
+#
+#     async with Async_Rf_Gen_Client('127.0.0.1', 5000) as client:
+#         power, state = await asyncio.gather(client.get_power(),
+#                                             client.get_state())
+#
+# Queries ('?') return the response of the driver. Writes ('$') have no
+# response, so a write returns as soon as it is sent, unless wait=True is
+# given, in which case it is followed by PING? and returns once the driver
+# has executed it, or raises if the driver rejected it (BUSY) or it failed.
+#
+# A response that does not arrive in time leaves the connection out of step
+# with the requests, so the blocking client then closes it and raises
+# ConnectionError for every later command. Create a new client to reconnect.
+#
+# There is a typed helper for every command of the lookup table in
+# cmd_lookup.py, see QUERIES and WRITES. When a client is created for one
+# generator of a multi-generator driver (gen="GEN2") every command is
+# prefixed with the name of the generator.
+
+import collections
+import socket
+import threading
+
+from admission import BUSY_RESP
+
+TERMINATOR = "\n" # Line terminator of requests and responses (see tcp_server.py)
+
+# Typed helpers. name: (command, type of the response)
+QUERIES = {"get_ip": ('IPADDR?', str),
+           "get_ipmode": ('IPMODE?', int),
+           "get_hostname": ('HOSTNAME?', str),
+           "get_power": ('GETPOWER?', int),
+           "get_state": ('GETSTATE?', int),
+           "get_ctrl_src": ('GETCTRLSRC?', int),
+           "get_fwd_pwr": ('GETFWDPWR?', int),
+           "get_rfl_pwr": ('GETRFLPWR?', int),
+           "get_match_mode": ('GETMATCHMODE?', int),
+           "get_load_cap": ('GETLDCAP?', int),
+           "get_tune_cap": ('GETTNCAP?', int),
+           "get_phase": ('GETPHASE?', int),
+           "get_queue_latency": ('GETQLATENCY?', str),
+           "get_queue_depth": ('GETQDEPTH?', str),
+           "get_macro_status": ('MACROSTAT?', str),
+           "get_macro_result": ('MACRORESULT?', str),
+           "ping": ('PING?', str)}
+
+# name: command. The helpers take the value to be written (required, i.e.
+# set_rf(1)) and wait=False.
+WRITES = {"set_power": 'SETPOWER$',
+          "set_rf": 'SETRF$',
+          "set_match_mode": 'SETMATCHMODE$',
+          "set_load_cap": 'SETLDCAP$',
+          "set_tune_cap": 'SETTNCAP$',
+          "macro": 'MACRO$',
+          "macro_abort": 'MACROABORT$'}
+
+class Rf_Gen_Error(Exception):
+    """
+    Raised when the driver answers a query with an error.
+    """
+    pass
+
+class Rf_Gen_Busy(Rf_Gen_Error):
+    """
+    Raised when the driver rejected a query because it is overloaded.
+    """
+    pass
+
+def _check(resp: str) -> str:
+    """
+    Raises an exception if a response is an error response.
+    """
+    if (resp == BUSY_RESP):
+        raise Rf_Gen_Busy(resp)
+
+    if (resp.startswith('Error')):
+        raise Rf_Gen_Error(resp)
+
+    return resp
+
+def _parse_metrics(resp: str) -> dict:
+    """
+    Parses the "key=value ..." response of METRICS? into a dict.
+    """
+    metrics = {}
+    for pair in resp.split():
+        key, value = pair.split('=', 1)
+        try:
+            metrics[key] = float(value) if ('.' in value) else int(value)
+        except ValueError:
+            metrics[key] = value
+
+    return metrics
+
+class Rf_Gen_Client():
+    """
+    Blocking client. Can be shared by several threads.
+    """
+
+    def __init__(self, server_ip: str, port: int, gen: str=None,
+                 timeout: float=10.0):
+        """
+        Initializes the Rf_Gen_Client class and connects to the driver.
+
+        Inputs:
+            server_ip (str)             - IP address of the driver, or the
+                                          path of a Unix domain socket if
+                                          port is None (see gen_daemon.py)
+            port      (int)             - Port of the driver
+            gen       (optional, str)   - Generator (or chord) name that is
+                                          prefixed to every command
+            timeout   (optional, float) - Time to wait for a response (seconds)
+        """
+        self._prefix = f'{gen}:' if (gen) else ''
+        self._lock   = threading.Lock()
+        self._buf    = b''
+        self._broken = None # Why the connection can no longer be used
+
+        if (port == None):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(timeout)
+            try:
+                self._sock.connect(server_ip)
+            except OSError:
+                self._sock.close()
+                raise
+        else:
+            self._sock = socket.create_connection((server_ip, int(port)),
+                                                  timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self._sock.close()
+
+        return
+
+    def query(self, cmd: str) -> str:
+        """
+        Sends a query and returns the response.
+
+        Inputs:
+            cmd (str) - Query, i.e. "GETPOWER?"
+        """
+        return self.pipeline([cmd])[0]
+
+    def write(self, cmd: str, value: str|int, wait: bool=False):
+        """
+        Sends a write command.
+
+        Inputs:
+            cmd   (str)            - Write command, i.e. "SETPOWER$"
+            value (str|int)        - Value to be written
+            wait  (optional, bool) - Wait until the driver executed the write
+        """
+        cmds = [f'{cmd} {value}']
+        if (wait): cmds.append('PING?')
+
+        resps = self.pipeline(cmds)
+        if (wait and isinstance(resps[-1], Rf_Gen_Error)):
+            raise resps[-1]
+
+        return
+
+    def pipeline(self, cmds: list) -> list:
+        """
+        Sends several commands at once, then reads all the responses.
+
+        Inputs:
+            cmds (list) - Commands (queries and writes with their value)
+
+        Returns:
+            list - Response of each query, None for each write. A query that
+                   failed is returned as the Rf_Gen_Error instance, so the
+                   responses of the other commands are not lost.
+        """
+        msg = ''.join(f'{self._prefix}{cmd}{TERMINATOR}' for cmd in cmds)
+
+        resps = []
+        with self._lock:
+            if (self._broken != None):
+                raise ConnectionError(f'Connection is broken: {self._broken}')
+
+            try:
+                self._sock.sendall(msg.encode("utf-8"))
+                for cmd in cmds:
+                    if (cmd.find('$') >= 0):
+                        resps.append(None)
+                        continue
+
+                    try:
+                        resps.append(_check(self._readline()))
+                    except Rf_Gen_Error as exc:
+                        resps.append(exc)
+            except OSError as exc:
+                # The responses still in flight would be taken as the answers
+                # to the next commands
+                self._broken = repr(exc)
+                self._sock.close()
+                raise ConnectionError(f'Connection to the driver lost: '
+                                      f'{exc!r}') from exc
+
+        if ((len(resps) == 1) and (isinstance(resps[0], Rf_Gen_Error))):
+            raise resps[0]
+
+        return resps
+
+    def _readline(self) -> str:
+        """
+        Reads one response. Must be called with the lock held.
+        """
+        term = TERMINATOR.encode("utf-8")
+        while (self._buf.find(term) < 0):
+            data = self._sock.recv(4096)
+            if (not data):
+                raise ConnectionError('Connection closed by the driver')
+            self._buf += data
+
+        line, self._buf = self._buf.split(term, 1)
+
+        return line.decode("utf-8").strip()
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the metrics of the driver (see METRICS? in cmd_lookup.py)
+        """
+        return _parse_metrics(self.query('METRICS?'))
+
+class Async_Rf_Gen_Client():
+    """
+    asyncio client. Queries issued concurrently by several tasks are pipelined
+    on the one connection.
+    """
+
+    def __init__(self, server_ip: str, port: int, gen: str=None):
+        """
+        Initializes the Async_Rf_Gen_Client class. Call connect (or use
+        "async with") before sending commands.
+
+        Inputs:
+            server_ip (str)           - IP address of the driver, or the path
+                                        of a Unix domain socket if port is
+                                        None (see gen_daemon.py)
+            port      (int)           - Port of the driver
+            gen       (optional, str) - Generator (or chord) name that is
+                                        prefixed to every command
+        """
+        self._server_ip = server_ip
+        self._port      = int(port) if (port != None) else None
+        self._prefix    = f'{gen}:' if (gen) else ''
+        self._pending   = collections.deque() # futures, in send order
+        self._reader    = None
+        self._writer    = None
+        self._task      = None
+
+        return
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+        return
+
+    async def connect(self):
+        """
+        Connects to the driver.
+        """
+        # asyncio is slow to import, so the blocking client does not import it.
+        # The caller of this client runs an event loop, so it is loaded already
+        import asyncio
+
+        if (self._port == None):
+            self._reader, self._writer = await asyncio.open_unix_connection(
+                                             self._server_ip)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(
+                                             self._server_ip, self._port)
+        self._task = asyncio.get_running_loop().create_task(self._receive())
+
+        return
+
+    async def close(self):
+        """
+        Closes the connection.
+        """
+        self._writer.close()
+        await self._writer.wait_closed()
+        await self._task
+
+        return
+
+    async def query(self, cmd: str) -> str:
+        """
+        Sends a query and returns the response.
+
+        Inputs:
+            cmd (str) - Query, i.e. "GETPOWER?"
+        """
+        future = self._send(cmd)
+
+        return _check(await future)
+
+    async def write(self, cmd: str, value: str|int, wait: bool=False):
+        """
+        Sends a write command.
+
+        Inputs:
+            cmd   (str)            - Write command, i.e. "SETPOWER$"
+            value (str|int)        - Value to be written
+            wait  (optional, bool) - Wait until the driver executed the write
+        """
+        self._send(f'{cmd} {value}')
+        if (wait):
+            await self.query('PING?')
+
+        return
+
+    async def pipeline(self, cmds: list) -> list:
+        """
+        Sends several commands at once, then waits for all the responses.
+
+        Inputs:
+            cmds (list) - Commands (queries and writes with their value)
+
+        Returns:
+            list - Response of each query (or the Rf_Gen_Error it raised), None
+                   for each write
+        """
+        futures = [self._send(cmd) for cmd in cmds]
+
+        resps = []
+        for future in futures:
+            if (future == None):
+                resps.append(None)
+                continue
+
+            try:
+                resps.append(_check(await future))
+            except Rf_Gen_Error as exc:
+                resps.append(exc)
+
+        return resps
+
+    def _send(self, cmd: str) -> 'asyncio.Future':
+        """
+        Sends a command without waiting.
+
+        Returns:
+            The future of the response, or None for a write
+        """
+        import asyncio
+
+        future = None
+        if (cmd.find('$') < 0):
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append(future)
+
+        self._writer.write(f'{self._prefix}{cmd}{TERMINATOR}'.encode("utf-8"))
+
+        return future
+
+    async def _receive(self):
+        """
+        Reads the responses and resolves the futures, in order.
+        """
+        import asyncio
+
+        while True:
+            try:
+                line = await self._reader.readline()
+            except (OSError, asyncio.IncompleteReadError):
+                line = b''
+
+            if (not line):
+                break
+
+            if (self._pending):
+                future = self._pending.popleft()
+                if (not future.done()):
+                    future.set_result(line.decode("utf-8").strip())
+
+        while (self._pending):
+            future = self._pending.popleft()
+            if (not future.done()):
+                future.set_exception(ConnectionError('Connection closed'))
+
+        return
+
+    async def get_metrics(self) -> dict:
+        """
+        Returns the metrics of the driver (see METRICS? in cmd_lookup.py)
+        """
+        return _parse_metrics(await self.query('METRICS?'))
+
+def _make_query(cmd: str, conv, is_async: bool):
+    """
+    Builds a typed query helper.
+    """
+    if (is_async):
+        async def helper(self):
+            return conv(await self.query(cmd))
+    else:
+        def helper(self):
+            return conv(self.query(cmd))
+
+    helper.__doc__ = f'Sends {cmd} and returns the response as {conv.__name__}'
+    helper.__annotations__ = {"return": conv}
+
+    return helper
+
+def _make_write(cmd: str, is_async: bool):
+    """
+    Builds a write helper.
+    """
+    if (is_async):
+        async def helper(self, value: str|int, wait: bool=False):
+            await self.write(cmd, value, wait)
+    else:
+        def helper(self, value: str|int, wait: bool=False):
+            self.write(cmd, value, wait)
+
+    helper.__doc__ = f'Sends {cmd} <value>'
+
+    return helper
+
+for _name, (_cmd, _conv) in QUERIES.items():
+    setattr(Rf_Gen_Client, _name, _make_query(_cmd, _conv, False))
+    setattr(Async_Rf_Gen_Client, _name, _make_query(_cmd, _conv, True))
+
+for _name, _cmd in WRITES.items():
+    setattr(Rf_Gen_Client, _name, _make_write(_cmd, False))
+    setattr(Async_Rf_Gen_Client, _name, _make_write(_cmd, True))
@@ -1,18 +1,28 @@
 
+# Every function takes the optional arguments "ipaddr" and "port", which select
+# the RF Generator that is talked to. If they are not given the generator at
+# DEFAULT_IP_ADDR/DEFAULT_TCP_PORT in parameters.py is used.
+
 import struct
+import tracing
 
 from modbus_client import Modbus_Client
 from parameters    import CMDS, MAX_POWER, MIN_POWER
 from psi_message   import Psi_Message
 
-def _read_param(param: str) -> str|int:
+def _read_param(param: str, ipaddr: str=None, port: int=None) -> str|int:
     """
     Reads a parameter value from the RF Generator
 
     Inputs:
-        param (str) - Name of parameter to be read. This will be the key to the
-                      CMD dict in the parameters.py file. Use the "list_params"
-                      function to get a list of the keys in the CMD dict
+        param  (str)           - Name of parameter to be read. This will be the
+                                 key to the CMD dict in the parameters.py file.
+                                 Use the "list_params" function to get a list of
+                                 the keys in the CMD dict
+        ipaddr (optional, str) - IP address of the RF Generator. Defaults to
+                                 DEFAULT_IP_ADDR
+        port   (optional, int) - Modbus port of the RF Generator. Defaults to
+                                 DEFAULT_TCP_PORT
     """
     func_id = f'{__name__}._read_param'
     pmsg = Psi_Message()
@@ -21,9 +31,10 @@ def _read_param(param: str) -> str|int:
         pmsg.error(func_id, f'No such command found ({param})')
         return None
 
-    mbc = Modbus_Client()
-    snd_cmd = mbc.build_mb_cmd(CMDS[param][0], 'r')
-    resp_data = mbc.send_cmd(snd_cmd, 'r')
+    with tracing.span('read_param'):
+        mbc = Modbus_Client(ipaddr, port)
+        snd_cmd = mbc.build_mb_cmd(CMDS[param][0], 'r')
+        resp_data = mbc.send_cmd(snd_cmd, 'r')
 
     if (CMDS[param][1] == "int"):
         ret_val = struct.unpack('>i', resp_data)
@@ -36,103 +47,220 @@ def _read_param(param: str) -> str|int:
 
     return ret_val
 
-def _set_param(param: str, value: int):
+def _set_param(param: str, value: int, ipaddr: str=None, port: int=None):
     """
     Sets the value of a parameter in the RF Generator
 
     Inputs:
-        param (str) - Name of parameter to be read. This will be the key to the
-                      CMD dict in the parameters.py file. Use the "list_params"
-                      function to get a list of the keys in the CMD dict
-        value (int) - Value to which the prameter will be set
+        param  (str)           - Name of parameter to be read. This will be the
+                                 key to the CMD dict in the parameters.py file.
+                                 Use the "list_params" function to get a list of
+                                 the keys in the CMD dict
+        value  (int)           - Value to which the prameter will be set
+        ipaddr (optional, str) - IP address of the RF Generator. Defaults to
+                                 DEFAULT_IP_ADDR
+        port   (optional, int) - Modbus port of the RF Generator. Defaults to
+                                 DEFAULT_TCP_PORT
+
+    Raises:
+        ConnectionError - The generator could not be reached
     """
-    mbc = Modbus_Client()
-    snd_cmd = mbc.build_mb_cmd(CMDS[param][0], 'w', value)
-    resp_data = mbc.send_cmd(snd_cmd, 'w')
+    with tracing.span('set_param'):
+        mbc = Modbus_Client(ipaddr, port)
+        snd_cmd = mbc.build_mb_cmd(CMDS[param][0], 'w', value)
+        resp_data = mbc.send_cmd(snd_cmd, 'w')
+
+    if (resp_data == -1):
+        raise ConnectionError('Cannot connect to the RF Generator')
 
     return
 
-def get_ip() -> str:
+def list_params() -> list:
+    """
+    Returns the names of the parameters that can be read or set (the keys of
+    CMDS in parameters.py)
+    """
+    return list(CMDS.keys())
+
+def read_raw(cmd_num: int, resp_type: str="int", ipaddr: str=None,
+             port: int=None) -> str|int|bytes:
+    """
+    Reads a command by its number, i.e. one that is not in CMDS
+
+    Inputs:
+        cmd_num   (int)           - Command number (see the Cito Plus manual)
+        resp_type (optional, str) - Type of the response, "int", "str" or
+                                    "bytes"
+        ipaddr    (optional, str) - IP address of the RF Generator
+        port      (optional, int) - Modbus port of the RF Generator
+
+    Returns:
+        The value, converted to resp_type
+
+    Raises:
+        ConnectionError - The generator could not be reached
+        ValueError      - The generator rejected the command
+    """
+    with tracing.span('read_param'):
+        mbc = Modbus_Client(ipaddr, port)
+        snd_cmd = mbc.build_mb_cmd(cmd_num, 'r')
+        resp_data = mbc.send_cmd(snd_cmd, 'r')
+
+    if (resp_data == -1):
+        raise ConnectionError('Cannot connect to the RF Generator')
+    if (resp_data == None):
+        raise ValueError(f'Command {cmd_num} was rejected by the RF Generator')
+
+    if (resp_type == "int"):
+        return struct.unpack('>i', resp_data)[0]
+
+    if (resp_type == "str"):
+        return resp_data.decode("utf-8")
+
+    return resp_data
+
+def write_raw(cmd_num: int, value: int, ipaddr: str=None, port: int=None):
+    """
+    Writes a command by its number, i.e. one that is not in CMDS
+
+    Inputs:
+        cmd_num (int)           - Command number (see the Cito Plus manual)
+        value   (int)           - Value to be written
+        ipaddr  (optional, str) - IP address of the RF Generator
+        port    (optional, int) - Modbus port of the RF Generator
+
+    Raises:
+        ConnectionError - The generator could not be reached
+    """
+    with tracing.span('set_param'):
+        mbc = Modbus_Client(ipaddr, port)
+        snd_cmd = mbc.build_mb_cmd(cmd_num, 'w', value)
+        resp_data = mbc.send_cmd(snd_cmd, 'w')
+
+    if (resp_data == -1):
+        raise ConnectionError('Cannot connect to the RF Generator')
+
+    return
+
+def read_params(params: list, ipaddr: str=None, port: int=None) -> list:
+    """
+    Reads several parameters in one pipelined Modbus exchange (see
+    Modbus_Client.read_many)
+
+    Inputs:
+        params (list)          - Names of the parameters (keys of CMDS)
+        ipaddr (optional, str) - IP address of the RF Generator
+        port   (optional, int) - Modbus port of the RF Generator
+
+    Returns:
+        list - Values of the parameters, in order. Integers are returned as
+               int, not as a tuple. None for a parameter the generator
+               rejected.
+
+    Raises:
+        ConnectionError - The generator could not be reached
+    """
+    with tracing.span('read_params'):
+        mbc = Modbus_Client(ipaddr, port)
+        resps = mbc.read_many([CMDS[param][0] for param in params])
+
+    if (resps == -1):
+        raise ConnectionError('Cannot connect to the RF Generator')
+
+    values = []
+    for param, resp_data in zip(params, resps):
+        if (resp_data == None):
+            values.append(None)
+        elif (CMDS[param][1] == "int"):
+            values.append(struct.unpack('>i', resp_data)[0])
+        elif (CMDS[param][1] == "str"):
+            values.append(resp_data.decode("utf-8"))
+        else:
+            values.append(resp_data)
+
+    return values
+
+def get_ip(ipaddr: str=None, port: int=None) -> str:
     """
     Gets the Current IP addres of the Modbus server
     """
     func_id = f'{__name__}.get_ip'
     pmsg = Psi_Message()
 
-    raw_ip = _read_param('get_ip')
+    raw_ip = _read_param('get_ip', ipaddr, port)
     ip_addr = f'{raw_ip[0]}.{raw_ip[1]}.{raw_ip[2]}.{raw_ip[3]}'
 
     return ip_addr
 
-def get_date() -> str:
+def get_date(ipaddr: str=None, port: int=None) -> str:
     """
     Retrieves the current date on the RF generator
     """
-    date_cur = _read_param('get_date')
+    date_cur = _read_param('get_date', ipaddr, port)
     return date_cur
 
-def get_domain() -> str:
+def get_domain(ipaddr: str=None, port: int=None) -> str:
     """
     Retrieves the domain name of the RF Generator
     """
-    domain_name = _read_param('domain_name')
+    domain_name = _read_param('domain_name', ipaddr, port)
     return domain_name
 
-def get_hostname() -> str:
+def get_hostname(ipaddr: str=None, port: int=None) -> str:
     """
     Retrieves the host name of the RF Generator
     """
-    host_name = _read_param('hostname')
+    host_name = _read_param('hostname', ipaddr, port)
     return host_name
 
-def get_power() -> int:
+def get_power(ipaddr: str=None, port: int=None) -> int:
     """
     Retrieves the current set point for the power in mili Watts
     """
-    power = _read_param('power_set_point')
+    power = _read_param('power_set_point', ipaddr, port)
     return power[0]
 
-def get_state() -> int:
-    state = _read_param('state')
+def get_state(ipaddr: str=None, port: int=None) -> int:
+    state = _read_param('state', ipaddr, port)
     return state[0]
 
-def get_control_source() -> int:
-    ctrl_src = _read_param('ctrl_src')
+def get_control_source(ipaddr: str=None, port: int=None) -> int:
+    ctrl_src = _read_param('ctrl_src', ipaddr, port)
     return ctrl_src[0]
 
-def get_forward_power() -> int:
-    fwd_pwr = _read_param('fwd_pwr')
+def get_forward_power(ipaddr: str=None, port: int=None) -> int:
+    fwd_pwr = _read_param('fwd_pwr', ipaddr, port)
     return fwd_pwr[0]
 
-def get_reflected_power() -> int:
-    rfl_pwr = _read_param('rfl_pwr')
+def get_reflected_power(ipaddr: str=None, port: int=None) -> int:
+    rfl_pwr = _read_param('rfl_pwr', ipaddr, port)
     return rfl_pwr[0]
 
-def get_match_mode() -> int:
-    match_mode = _read_param('match_mode')
+def get_match_mode(ipaddr: str=None, port: int=None) -> int:
+    match_mode = _read_param('match_mode', ipaddr, port)
     return match_mode[0]
 
-def get_load_cap() -> int:
+def get_load_cap(ipaddr: str=None, port: int=None) -> int:
     """
     Get load capacitor position. Returns an integer in the range 0 -> 1000. A
     value of 1000 corresponds to 100.0%
     """
-    lc_pos = _read_param('read_load_cap')
+    lc_pos = _read_param('read_load_cap', ipaddr, port)
     return lc_pos[0]
 
-def get_tune_cap() -> int:
+def get_tune_cap(ipaddr: str=None, port: int=None) -> int:
     """
     Get tune capacitor position. Returns an integer in the range 0 -> 1000. A
     value of 1000 corresponds to 100.0%
     """
-    tc_pos = _read_param('read_tune_cap')
+    tc_pos = _read_param('read_tune_cap', ipaddr, port)
     return tc_pos[0]
 
-def get_phase() -> int:
-    phase = _read_param('phase_shift')
+def get_phase(ipaddr: str=None, port: int=None) -> int:
+    phase = _read_param('phase_shift', ipaddr, port)
     return phase[0]
 
-def set_power(set_point: int):
+def set_power(set_point: int, ipaddr: str=None, port: int=None):
     """
     Sets the RF Generator's power set point
 
@@ -148,25 +276,25 @@ def set_power(set_point: int):
     if (set_point < MIN_POWER): power = MIN_POWER
     if (set_point > MAX_POWER): power = MAX_POWER
 
-    ret_val = _set_param('power_set_point', set_point)
+    ret_val = _set_param('power_set_point', set_point, ipaddr, port)
     pmsg.debug(func_id, f'set_point return value is {ret_val}')
     return
 
-def rf_on():
+def rf_on(ipaddr: str=None, port: int=None):
     """
     Turn Rf power on
     """
-    _set_param('rf', 1)
+    _set_param('rf', 1, ipaddr, port)
     return
 
-def rf_off():
+def rf_off(ipaddr: str=None, port: int=None):
     """
     Turn Rf power off
     """
-    _set_param('rf', 0)
+    _set_param('rf', 0, ipaddr, port)
     return
 
-def set_load_cap(cap_pos: int):
+def set_load_cap(cap_pos: int, ipaddr: str=None, port: int=None):
     """
     Sets the position of the load capacitor
 
@@ -174,10 +302,10 @@ def set_load_cap(cap_pos: int):
         cap_pos (int) - Position of the load capacitor. cap_pos = 1000 is 100.0%,
                         cap_pos = 0 is 0.0%
     """
-    _set_param('move_load_cap', cap_pos)
+    _set_param('move_load_cap', cap_pos, ipaddr, port)
     return
 
-def set_tune_cap(cap_pos: int):
+def set_tune_cap(cap_pos: int, ipaddr: str=None, port: int=None):
     """
     Sets the position of the tune capacitor
 
@@ -185,10 +313,10 @@ def set_tune_cap(cap_pos: int):
         cap_pos (int) - Position of the tune capacitor. cap_pos = 1000 is 100.0%,
                         cap_pos = 0 is 0.0%
     """
-    _set_param('move_tune_cap', cap_pos)
+    _set_param('move_tune_cap', cap_pos, ipaddr, port)
     return
 
-def set_match_mode(m_mode):
+def set_match_mode(m_mode, ipaddr: str=None, port: int=None):
     """
     Sets the match mode..
 
@@ -196,7 +324,7 @@ def set_match_mode(m_mode):
         m_mode (int) - Match mode. Set m_mode = 1 for manual, and m_mode = 2
                        for auto
     """
-    _set_param('match_mode', m_mode)
+    _set_param('match_mode', m_mode, ipaddr, port)
     return
 
 
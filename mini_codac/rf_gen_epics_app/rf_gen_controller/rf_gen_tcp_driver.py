@@ -1,6 +1,11 @@
 #!/usr/bin/env python3.11
 
-from tcp_server import tcp_server
+import profiling
+
+from gen_router      import parse_gen_args
+from parameters      import PV_PREFIX, TRACE_FILE
+from tcp_server      import tcp_server
+from telemetry_mcast import parse_mcast_arg
 
 import argparse
 
@@ -9,17 +14,96 @@ def main():
     ip_help  = '''Ip address of host'''
     prt_help = '''Port number upon which the server will be listening'''
     log_help = '''Use this option to create a debugging log file.'''
+    pol_help = '''Period (in seconds) at which the driver polls the generator
+                  in the background. Polling is disabled by default.'''
+    que_help = '''Maximum number of requests waiting for the generator.'''
+    cqu_help = '''Maximum number of requests queued for a single client.'''
+    ovl_help = '''What to do when a queue is full. "busy" rejects the new
+                  request with BUSY, "shed" drops the oldest queued read.'''
+    gen_help = '''Generator served by the driver, given as
+                  NAME=IP[:PORT][@CHORD]. Repeat the option to serve several
+                  generators, which are then addressed by prefixing a command
+                  with the name or chord (i.e. GEN2:GETPOWER?). Defaults to
+                  GENERATORS in parameters.py.'''
+    mca_help = '''Publish every polled snapshot on a multicast group, given as
+                  GROUP[:PORT] (defaults in parameters.py). Requires --POLL.
+                  See telemetry_mcast.py for a listener.'''
+    shm_help = '''Write every polled snapshot to a shared memory board per
+                  generator, for local readers. Requires --POLL. See
+                  telemetry_shm.py.'''
+    epc_help = f'''Serve the polled values as EPICS PVs (Channel Access, needs
+                   caproto), named PREFIX<GEN>:<NAME>. PREFIX defaults to
+                   {PV_PREFIX}. Requires --POLL. See pv_server.py.'''
+    trc_help = f'''Trace every request through the driver and append the
+                   traces to a file (default {TRACE_FILE}). Summarize them
+                   with tracing.py.'''
+
+    scn_help = '''Poll by scan class instead of every --POLL seconds: every
+                  class of POLL_CLASSES in parameters.py has its own period,
+                  and the reads that are due together are sent in one
+                  pipelined batch. Overruns are counted in METRICS?.'''
+
+    adp_help = '''Adaptive polling by scan class (implies --SCAN): slower
+                  while RF is off, faster during transients, within the
+                  bounds in parameters.py. GETPOLL? returns the current
+                  periods.'''
+
+    prf_help = '''Profile the driver: "cpu" (CPU time per command plus
+                  cProfile of a sample of the requests), "mem" (tracemalloc)
+                  or "all". The profile is written on SIGUSR1 and every
+                  --PROFILE_INTERVAL seconds. Can also be enabled with the
+                  RFGEN_PROFILE environment variable, see profiling.py.'''
+    pri_help = '''Interval (seconds) at which the profile is written'''
 
     parser = argparse.ArgumentParser(description = descript)
     parser.add_argument('IP', help = ip_help)
     parser.add_argument('PORT', help = prt_help)
     parser.add_argument('-l', '--LOG', help = log_help, action = 'store_true',
                         default = False)
+    parser.add_argument('-p', '--POLL', help = pol_help, type = float,
+                        default = None)
+    parser.add_argument('-q', '--QUEUE', help = que_help, type = int,
+                        default = None)
+    parser.add_argument('-c', '--CONN_QUEUE', help = cqu_help, type = int,
+                        default = None)
+    parser.add_argument('-o', '--POLICY', help = ovl_help,
+                        choices = ['busy', 'shed'], default = None)
+    parser.add_argument('-g', '--GEN', help = gen_help, action = 'append',
+                        default = None)
+    parser.add_argument('-m', '--MCAST', help = mca_help, nargs = '?',
+                        const = '', default = None)
+    parser.add_argument('-s', '--SHM', help = shm_help, action = 'store_true',
+                        default = False)
+    parser.add_argument('-e', '--EPICS', help = epc_help, nargs = '?',
+                        const = PV_PREFIX, default = None)
+    parser.add_argument('-t', '--TRACE', help = trc_help, nargs = '?',
+                        const = TRACE_FILE, default = None)
+    parser.add_argument('-S', '--SCAN', help = scn_help, action = 'store_true',
+                        default = False)
+    parser.add_argument('-A', '--ADAPT', help = adp_help,
+                        action = 'store_true', default = False)
+    parser.add_argument('-P', '--PROFILE', help = prf_help,
+                        choices = profiling.MODES, default = None)
+    parser.add_argument('-I', '--PROFILE_INTERVAL', help = pri_help,
+                        type = float, default = None)
 
     # Create list of keys to the args dictionary
     args = parser.parse_args().__dict__
 
-    tcp_server(args['IP'], args['PORT'], args['LOG'])
+    generators = None
+    if (args['GEN'] != None):
+        generators = parse_gen_args(args['GEN'])
+
+    profiling.start(args['PROFILE'], args['PROFILE_INTERVAL'])
+
+    mcast = None
+    if (args['MCAST'] != None):
+        mcast = parse_mcast_arg(args['MCAST'])
+
+    tcp_server(args['IP'], args['PORT'], args['LOG'], args['POLL'],
+               args['QUEUE'], args['CONN_QUEUE'], args['POLICY'], generators,
+               mcast, args['SHM'], args['EPICS'], args['TRACE'], args['SCAN'],
+               args['ADAPT'])
 
     return
 
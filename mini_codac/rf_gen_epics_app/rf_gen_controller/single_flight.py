@@ -0,0 +1,93 @@
+import threading
+import tracing
+
+class _Call():
+    """
+    A single in-flight call. Every caller that shares the key of this call
+    waits on "done" and then reads the result (or the exception).
+    """
+
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.exc    = None
+
+        return
+
+class Single_Flight():
+    """
+    Coalesces concurrent calls that share a key. The first caller (the leader)
+    executes the function, while every caller that arrives before the leader
+    has finished attaches to the outstanding call and receives its result. A
+    new call is only started once the previous one has completed, so results
+    are never older than the call that produced them.
+    """
+
+    def __init__(self):
+        """
+        Initializes the Single_Flight class.
+
+        Inputs:
+            None
+        """
+        self._lock  = threading.Lock()
+        self._calls = {}
+
+        self.num_calls  = 0 # Calls that executed the function
+        self.num_shared = 0 # Calls that attached to an outstanding call
+
+        return
+
+    def do(self, key, func, *args) -> str|int:
+        """
+        Executes func(*args), unless a call with the same key is already in
+        flight. In that case wait for it and return its result.
+
+        Inputs:
+            key  (hashable) - Identifies the call, i.e. (device, command)
+            func (callable) - Function that performs the call
+            args            - Arguments passed to func
+
+        Returns:
+            The return value of func. If func raised an exception, the same
+            exception is raised in every caller attached to the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = (call == None)
+            if (leader):
+                call = _Call()
+                self._calls[key] = call
+                self.num_calls += 1
+            else:
+                self.num_shared += 1
+
+        if (not leader):
+            with tracing.span('flight_wait'):
+                call.done.wait()
+            if (call.exc != None):
+                raise call.exc
+
+            return call.result
+
+        try:
+            call.result = func(*args)
+        except Exception as exc:
+            call.exc = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def in_flight(self) -> int:
+        """
+        Returns the number of calls currently in flight.
+
+        Inputs:
+            None
+        """
+        with self._lock:
+            return len(self._calls)
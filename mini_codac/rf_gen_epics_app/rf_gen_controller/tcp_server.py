@@ -1,68 +1,346 @@
 
+import select
 import socket
-import numpy as np
+import threading
+import profiling
+import time
+import tracing
 
-from cmd_lookup   import Cmd_Lookup
-from numpy.random import randint
-from psi_message  import Psi_Message
+from admission       import BUSY_RESP, Conn_Queue
+from dispatch_queue  import SAFETY
+from gen_router      import Gen_Router
+from parameters      import MAX_CONN_QUEUE, MAX_QUEUE_DEPTH, OVERLOAD_POLICY
+from psi_message     import DEBUG, ERROR, Psi_Message, configure
 
 CHUNK = 1024
 
-def tcp_server(host_ip: str, port: int, bug_level: bool=None):
+# Every response is terminated by TERMINATOR. Commands may be terminated by
+# it too, which is required when several commands are sent (pipelined)
+# without waiting for the responses. A command without it is executed once
+# the client has sent nothing more for LINE_TIMEOUT seconds, or has closed the
+# connection.
+TERMINATOR   = "\n"
+LINE_TIMEOUT = 0.5
+
+def tcp_server(host_ip: str, port: int, bug_level: bool=None,
+               poll_period: float=None, max_queue: int=None,
+               max_conn_queue: int=None, policy: str=None,
+               generators: dict=None, mcast: tuple=None, shm: bool=False,
+               pv_prefix: str=None, trace_file: str=None, scan: bool=False,
+               adaptive: bool=False, ready=None):
     """
     TCP server that takes in commands, and parses them using a lookup table. See
-    cmd_lookup.py for the lookup table.
+    cmd_lookup.py for the lookup table. Each client is served in its own
+    thread, and all clients share the lookup tables, so that identical reads
+    issued at the same time by several clients result in a single request to
+    the RF generator. One server can front several generators, see
+    gen_router.py for how commands are addressed to them.
 
     Inputs:
         host_ip   (str)      - IP address of the server
         port      (int)      - Port number upon which the server is listening
         bug_level (opt, int) - Logging level. Set to True for creating a debug
-                               log file. Otherwise a log file will only be
-                               written to if there is a critical error.
+                               log file (LOG_FILE in parameters.py).
+                               Otherwise only errors are logged.
+        poll_period (opt, float) - Period (seconds) of the background poller.
+                                   Polling is disabled if not given.
+        max_queue   (opt, int)   - Maximum number of requests waiting for the
+                                   generator. Defaults to MAX_QUEUE_DEPTH
+        max_conn_queue (opt, int) - Maximum number of lines queued for a single
+                                    client. Defaults to MAX_CONN_QUEUE
+        policy      (opt, str)   - Overload policy, "busy" or "shed". Defaults
+                                   to OVERLOAD_POLICY
+        generators  (opt, dict)  - Generators served by the driver. Defaults
+                                   to GENERATORS in parameters.py
+        mcast       (opt, tuple) - (group, port) on which the polled snapshots
+                                   are published, see telemetry_mcast.py.
+                                   Requires polling. Disabled if not given.
+        shm         (opt, bool)  - Write the polled snapshots to shared memory
+                                   boards, see telemetry_shm.py. Requires
+                                   polling.
+        pv_prefix   (opt, str)   - Serve the polled snapshots as PVs with this
+                                   prefix, see pv_server.py. Requires polling
+                                   and caproto. Disabled if not given.
+        trace_file  (opt, str)   - Trace every request and append the traces
+                                   to this file, see tracing.py. Disabled if
+                                   not given.
+        scan        (opt, bool)  - Poll by the scan classes of POLL_CLASSES
+                                   (see Scan_Poller in poller.py) instead of
+                                   every poll_period.
+        adaptive    (opt, bool)  - Adapt the periods of the scan classes to the
+                                   state of the generators (see Scan_Poller).
+                                   Implies scan.
+        ready       (opt, Event) - Set once the server listens and its shared
+                                   memory boards exist (see gen_supervisor.py)
     """
     func_id = f'{__name__}.tcp_server'
+
+    if (bug_level):
+        configure(DEBUG, True, console_level=ERROR)
+    else:
+        configure(ERROR)
     pmsg = Psi_Message()
 
-    cmd_table = Cmd_Lookup()
+    if (trace_file != None):
+        tracing.enable(trace_file)
+
+    if (max_queue == None): max_queue = MAX_QUEUE_DEPTH
+    if (max_conn_queue == None): max_conn_queue = MAX_CONN_QUEUE
+    if (policy == None): policy = OVERLOAD_POLICY
+    if (adaptive): scan = True
+
+    if (((mcast != None) or shm or (pv_prefix != None)) and
+        (poll_period == None) and (not scan)):
+        pmsg.error(func_id, 'Telemetry (multicast, shared memory, PVs) '
+                            'requires polling')
+
+    # The telemetry modules are only imported when used, caproto in particular
+    # takes long to import
+    publisher = None
+    if (mcast != None):
+        from telemetry_mcast import Mcast_Publisher
+        publisher = Mcast_Publisher(*mcast)
+
+    router = Gen_Router(generators, max_queue, policy, poll_period, publisher,
+                        shm, scan=scan, adaptive=adaptive)
+
+    if ((pv_prefix != None) and ((poll_period != None) or scan)):
+        from pv_server import HAVE_CAPROTO, Pv_Server
+        if (HAVE_CAPROTO):
+            pvs = Pv_Server(pv_prefix)
+            for gen in router.generators():
+                if (gen.poller != None):
+                    pvs.add_generator(gen)
+            pvs.start()
+        else:
+            pmsg.error(func_id, 'caproto is not installed, PVs are not served')
+
+    router.start()
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind((host_ip, int(port)))
         sock.listen()
 
-        while True:
-            conn, addr = sock.accept()
-            print(f'Connected to {addr[0]}, on port {addr[1]}')
+        if (ready != None):
+            ready.set()
+        serve(sock, router, max_conn_queue, policy)
+
+    return
+
+def serve(sock: socket.socket, router: Gen_Router, max_conn_queue: int=None,
+          policy: str=None):
+    """
+    Accepts clients on a listening socket and serves each one in its own
+    thread. Does not return. Used by tcp_server and by gen_daemon.py (Unix
+    domain socket).
+
+    Inputs:
+        sock      (socket)     - Listening socket
+        router    (Gen_Router) - Generators shared by all clients (started)
+        max_conn_queue (opt, int) - Maximum number of lines queued for a single
+                                    client. Defaults to MAX_CONN_QUEUE
+        policy    (opt, str)   - Overload policy, "busy" or "shed". Defaults
+                                 to OVERLOAD_POLICY
+    """
+    if (max_conn_queue == None): max_conn_queue = MAX_CONN_QUEUE
+    if (policy == None): policy = OVERLOAD_POLICY
+
+    while True:
+        conn, addr = sock.accept()
+        print(f'Connected to {_peer(addr)}')
+
+        client = threading.Thread(target=_serve_client,
+                                  args=(conn, addr, router, max_conn_queue,
+                                        policy),
+                                  daemon=True)
+        client.start()
 
-            with conn:
-                while True:
+    return
+
+def _peer(addr) -> str:
+    """
+    Returns the address of a client for the messages. Clients of a Unix domain
+    socket have no address.
+    """
+    if (isinstance(addr, tuple)):
+        return f'{addr[0]}, on port {addr[1]}'
+
+    return 'local client'
+
+def _serve_client(conn: socket.socket, addr: tuple, router: Gen_Router,
+                  max_conn_queue: int, policy: str):
+    """
+    Serves a single client connection until the client disconnects. This thread
+    reads the socket and queues the received lines, while a second thread
+    executes them, so that a client that sends requests faster than the
+    generator can answer them gets BUSY instead of an ever growing backlog.
+
+    Inputs:
+        conn      (socket)     - Socket connected to the client
+        addr      (tuple)      - Address of the client (ip, port), or the
+                                 address of a Unix domain socket client
+        router    (Gen_Router) - Generators shared by all clients
+        max_conn_queue (int)   - Maximum number of lines queued for the client
+        policy    (str)        - Overload policy ("busy" or "shed")
+    """
+    func_id = f'{__name__}._serve_client'
+    pmsg = Psi_Message()
+
+    cqueue = Conn_Queue(max_conn_queue, policy)
+    router.conns.add(cqueue)
+
+    executor = threading.Thread(target=_execute_lines,
+                                args=(conn, router, cqueue), daemon=True)
+    executor.start()
+
+    # Bytes received after the last terminator. They are only decoded once
+    # the line is complete, a chunk may end inside a multibyte character.
+    partial = b''
+    with conn:
+        closed = False
+        while (not closed):
+            # A command without a terminator is complete once the client
+            # stops sending (select, not a socket timeout, which would apply
+            # to the responses sent by the executor too)
+            if ((partial) and
+                (not select.select([conn], [], [], LINE_TIMEOUT)[0])):
+                raw_lines = [partial]
+                partial = b''
+            else:
+                try:
                     data = conn.recv(CHUNK)
-                    
-                    if not data:
-                        break
-                    
-                    cli_msg = data.decode("utf-8")
-                    cli_msg = cli_msg.strip()
-                    cli_msg_list = cli_msg.split("\n")
-
-                    idx = 0
-                    for line in cli_msg_list:
-                        if (line.find('$') >= 0):
-                            cmd_arg = line.split("$")[1].strip()
-                            try:
-                                cmd_arg = int(cmd_arg)
-                            except ValueError:
-                                cmd_arg = str(cmd_arg)
-
-                            cmd_table.cmd_lookup(cli_msg, args=cmd_arg)
-                            pmsg.debug(func_id, f'({idx}) client msg: {line}, args: {cmd_arg}')
-
-                        else:
-                            snd_data = str(cmd_table.cmd_lookup(line))
-
-                            pmsg.debug(func_id, f'({idx}) client msg: {line}, server resp: {snd_data}')
-                            conn.sendall(snd_data.encode("utf-8"))
-
-                        idx += 1
+                except OSError:
+                    data = b''
+
+                if (not data):
+                    closed = True
+                raw_lines = (partial + data).split(TERMINATOR.encode("utf-8"))
+                partial = raw_lines.pop()
+                if (closed):
+                    raw_lines.append(partial)
+
+            for raw_line in raw_lines:
+                line = raw_line.decode("utf-8", "replace").strip()
+                if (len(line) == 0):
+                    continue
+
+                force = False
+                gen, cmd = router.route(line)
+                if ((gen != None) and (cmd.find('$') >= 0)):
+                    force = (gen.cmd_table.cmd_priority(cmd[:cmd.find('$')+1],
+                                                        cmd.split("$")[1]) == SAFETY)
+
+                if (not cqueue.put(line, force)):
+                    pmsg.error(func_id, f'Client queue full, rejected: {line}')
+
+        cqueue.close()
+        executor.join()
+
+    router.conns.remove(cqueue)
+    print(f'Disconnected from {_peer(addr)}')
+
+    return
+
+def _execute_lines(conn: socket.socket, router: Gen_Router,
+                   cqueue: Conn_Queue):
+    """
+    Executes the lines queued for a client, in order, and sends the responses
+    back to the client.
+
+    Inputs:
+        conn      (socket)     - Socket connected to the client
+        router    (Gen_Router) - Generators shared by all clients
+        cqueue    (Conn_Queue) - Queue of the lines received from the client
+    """
+    func_id = f'{__name__}._execute_lines'
+    pmsg = Psi_Message()
+
+    idx = 0
+    while True:
+        item = cqueue.get()
+        if (item == None):
+            break
+
+        line, rejected, t_queued = item
+        trace = tracing.begin(line, t_queued)
+        tracing.add_span('conn_queue', t_queued)
+
+        t_start = time.monotonic()
+        gen, cmd = router.route(line)
+
+        # Key of the metrics and the profile of the request
+        key = cmd[:cmd.find('$')+1] if (cmd.find('$') >= 0) else cmd
+        if (rejected):
+            key = BUSY_RESP
+        elif ((gen == None) or (not gen.cmd_table.has_cmd(key))):
+            key = 'INVALID'
+
+        with profiling.request(key):
+            try:
+                if (rejected):
+                    # A rejected PING? also reports the writes before it
+                    if ((gen != None) and (cmd == 'PING?')):
+                        cqueue.take_write_error()
+                    conn.sendall(f'{BUSY_RESP}{TERMINATOR}'.encode("utf-8"))
+
+                elif (gen == None):
+                    pmsg.error(func_id, f'({idx}) unknown generator: {line}')
+                    snd_data = f'Error: "{line}" unknown generator'
+                    if (line.find('$') < 0):
+                        conn.sendall(f'{snd_data}{TERMINATOR}'.encode("utf-8"))
+                    else:
+                        cqueue.set_write_error(snd_data)
+
+                elif (cmd.find('$') >= 0):
+                    cmd_arg = cmd.split("$")[1].strip()
+                    try:
+                        cmd_arg = int(cmd_arg)
+                    except ValueError:
+                        cmd_arg = str(cmd_arg)
+
+                    with tracing.span('cmd_lookup'):
+                        result = gen.cmd_table.cmd_lookup(cmd, args=cmd_arg)
+                    pmsg.debug(func_id, '(%d) client msg: %s, args: %s', idx, line,
+                               cmd_arg)
+
+                    # Writes have no response, the next PING? reports it
+                    if ((result == BUSY_RESP) or
+                        (str(result).startswith('Error'))):
+                        cqueue.set_write_error(str(result))
+
+                else:
+                    with tracing.span('cmd_lookup'):
+                        snd_data = str(gen.cmd_table.cmd_lookup(cmd))
+
+                    # PING? confirms the writes sent before it
+                    if (cmd == 'PING?'):
+                        error = cqueue.take_write_error()
+                        if (error != None): snd_data = error
+
+                    pmsg.debug(func_id, '(%d) client msg: %s, server resp: %s', idx,
+                               line, snd_data)
+                    with tracing.span('send'):
+                        conn.sendall(f'{snd_data}{TERMINATOR}'.encode("utf-8"))
+            except Exception as exc:
+                # i.e. the generator could not be reached (ConnectionError is
+                # an OSError too), the request was preempted or the client is
+                # gone. The executor must survive, or the client would never
+                # get another answer.
+                pmsg.error(func_id, f'({idx}) {line} failed: {exc!r}')
+                snd_data = f'Error: "{line}" failed'
+                if (cmd.find('$') >= 0):
+                    cqueue.set_write_error(snd_data)
+                else:
+                    try:
+                        conn.sendall(f'{snd_data}{TERMINATOR}'.encode("utf-8"))
+                    except OSError:
+                        pass
+
+        router.metrics.record(key, time.monotonic() - t_start)
+        tracing.end(trace)
+
+        idx += 1
 
     return
 
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+# UDP multicast telemetry. The driver can publish every snapshot of its
+# background poller (see poller.py) as one datagram on a multicast group, so
+# any number of listeners (GUI, archiver, sequencers) get the telemetry without
+# a single extra request to the driver or the generator.
+#
+# Datagram layout (network byte order):
+#     HEADER  magic b'RFGT', version, generator name (8 bytes, NUL padded),
+#             sequence number, time of the snapshot (time.time()), valid mask
+#     VALUES  one int32 per command of POLL_CMDS, in that order
+# Bit i of the valid mask is set if VALUES[i] holds a polled value. The
+# sequence number is counted per generator, so a listener can detect lost
+# datagrams.
+
+import argparse
+import socket
+import struct
+import time
+
+from parameters  import MCAST_GROUP, MCAST_PORT, MCAST_TTL, POLL_CMDS
+from psi_message import Psi_Message
+
+MAGIC   = b'RFGT'
+VERSION = 1
+HEADER  = struct.Struct('>4sBx8sIdH')
+VALUES  = struct.Struct(f'>{len(POLL_CMDS)}i')
+
+class Mcast_Publisher():
+    """
+    Publishes poller snapshots on a multicast group.
+    """
+
+    def __init__(self, group: str=None, port: int=None, ttl: int=None,
+                 iface: str=None):
+        """
+        Initializes the Mcast_Publisher class.
+
+        Inputs:
+            group (optional, str) - Multicast group. Defaults to MCAST_GROUP
+            port  (optional, int) - UDP port. Defaults to MCAST_PORT
+            ttl   (optional, int) - Multicast TTL. Defaults to MCAST_TTL
+            iface (optional, str) - IP address of the interface to send on
+        """
+        if (group == None): group = MCAST_GROUP
+        if (port == None): port = MCAST_PORT
+        if (ttl == None): ttl = MCAST_TTL
+
+        self._addr = (group, int(port))
+        self._seq  = {} # generator name -> sequence number of the last datagram
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                   socket.IPPROTO_UDP)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        if (iface != None):
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                  socket.inet_aton(iface))
+
+        self.num_sent = 0
+
+        return
+
+    def listener(self, gen_name: str):
+        """
+        Returns a function that publishes the snapshots of one generator, to be
+        registered with Poller.add_listener.
+
+        Inputs:
+            gen_name (str) - Name of the generator
+        """
+        return lambda snapshot: self.publish(gen_name, snapshot)
+
+    def publish(self, gen_name: str, snapshot: dict):
+        """
+        Sends one snapshot.
+
+        Inputs:
+            gen_name (str)  - Name of the generator
+            snapshot (dict) - {cmd: (value, time of the read)}, see Poller
+        """
+        func_id = f'{__name__}.publish'
+        pmsg = Psi_Message()
+
+        seq = (self._seq.get(gen_name, 0) + 1) & 0xFFFFFFFF
+        self._seq[gen_name] = seq
+
+        try:
+            datagram = pack_snapshot(gen_name, seq, snapshot)
+            self._sock.sendto(datagram, self._addr)
+            self.num_sent += 1
+        except (OSError, struct.error) as exc:
+            pmsg.error(func_id, f'Failed to publish {gen_name} #{seq}: {exc}')
+
+        return
+
+    def close(self):
+        """
+        Closes the socket.
+        """
+        self._sock.close()
+
+        return
+
+class Mcast_Listener():
+    """
+    Receives the telemetry published by Mcast_Publisher.
+    """
+
+    def __init__(self, group: str=None, port: int=None, iface: str=None):
+        """
+        Initializes the Mcast_Listener class and joins the multicast group.
+
+        Inputs:
+            group (optional, str) - Multicast group. Defaults to MCAST_GROUP
+            port  (optional, int) - UDP port. Defaults to MCAST_PORT
+            iface (optional, str) - IP address of the interface to listen on
+        """
+        if (group == None): group = MCAST_GROUP
+        if (port == None): port = MCAST_PORT
+        if (iface == None): iface = '0.0.0.0'
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                   socket.IPPROTO_UDP)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('', int(port)))
+
+        mreq = socket.inet_aton(group) + socket.inet_aton(iface)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+
+        self._seq = {} # generator name -> last sequence number received
+        self.num_lost = 0
+
+        return
+
+    def recv(self, timeout: float=None) -> dict:
+        """
+        Waits for the next datagram.
+
+        Inputs:
+            timeout (optional, float) - Time to wait (seconds). Waits forever
+                                        if not given.
+
+        Returns:
+            dict - See unpack_snapshot, plus "lost", the number of datagrams
+                   of this generator that were missed. None on timeout.
+        """
+        self._sock.settimeout(timeout)
+        while True:
+            try:
+                datagram = self._sock.recv(65536)
+            except socket.timeout:
+                return None
+
+            telem = unpack_snapshot(datagram)
+            if (telem != None):
+                break
+
+        last = self._seq.get(telem["gen"])
+        telem["lost"] = 0
+        if (last != None):
+            telem["lost"] = max(((telem["seq"] - last) & 0xFFFFFFFF) - 1, 0)
+        self._seq[telem["gen"]] = telem["seq"]
+        self.num_lost += telem["lost"]
+
+        return telem
+
+    def close(self):
+        """
+        Closes the socket.
+        """
+        self._sock.close()
+
+        return
+
+def pack_snapshot(gen_name: str, seq: int, snapshot: dict) -> bytes:
+    """
+    Builds the datagram of a snapshot.
+
+    Inputs:
+        gen_name (str)  - Name of the generator (at most 8 characters are sent)
+        seq      (int)  - Sequence number
+        snapshot (dict) - {cmd: (value, time of the read)}, see Poller
+
+    Returns:
+        bytes - The datagram
+    """
+    mask   = 0
+    values = [0]*len(POLL_CMDS)
+    t_snap = 0.0
+    for idx, cmd in enumerate(POLL_CMDS):
+        if (cmd not in snapshot):
+            continue
+
+        value, t_read = snapshot[cmd]
+        if (not isinstance(value, int)):
+            continue
+
+        values[idx] = value
+        mask |= (1 << idx)
+        t_snap = max(t_snap, t_read)
+
+    if (t_snap == 0.0): t_snap = time.time()
+
+    header = HEADER.pack(MAGIC, VERSION, gen_name.encode("utf-8")[:8], seq,
+                         t_snap, mask)
+
+    return header + VALUES.pack(*values)
+
+def unpack_snapshot(datagram: bytes) -> dict:
+    """
+    Decodes a datagram built by pack_snapshot.
+
+    Inputs:
+        datagram (bytes) - Received datagram
+
+    Returns:
+        dict - {"gen": name, "seq": sequence number, "time": time of the
+               snapshot, "values": {cmd: value}}, only polled values are
+               included. None if the datagram is not valid telemetry.
+    """
+    if (len(datagram) != HEADER.size + VALUES.size):
+        return None
+
+    magic, version, name, seq, t_snap, mask = HEADER.unpack_from(datagram)
+    if ((magic != MAGIC) or (version != VERSION)):
+        return None
+
+    raw = VALUES.unpack_from(datagram, HEADER.size)
+    values = {cmd: raw[idx] for idx, cmd in enumerate(POLL_CMDS)
+              if (mask & (1 << idx))}
+
+    return {"gen": name.rstrip(b'\0').decode("utf-8"), "seq": seq,
+            "time": t_snap, "values": values}
+
+def parse_mcast_arg(arg: str) -> tuple:
+    """
+    Parses a multicast address given on the command line.
+
+    Inputs:
+        arg (str) - "GROUP[:PORT]", or "" for the defaults
+
+    Returns:
+        (group, port)
+    """
+    group, port = MCAST_GROUP, MCAST_PORT
+    if (arg):
+        if (arg.find(':') >= 0):
+            arg, port = arg.split(':', 1)
+        if (arg): group = arg
+
+    return (group, int(port))
+
+def main():
+    descript = '''Prints the telemetry published by the RF generator driver'''
+    grp_help = f'''Multicast group and port as GROUP[:PORT]. Defaults to
+                   {MCAST_GROUP}:{MCAST_PORT}'''
+    ifc_help = '''IP address of the interface to listen on'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('GROUP', help = grp_help, nargs = '?', default = '')
+    parser.add_argument('-i', '--iface', help = ifc_help, default = None)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    group, port = parse_mcast_arg(args['GROUP'])
+    listener = Mcast_Listener(group, port, args['iface'])
+
+    try:
+        while True:
+            telem = listener.recv()
+            values = ' '.join(f'{cmd}={value}'
+                              for cmd, value in telem["values"].items())
+            t_snap = time.strftime('%H:%M:%S', time.localtime(telem["time"]))
+            print(f'{t_snap} {telem["gen"]} #{telem["seq"]} '
+                  f'(lost {telem["lost"]}) {values}')
+    except KeyboardInterrupt:
+        pass
+
+    listener.close()
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+# Shared memory latest-value boards. Processes on the same host as the driver
+# (GUI, loggers, interlocks) can map a board and read the latest telemetry
+# without a request to the driver, a socket or a copy.
+#
+# There is one board per generator, named "rfgen_<GEN>", which the driver
+# writes from its background poller with the CMDS reads of that generator, and
+# one environment board, "rfgen_env", for the Fyra pressures (VAC1, VAC2) and
+# the thermocouples (TC1..TC4), written by the GUI that reads them
+# (CombinedGuiDualGen_kyles_rf_gen.py). A pressure out of range is -1.
+#
+# Board layout (native byte order):
+#     uint64   version counter
+#     float64  time of the last update (time.time())
+#     uint64   valid mask, bit i is set once field i has been written
+#     fields   int64 (generator boards) or float64 (environment board) values
+#
+# Each board has a single writer, which uses the version counter as a seqlock:
+# it makes the counter odd, writes the values, then makes it even again. A
+# reader reads the counter, the values and the counter again, and retries if
+# the counter was odd or has changed in between, so it never sees a half
+# written snapshot.
+
+import argparse
+import struct
+import time
+
+from multiprocessing import resource_tracker, shared_memory
+
+from psi_message import Psi_Message
+
+# CMDS read by the driver into a generator board. CMDS key -> lookup command.
+# The string parameters (IP address, date, host and domain name) do not change
+# while the driver runs and are not on the board.
+GEN_FIELDS = {"ctrl_src": 'GETCTRLSRC?', "power_set_point": 'GETPOWER?',
+              "state": 'GETSTATE?', "fwd_pwr": 'GETFWDPWR?',
+              "rfl_pwr": 'GETRFLPWR?', "read_load_cap": 'GETLDCAP?',
+              "read_tune_cap": 'GETTNCAP?', "match_mode": 'GETMATCHMODE?',
+              "phase_shift": 'GETPHASE?'}
+
+ENV_FIELDS = ['VAC1', 'VAC2', 'TC1', 'TC2', 'TC3', 'TC4']
+
+ENV_BOARD = 'rfgen_env'
+
+VERSION = struct.Struct('Q')
+HEADER  = struct.Struct('QdQ') # version counter, time, valid mask
+
+class Shm_Board():
+    """
+    A latest-value board in shared memory.
+    """
+
+    def __init__(self, name: str, fields: list, fmt: str='q',
+                 create: bool=False):
+        """
+        Initializes the Shm_Board class, creating the board or attaching to it.
+
+        Inputs:
+            name   (str)            - Name of the shared memory block
+            fields (list)           - Names of the fields, in board order
+            fmt    (optional, str)  - struct format of a field, "q" or "d"
+            create (optional, bool) - Create the board (the writer), otherwise
+                                      attach to an existing one (a reader)
+        """
+        self.name   = name
+        self.fields = list(fields)
+        self._data  = struct.Struct(f'{len(self.fields)}{fmt}')
+        size = HEADER.size + self._data.size
+
+        if (create):
+            try:
+                self._shm = shared_memory.SharedMemory(name, True, size)
+            except FileExistsError:
+                # Left over by a writer that did not exit cleanly
+                stale = shared_memory.SharedMemory(name)
+                stale.close()
+                stale.unlink()
+                self._shm = shared_memory.SharedMemory(name, True, size)
+            HEADER.pack_into(self._shm.buf, 0, 0, 0.0, 0)
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            # A reader must not remove the board when it exits
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+        self._owner  = create
+        self._values = [0]*len(self.fields)
+        self._mask   = 0
+
+        return
+
+    def write(self, values: dict, t_update: float=None):
+        """
+        Updates fields of the board. Fields that are not given keep their
+        value. Must only be called by the writer.
+
+        Inputs:
+            values   (dict)            - {field: value}, unknown fields are
+                                         ignored
+            t_update (optional, float) - Time of the values. Defaults to now
+        """
+        for idx, field in enumerate(self.fields):
+            if (field in values):
+                self._values[idx] = values[field]
+                self._mask |= (1 << idx)
+
+        if (t_update == None): t_update = time.time()
+
+        buf = self._shm.buf
+        version = VERSION.unpack_from(buf, 0)[0]
+        HEADER.pack_into(buf, 0, version + 1, t_update, self._mask)
+        self._data.pack_into(buf, HEADER.size, *self._values)
+        VERSION.pack_into(buf, 0, version + 2)
+
+        return
+
+    def read(self, max_tries: int=1000) -> dict:
+        """
+        Reads a consistent snapshot of the board.
+
+        Inputs:
+            max_tries (optional, int) - Attempts before giving up while the
+                                        writer is busy
+
+        Returns:
+            dict - {"version": counter, "time": time of the update,
+                   "values": {field: value}}, only fields that have been
+                   written are included. None if no consistent snapshot was
+                   read.
+        """
+        buf = self._shm.buf
+        for itry in range(max_tries):
+            version, t_update, mask = HEADER.unpack_from(buf, 0)
+            if (version & 1):
+                continue
+
+            raw = self._data.unpack_from(buf, HEADER.size)
+            if (VERSION.unpack_from(buf, 0)[0] != version):
+                continue
+
+            values = {field: raw[idx] for idx, field in enumerate(self.fields)
+                      if (mask & (1 << idx))}
+
+            return {"version": version, "time": t_update, "values": values}
+
+        return None
+
+    def close(self):
+        """
+        Detaches from the board. The writer also removes it.
+        """
+        self._shm.close()
+        if (self._owner):
+            self._shm.unlink()
+
+        return
+
+def gen_board_name(gen_name: str) -> str:
+    """
+    Returns the name of the board of a generator.
+    """
+    return f'rfgen_{gen_name}'
+
+def gen_board(gen_name: str, create: bool=False) -> Shm_Board:
+    """
+    Creates, or attaches to, the board of a generator.
+
+    Inputs:
+        gen_name (str)            - Name of the generator (see GENERATORS)
+        create   (optional, bool) - Create the board (the driver)
+    """
+    return Shm_Board(gen_board_name(gen_name), GEN_FIELDS.keys(), 'q', create)
+
+def remove_gen_board(gen_name: str):
+    """
+    Removes the board of a generator whose writer was stopped without closing
+    it (see gen_supervisor.py). Does nothing if there is no board.
+
+    Inputs:
+        gen_name (str) - Name of the generator (see GENERATORS)
+    """
+    try:
+        shm = shared_memory.SharedMemory(gen_board_name(gen_name))
+    except FileNotFoundError:
+        return
+
+    shm.close()
+    shm.unlink()
+
+    return
+
+def env_board(create: bool=False) -> Shm_Board:
+    """
+    Creates, or attaches to, the environment board (pressures, temperatures).
+
+    Inputs:
+        create (optional, bool) - Create the board (the process reading the
+                                  Fyra controller and thermocouples)
+    """
+    return Shm_Board(ENV_BOARD, ENV_FIELDS, 'd', create)
+
+def snapshot_writer(board: Shm_Board):
+    """
+    Returns a function that writes poller snapshots to a generator board, to be
+    registered with Poller.add_listener.
+
+    Inputs:
+        board (Shm_Board) - Board created with gen_board(name, True)
+    """
+    func_id = f'{__name__}.snapshot_writer'
+    pmsg = Psi_Message()
+
+    def write(snapshot: dict):
+        values = {}
+        t_update = 0.0
+        for field, cmd in GEN_FIELDS.items():
+            if ((cmd in snapshot) and (isinstance(snapshot[cmd][0], int))):
+                values[field] = snapshot[cmd][0]
+                t_update = max(t_update, snapshot[cmd][1])
+
+        if (values):
+            try:
+                board.write(values, t_update)
+            except struct.error as exc:
+                pmsg.error(func_id, f'Failed to write {board.name}: {exc}')
+
+        return
+
+    return write
+
+def main():
+    descript = '''Prints the telemetry boards of the RF generator driver'''
+    gen_help = '''Generator names (see GENERATORS in parameters.py)'''
+    env_help = '''Also print the environment board (pressures and
+                  temperatures)'''
+    per_help = '''Print period in seconds'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('GEN', help = gen_help, nargs = '*', default = [])
+    parser.add_argument('-e', '--env', help = env_help, action = 'store_true',
+                        default = False)
+    parser.add_argument('-p', '--period', help = per_help, type = float,
+                        default = 1.0)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    boards = [gen_board(name) for name in args['GEN']]
+    if (args['env']):
+        boards.append(env_board())
+
+    try:
+        while True:
+            for board in boards:
+                snap = board.read()
+                if (snap == None):
+                    continue
+
+                values = ' '.join(f'{field}={value}'
+                                  for field, value in snap["values"].items())
+                print(f'{board.name} v{snap["version"]} {values}')
+            time.sleep(args['period'])
+    except KeyboardInterrupt:
+        pass
+
+    for board in boards:
+        board.close()
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()
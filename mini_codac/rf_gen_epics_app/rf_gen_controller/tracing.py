@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+# Span tracing of client requests through the driver. When tracing is enabled
+# every line received from a client gets a trace with a unique ID, and each
+# stage the request passes through records a span (name, start, duration):
+#
+#     conn_queue     waiting in the queue of the client connection (tcp_server)
+#     cmd_lookup     Cmd_Lookup.cmd_lookup, contains the stages below
+#       flight_wait  waiting for an identical read already in flight
+#       dispatch_wait waiting in the dispatch queue for the generator
+#       read_param / set_param   rf_gen_controller, contains the stages below
+#         mb_acquire getting a pooled Modbus connection (connects if needed)
+#         mb_io      sending the Modbus command and receiving the response
+#     send           sending the response to the client
+#
+# Spans are timed from the start of the trace, so nested stages overlap their
+# parent. A finished trace is written as one JSON line by a background thread:
+#
+#     {"id": 12, "cmd": "GETRFLPWR?", "t": <time.time() at the start>,
+#      "total": <us>, "spans": [[name, start us, duration us], ...]}
+#
+# Run this file on a trace file to see where the latency goes.
+#
+# The current trace is kept per thread. Work handed to another thread (the
+# dispatch queue workers) carries the trace along, see attach().
+
+import collections
+import itertools
+import json
+import queue
+import random
+import threading
+import time
+
+from metrics     import percentile
+from psi_message import Psi_Message
+
+_local   = threading.local()
+_ids     = itertools.count(1)
+_enabled = False
+_sample  = 1.0
+_queue   = queue.SimpleQueue()
+_writer  = None
+
+class Trace():
+    """
+    The spans of one client request.
+    """
+
+    def __init__(self, cmd: str, t_start: float=None):
+        """
+        Initializes the Trace class.
+
+        Inputs:
+            cmd     (str)             - Command (line) that is traced
+            t_start (optional, float) - time.monotonic() at which the request
+                                        arrived. Defaults to now
+        """
+        if (t_start == None): t_start = time.monotonic()
+
+        self.id      = next(_ids)
+        self.cmd     = cmd
+        self.t_start = t_start
+        self.t_wall  = time.time() - (time.monotonic() - t_start)
+        self.spans   = []
+
+        return
+
+    def add(self, name: str, t_start: float, t_end: float):
+        """
+        Records a span.
+
+        Inputs:
+            name    (str)   - Name of the stage
+            t_start (float) - time.monotonic() at the start of the stage
+            t_end   (float) - time.monotonic() at the end of the stage
+        """
+        self.spans.append((name, t_start, t_end))
+
+        return
+
+    def record(self, t_end: float) -> str:
+        """
+        Returns the trace as a JSON line.
+        """
+        spans = [[name, round((t0 - self.t_start)*1e6), round((t1 - t0)*1e6)]
+                 for name, t0, t1 in self.spans]
+
+        return json.dumps({"id": self.id, "cmd": self.cmd,
+                           "t": round(self.t_wall, 6),
+                           "total": round((t_end - self.t_start)*1e6),
+                           "spans": spans}, separators=(',', ':'))
+
+class _Span():
+    """
+    Context manager that records a span of the current trace.
+    """
+
+    def __init__(self, trace: Trace, name: str):
+        self._trace = trace
+        self._name  = name
+
+        return
+
+    def __enter__(self):
+        self._t_start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._trace.add(self._name, self._t_start, time.monotonic())
+        return False
+
+class _Null_Span():
+    """
+    Context manager that does nothing, used when there is no current trace.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _Null_Span()
+
+def enable(path: str, sample: float=1.0):
+    """
+    Enables tracing.
+
+    Inputs:
+        path   (str)             - File the traces are appended to
+        sample (optional, float) - Fraction of the requests that are traced
+    """
+    global _enabled, _sample, _writer
+
+    _sample = sample
+    if (_writer == None):
+        _writer = threading.Thread(target=_write, args=(path,), daemon=True)
+        _writer.start()
+    _enabled = True
+
+    return
+
+def disable():
+    """
+    Disables tracing. Requests that are being traced are still written.
+    """
+    global _enabled
+
+    _enabled = False
+
+    return
+
+def begin(cmd: str, t_start: float=None) -> Trace:
+    """
+    Starts the trace of a request in the current thread.
+
+    Inputs:
+        cmd     (str)             - Command (line) that is traced
+        t_start (optional, float) - time.monotonic() at which it arrived
+
+    Returns:
+        The trace, or None if tracing is disabled (or the request is not
+        sampled)
+    """
+    if ((not _enabled) or ((_sample < 1.0) and (random.random() >= _sample))):
+        _local.trace = None
+        return None
+
+    trace = Trace(cmd, t_start)
+    _local.trace = trace
+
+    return trace
+
+def end(trace: Trace):
+    """
+    Finishes a trace started by begin and queues it for writing.
+
+    Inputs:
+        trace (Trace) - Trace returned by begin (None is ignored)
+    """
+    _local.trace = None
+    if (trace != None):
+        _queue.put(trace.record(time.monotonic()))
+
+    return
+
+def current() -> Trace:
+    """
+    Returns the trace of the current thread, or None.
+    """
+    return getattr(_local, 'trace', None)
+
+def attach(trace: Trace) -> Trace:
+    """
+    Makes a trace the current trace of this thread, i.e. in a worker thread
+    that executes work for the traced request.
+
+    Inputs:
+        trace (Trace) - Trace (or None)
+
+    Returns:
+        The previous trace of this thread, to be attached again afterwards
+    """
+    prev = getattr(_local, 'trace', None)
+    _local.trace = trace
+
+    return prev
+
+def span(name: str):
+    """
+    Returns a context manager that records a span of the current trace.
+
+    Inputs:
+        name (str) - Name of the stage
+    """
+    trace = getattr(_local, 'trace', None)
+    if (trace == None):
+        return _NULL_SPAN
+
+    return _Span(trace, name)
+
+def add_span(name: str, t_start: float, t_end: float=None):
+    """
+    Records a span of the current trace from timestamps taken earlier, i.e.
+    the time a request spent in a queue.
+
+    Inputs:
+        name    (str)             - Name of the stage
+        t_start (float)           - time.monotonic() at the start
+        t_end   (optional, float) - time.monotonic() at the end. Defaults to now
+    """
+    trace = getattr(_local, 'trace', None)
+    if (trace != None):
+        if (t_end == None): t_end = time.monotonic()
+        trace.add(name, t_start, t_end)
+
+    return
+
+def _write(path: str):
+    """
+    Writer thread. Appends the finished traces to the trace file.
+    """
+    func_id = f'{__name__}._write'
+    pmsg = Psi_Message()
+
+    with open(path, 'a') as file:
+        while True:
+            line = _queue.get()
+            try:
+                file.write(line + '\n')
+                if (_queue.empty()):
+                    file.flush()
+            except OSError as exc:
+                pmsg.error(func_id, f'Failed to write {path}: {exc}')
+
+    return
+
+def summarize(path: str, cmd: str=None) -> dict:
+    """
+    Summarizes a trace file.
+
+    Inputs:
+        path (str)           - Trace file
+        cmd  (optional, str) - Only summarize the traces of this command
+
+    Returns:
+        dict - {cmd: {"n": traces, "total": [us], stage: [us], ...}}
+    """
+    stats = collections.defaultdict(lambda: collections.defaultdict(list))
+    with open(path) as file:
+        for line in file:
+            try:
+                trace = json.loads(line)
+            except ValueError:
+                continue
+
+            name = trace["cmd"].split()[0]
+            if ((cmd != None) and (name != cmd)):
+                continue
+
+            stats[name]["total"].append(trace["total"])
+            stages = collections.Counter()
+            for stage, start, dur in trace["spans"]:
+                stages[stage] += dur
+            for stage, dur in stages.items():
+                stats[name][stage].append(dur)
+
+    return stats
+
+def print_summary(stats: dict):
+    """
+    Prints the latency of each stage per command. "share" is the mean time of
+    the stage over the mean total time of the command.
+    """
+    for name, stages in sorted(stats.items()):
+        totals = sorted(stages["total"])
+        mean_total = max(sum(totals)/len(totals), 1e-9)
+        print(f'{name}  ({len(totals)} requests)')
+        print(f'  {"stage":<16}{"n":>8}{"mean ms":>10}{"p50 ms":>10}'
+              f'{"p99 ms":>10}{"share":>8}')
+
+        for stage, samples in stages.items():
+            samples = sorted(samples)
+            mean = sum(samples)/len(samples)
+            print(f'  {stage:<16}{len(samples):>8}{mean/1000.0:>10.3f}'
+                  f'{percentile(samples, 50.0)/1000.0:>10.3f}'
+                  f'{percentile(samples, 99.0)/1000.0:>10.3f}'
+                  f'{100.0*mean*len(samples)/(mean_total*len(totals)):>7.1f}%')
+
+    return
+
+def print_slowest(path: str, num: int):
+    """
+    Prints the spans of the slowest traces of a trace file.
+    """
+    # A line may be cut off (a driver that is still running or was killed),
+    # it is skipped as in summarize
+    traces = []
+    with open(path) as file:
+        for line in file:
+            try:
+                traces.append(json.loads(line))
+            except ValueError:
+                continue
+
+    for trace in sorted(traces, key=lambda trace: trace["total"])[-num:]:
+        spans = ' '.join(f'{stage}@{start}+{dur}'
+                         for stage, start, dur in trace["spans"])
+        print(f'#{trace["id"]} {trace["cmd"]} {trace["total"]} us: {spans}')
+
+    return
+
+def main():
+    import argparse
+
+    descript = '''Summarizes the request traces written by the RF generator
+                  driver (--TRACE)'''
+    fil_help = '''Trace file'''
+    cmd_help = '''Only summarize this command (i.e. GETRFLPWR?)'''
+    slo_help = '''Also print the spans of the N slowest requests'''
+
+    parser = argparse.ArgumentParser(description = descript)
+    parser.add_argument('FILE', help = fil_help)
+    parser.add_argument('-c', '--cmd', help = cmd_help, default = None)
+    parser.add_argument('-s', '--slowest', help = slo_help, type = int,
+                        default = 0)
+
+    # Create list of keys to the args dictionary
+    args = parser.parse_args().__dict__
+
+    print_summary(summarize(args['FILE'], args['cmd']))
+    if (args['slowest'] > 0):
+        print_slowest(args['FILE'], args['slowest'])
+
+    return
+
+######################################### main ###########################################
+if (__name__ == '__main__'):
+    main()